@@ -12,8 +12,85 @@ com conjuntos de funções específicas para tais simulações e extrações de
 informação.
 """
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
-from process_spectra.funcs import load_from_optisystem
+from process_spectra.funcs import guard_step, load_spectrum
+from process_spectra.funcs._context import spectrum_context
+from process_spectra.utils.budget import BudgetExceeded, time_budget
+
+
+def _apply_step(step, kwargs, budget, spectrum, info, c=0):
+    """
+    Aplica um passo, respeitando o limite e o fallback dele (ver
+    MassSpectraData.add_step)
+
+    :return: O espectro e o dicionário retornados pelo passo
+    :rtype: (np.ndarray, dict)
+    """
+    if budget is None:
+        return step(spectrum, info, **kwargs)
+
+    label = getattr(step, '__name__', f'step{c}')
+    start = time.perf_counter()
+    path = 'primary'
+
+    try:
+        with time_budget(budget['max_time'], budget['max_evaluations']):
+            spectrum, _info = step(spectrum, info, **kwargs)
+
+        # Um passo que não chama o check_budget roda até o fim, então o
+        # tempo só é verificado depois
+        if budget['max_time'] is not None and \
+                time.perf_counter() - start > budget['max_time']:
+            path = 'over_budget'
+    except BudgetExceeded:
+        if budget['fallback'] is None:
+            raise
+        path = 'fallback'
+        spectrum, _info = budget['fallback'](spectrum, info,
+                                             **budget['fallback_kwargs'])
+
+    if _info is None:
+        return spectrum, None
+
+    _info = {**_info, f'{label}_path': path,
+             f'{label}_time': time.perf_counter() - start}
+
+    return spectrum, _info
+
+
+def _process_file(pipeline, filename, load_kwargs):
+    """
+    Carrega um espectro e aplica os passos (ver
+    MassSpectraData.process_file). É uma função do módulo, e não um método,
+    para o aiter_results enviar para o executor só o pipeline (a função de
+    carregamento, os passos, os argumentos e os limites), sem o self.df e
+    os sinks
+
+    :param pipeline: A tupla (load_function, steps, kwargs, budgets)
+    :type pipeline: tuple
+
+    :return: O espectro final e o dicionário com as informações
+    :rtype: (np.ndarray, dict)
+    """
+    load_function, steps, kwargs, budgets = pipeline
+    spectrum, info = load_function(filename, **load_kwargs)
+
+    with spectrum_context():
+        for c in range(len(steps)):
+            if spectrum is None:
+                break
+
+            spectrum, _info = _apply_step(steps[c], kwargs[c], budgets[c],
+                                          spectrum, info, c)
+            if _info is None:
+                return None, None
+            info = {**info, **_info}
+
+    return spectrum, info
 
 
 class MassSpectraData:
@@ -31,26 +108,35 @@ class MassSpectraData:
 
         :param out_filename: O arquivo de saída
         :type out_filename: str
+
+        :param load_function: A função de carregamento dos espectros. Por
+            padrão é o funcs.load_spectrum, que detecta o formato de cada
+            arquivo (optisystem, optigrating ou outro registrado com
+            funcs.register_loader)
+        :type load_function: function
         """
         self.filenames = list(filenames)
-        self.load_spectrum = load_function or load_from_optisystem
+        self.load_spectrum = load_function or load_spectrum
         self.out_filename = out_filename
         self.quiet = quiet
 
         self.steps = list()
         self.kwargs = list()
+        self.sinks = list()
+        self.budgets = list()
 
         self.df = pd.DataFrame(columns=['name', ])
 
-    def add_step(self, step, kwargs=None):
+    def add_step(self, step, kwargs=None, max_time=None, max_evaluations=None,
+                 fallback=None, fallback_kwargs=None):
         """
         Adiciona uma função para ser aplicada à todos os espectros, com os
         argumentos definidos no dicionário kwargs. Se a função tiver
         argumentos obrigatórios, esses devem estar inclusos no kwargs.
 
-        :param step: A função a ser adicionada. Deve aceitar um objeto da
-            classe SpectrumData como primeiro argumento ou ser uma função da
-            classe.
+        :param step: A função a ser adicionada. Deve aceitar o espectro
+            (np.ndarray (n, 2)) e o dicionário de informações como primeiros
+            argumentos e retornar o espectro e um dicionário.
         :type step: Uma função
 
         :param kwargs: Um dicionário contendo pares com a key sendo uma str
@@ -58,40 +144,311 @@ class MassSpectraData:
             argumento.
         :type kwargs: dict, optional
 
+        :param max_time: O tempo máximo do passo por espectro, em segundos.
+            Os passos caros verificam esse limite nos seus laços (ver
+            utils.budget) e, se ele acabar, o fallback é usado. Um passo que
+            não verifica o limite roda até o fim, e se passar do tempo fica
+            marcado como 'over_budget' (ver fallback)
+        :type max_time: float, optional
+
+        :param max_evaluations: O número máximo de avaliações do passo por
+            espectro (por exemplo, as avaliações da função no curve_fit do
+            get_approximate_valley). Só vale para os passos que contam as
+            avaliações com o check_budget
+        :type max_evaluations: int, optional
+
+        :param fallback: Um passo mais barato usado no lugar desse quando o
+            limite acabar. Sem fallback, o BudgetExceeded é levantado. Se
+            tiver limite ou fallback, o dicionário ganha
+            '<nome do passo>_path' ('primary', 'fallback' ou 'over_budget')
+            e '<nome do passo>_time' (em segundos)
+        :type fallback: function, optional
+
+        :param fallback_kwargs: Os argumentos do fallback
+        :type fallback_kwargs: dict, optional
+
         :return: None
         """
         self.steps.append(step)
         kwargs = kwargs or dict()
         self.kwargs.append(kwargs)
 
-    def run(self, quiet=False, **load_kwargs):
+        if max_time is None and max_evaluations is None and fallback is None:
+            self.budgets.append(None)
+        else:
+            self.budgets.append({'max_time': max_time,
+                                 'max_evaluations': max_evaluations,
+                                 'fallback': fallback,
+                                 'fallback_kwargs': fallback_kwargs or dict()})
+
+    def add_guard(self, predicate, kwargs=None, reason=None):
         """
-        Aplica todas as funções em self.steps a todos os espectros (um por
-        vez).  Ao finalizar as funções de um espectro, tenta passar as
-        informações definidas no self.columns para o dataframe do objeto.
-        Salva checkpoints a cada intervalo de self.batch_size e um último
-        no final.
+        Adiciona um passo de guarda (ver funcs.guard_step): se o predicado
+        retornar False, os passos seguintes não rodam para esse espectro, a
+        coluna 'rejected' fica com o motivo e o dicionário de informações não
+        tem as chaves dos passos seguintes (no self.df, essas colunas ficam
+        NaN). Serve para não gastar os passos caros (como ajustes e
+        simulações) em espectros inúteis
+
+        :param predicate: Uma função predicate(spectrum, info, **kwargs) que
+            retorna True se o espectro deve continuar (como
+            funcs.valley_found e funcs.channel_alive)
+        :type predicate: function
+
+        :param kwargs: Os argumentos do predicado
+        :type kwargs: dict, optional
+
+        :param reason: O motivo registrado. Por padrão é o nome do predicado
+        :type reason: str, optional
 
         :return: None
         """
+        self.add_step(guard_step(predicate, reason), kwargs)
+
+    def add_sink(self, sink):
+        """
+        Adiciona um sink, que recebe o dicionário de informações de cada
+        espectro assim que ele fica pronto (no iter_results, no
+        aiter_results e no run). Serve para acompanhar os resultados sem
+        guardar a tabela inteira (ver aggregate.OnlineAggregator)
+
+        :param sink: Uma função (ou objeto chamável) que recebe o dicionário
+        :type sink: function
 
+        :return: O próprio sink
+        """
+        self.sinks.append(sink)
+        return sink
+
+    @property
+    def _pipeline(self):
+        return self.load_spectrum, self.steps, self.kwargs, self.budgets
+
+    def process_file(self, filename, **load_kwargs):
+        """
+        Carrega um espectro e aplica todas as funções em self.steps nele
+
+        :param filename: O nome do arquivo do espectro
+        :type filename: str
+
+        :param load_kwargs: Os argumentos da função de carregamento
+
+        Um passo que retorna o espectro None encerra o processamento desse
+        espectro (os passos seguintes não rodam), e um passo que retorna
+        (None, None) descarta o espectro, sem linha no resultado (como o
+        funcs.coadd.SpectrumAverager enquanto a janela não está cheia)
+
+        Os passos rodam dentro de um contexto do espectro, onde resultados
+        intermediários (como os vales achados pelo find_valley) ficam em
+        cache para os passos seguintes
+
+        :return: O espectro final (None se não carregou) e o dicionário com
+            as informações (None se foi descartado)
+        :rtype: (np.ndarray, dict)
+        """
+        return _process_file(self._pipeline, filename, load_kwargs)
+
+    def iter_results(self, return_spectrum=False, quiet=False,
+                     **load_kwargs):
+        """
+        Processa os espectros um por vez, entregando o resultado de cada um
+        assim que fica pronto. Nada é guardado no self.df, então a memória
+        não cresce com o número de arquivos, e o laço pode ser interrompido
+        a qualquer momento
+
+        :param return_spectrum: Se deve entregar também o espectro final
+        :type return_spectrum: bool
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+
+        :param load_kwargs: Os argumentos da função de carregamento
+
+        :return: Um gerador com o dicionário de informações de cada espectro,
+            ou tuplas (info, spectrum) se return_spectrum for True
+        :rtype: generator
+        """
         for i, filename in enumerate(self.filenames):
             if not quiet:
                 padding = 5 * "-"
                 print(f'\n{padding}calculando {i + 1}/'
                       f'{len(self.filenames)}{padding}')
 
-            spectrum, info = self.load_spectrum(self.filenames[i], **load_kwargs)
+            spectrum, info = self.process_file(filename, **load_kwargs)
+            if info is None:
+                continue
+            for sink in self.sinks:
+                sink(info)
+
+            yield (info, spectrum) if return_spectrum else info
+
+    def run(self, quiet=False, store=True, **load_kwargs):
+        """
+        Aplica todas as funções em self.steps a todos os espectros (um por
+        vez).  Ao finalizar as funções de um espectro, tenta passar as
+        informações definidas no self.columns para o dataframe do objeto.
+        Salva checkpoints a cada intervalo de self.batch_size e um último
+        no final. Se os passos colocarem um 'timestamp' no dicionário (ver
+        funcs.set_timestamp), o dataframe fica ordenado e indexado por ele.
+        Para consumir os resultados sem guardar tudo, ver iter_results
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+
+        :param store: Se deve guardar os resultados no self.df. Se for
+            False, os resultados só passam pelos sinks (ver add_sink)
+        :type store: bool
+
+        :return: None
+        """
+        if not store:
+            for _ in self.iter_results(quiet=quiet, **load_kwargs):
+                pass
+            return
+
+        rows = list(self.iter_results(quiet=quiet, **load_kwargs))
+        self._store(rows)
+
+    async def aiter_results(self, return_spectrum=False, concurrency=4,
+                            executor=None, quiet=False, **load_kwargs):
+        """
+        Versão assíncrona do iter_results, para usar dentro de um event loop
+        do asyncio sem bloqueá-lo. O carregamento e os passos de cada arquivo
+        rodam no executor, com no máximo concurrency arquivos ao mesmo tempo,
+        e os resultados são entregues conforme ficam prontos (não
+        necessariamente na ordem dos arquivos). Se o laço for interrompido
+        ou a tarefa for cancelada, os arquivos que ainda não começaram são
+        cancelados e os que estão rodando terminam antes do gerador fechar.
+        Para o gerador fechar logo depois de um break, use o
+        contextlib.aclosing (ou chame o aclose)
+
+        :param return_spectrum: Se deve entregar também o espectro final
+        :type return_spectrum: bool
+
+        :param concurrency: O número máximo de arquivos processando ao mesmo
+            tempo
+        :type concurrency: int
+
+        :param executor: O executor (concurrent.futures) onde rodar os
+            arquivos. Para passos que usam muita CPU, um ProcessPoolExecutor
+            (a função de carregamento, os passos e os argumentos devem poder
+            ser enviados com pickle; o resto do objeto não é enviado). Se
+            for None, usa um ThreadPoolExecutor com concurrency threads
+        :type executor: concurrent.futures.Executor
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+
+        :param load_kwargs: Os argumentos da função de carregamento
 
-            if spectrum is not None:
-                for c, step in enumerate(self.steps):
-                    spectrum, _info = step(spectrum, info, **self.kwargs[c])
-                    info = {**info, **_info}
+        :return: Um gerador assíncrono com o dicionário de informações de
+            cada espectro, ou tuplas (info, spectrum) se return_spectrum for
+            True
+        :rtype: async generator
+
+        :raises ValueError: Se algum passo tiver estado (como o
+            funcs.coadd.SpectrumAverager) e os arquivos não forem processados
+            um por vez no próprio processo (concurrency 1, sem executor)
+        """
+        stateful = [getattr(step, '__name__', step) for step in self.steps
+                    if getattr(step, 'stateful', False)]
+        if stateful and (concurrency > 1 or executor is not None):
+            raise ValueError(f'Os passos {stateful} dependem da ordem dos '
+                             f'espectros. Use o iter_results ou '
+                             f'concurrency=1 sem executor')
+
+        loop = asyncio.get_running_loop()
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        filenames = iter(self.filenames)
+        pipeline = self._pipeline
+        pending = dict()        # future do asyncio -> future do executor
+        done_count = 0
+
+        def submit():
+            for filename in filenames:
+                work = executor.submit(_process_file, pipeline, filename,
+                                       load_kwargs)
+                pending[asyncio.wrap_future(work, loop=loop)] = work
+                if len(pending) >= concurrency:
+                    break
+
+        try:
+            submit()
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for future in done:
+                    del pending[future]
+                    spectrum, info = future.result()
+
+                    done_count += 1
+                    if not quiet:
+                        padding = 5 * "-"
+                        print(f'\n{padding}calculado {done_count}/'
+                              f'{len(self.filenames)}{padding}')
+
+                    if info is None:
+                        continue
+                    for sink in self.sinks:
+                        sink(info)
+
+                    yield (info, spectrum) if return_spectrum else info
+
+                submit()
+        finally:
+            # Cancela o que não começou e espera o que já está rodando
+            running = [work for work in pending.values() if not work.cancel()]
+            try:
+                if running:
+                    await asyncio.wait([asyncio.wrap_future(work, loop=loop)
+                                        for work in running])
+            finally:
+                if own_executor:
+                    executor.shutdown(wait=False)
+
+    async def arun(self, concurrency=4, executor=None, quiet=False,
+                   **load_kwargs):
+        """
+        Versão assíncrona do run: processa todos os espectros com o
+        aiter_results e guarda o resultado no self.df da mesma forma
+
+        :param concurrency: O número máximo de arquivos processando ao mesmo
+            tempo
+        :type concurrency: int
+
+        :param executor: O executor onde rodar os arquivos (ver
+            aiter_results)
+        :type executor: concurrent.futures.Executor
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+
+        :return: None
+        """
+        rows = [info async for info in self.aiter_results(
+            concurrency=concurrency, executor=executor, quiet=quiet,
+            **load_kwargs)]
+        self._store(rows)
+
+    def _store(self, rows):
+        """
+        Junta as linhas ao self.df, ordena pelo 'timestamp' (se tiver) e
+        exporta o csv, como no fim do run
+
+        :return: None
+        """
+        self.df = pd.concat([self.df, pd.DataFrame(rows)],
+                            ignore_index=True,
+                            axis=0, join='outer')
 
-            info_df = pd.DataFrame(info, index=[0, ])
-            self.df = pd.concat([self.df, info_df],
-                                ignore_index=True,
-                                axis=0, join='outer')
+        if 'timestamp' in self.df.columns:
+            self.df = self.df.sort_values('timestamp')
+            self.df.index = pd.DatetimeIndex(self.df['timestamp'],
+                                             name='time')
 
         if self.out_filename:
             self.export_csv(self.out_filename)
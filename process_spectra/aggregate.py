@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Esse módulo calcula estatísticas dos resultados do MassSpectraData conforme
+os espectros são processados, sem guardar a tabela inteira: média e
+variância (algoritmo de Welford), mínimo e máximo de cada coluna numérica,
+a inclinação (deriva) de algumas colunas ao longo do tempo e histogramas. A
+memória não cresce com o número de espectros, e agregadores de processos ou
+lotes diferentes podem ser juntados com o merge.
+"""
+
+import numbers
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+class _Moments:
+    """Contagem, média, soma dos quadrados dos desvios, mínimo e máximo"""
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+class _Drift:
+    """Os momentos de (x, y) de uma regressão linear, no estilo do Welford"""
+    __slots__ = ('count', 'mean_x', 'mean_y', 'm2_x', 'c_xy')
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.
+        self.mean_y = 0.
+        self.m2_x = 0.
+        self.c_xy = 0.
+
+    def update(self, x, y):
+        self.count += 1
+        dx = x - self.mean_x
+        self.mean_x += dx / self.count
+        self.mean_y += (y - self.mean_y) / self.count
+        self.m2_x += dx * (x - self.mean_x)
+        self.c_xy += dx * (y - self.mean_y)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        weight = self.count * other.count / count
+        self.mean_x += dx * other.count / count
+        self.mean_y += dy * other.count / count
+        self.m2_x += other.m2_x + dx ** 2 * weight
+        self.c_xy += other.c_xy + dx * dy * weight
+        self.count = count
+
+    @property
+    def slope(self):
+        return self.c_xy / self.m2_x if self.m2_x > 0 else np.nan
+
+
+class OnlineAggregator:
+    """
+    Um sink para o MassSpectraData (ver MassSpectraData.add_sink) que
+    mantém estatísticas das colunas dos resultados, atualizadas a cada
+    espectro
+    """
+    def __init__(self, columns=None, drift_columns=('resonant_wl',
+                                                    'max_power'),
+                 histograms=None, time_column='timestamp'):
+        """
+        Inicia o agregador
+
+        :param columns: As colunas acompanhadas. Se for None, acompanha
+            todas as colunas numéricas que aparecerem
+        :type columns: list
+
+        :param drift_columns: As colunas em que a inclinação ao longo do
+            tempo é calculada
+        :type drift_columns: list
+
+        :param histograms: Um dicionário com o nome da coluna e os limites
+            das classes do histograma (como no np.histogram). Os valores fora
+            dos limites são contados à parte
+        :type histograms: dict
+
+        :param time_column: A coluna com o instante de cada espectro (ver
+            funcs.set_timestamp) ou outro eixo comum a todos os agregadores
+            (como o 'sequence' da interrogation). A inclinação é por segundo
+            se a coluna for um datetime, ou por unidade da coluna se for um
+            número. Os espectros sem essa coluna não entram na deriva, para
+            agregadores juntados com o merge terem o mesmo eixo
+        :type time_column: str
+        """
+        self.columns = None if columns is None else set(columns)
+        self.drift_columns = tuple(drift_columns)
+        self.time_column = time_column
+
+        self.moments = dict()
+        self.drifts = {column: _Drift() for column in self.drift_columns}
+        self.histograms = {
+            column: (np.asarray(edges, dtype=np.float64),
+                     np.zeros(len(edges) + 1, dtype=np.int64))
+            for column, edges in (histograms or dict()).items()}
+
+        self.count = 0
+
+    def __call__(self, info):
+        self.update(info)
+
+    def _time(self, info):
+        timestamp = info.get(self.time_column)
+        if isinstance(timestamp, datetime):
+            return timestamp.timestamp()
+        if isinstance(timestamp, numbers.Real) and \
+                not isinstance(timestamp, bool):
+            return float(timestamp)
+        return None
+
+    def update(self, info):
+        """
+        Atualiza as estatísticas com o resultado de um espectro
+
+        :param info: O dicionário de informações do espectro
+        :type info: dict
+
+        :return: None
+        """
+        x = self._time(info)
+        self.count += 1
+
+        for column, value in info.items():
+            if self.columns is not None and column not in self.columns:
+                continue
+            if isinstance(value, bool) or \
+                    not isinstance(value, numbers.Real) or np.isnan(value):
+                continue
+
+            moments = self.moments.get(column)
+            if moments is None:
+                moments = self.moments[column] = _Moments()
+            moments.update(value)
+
+            if column in self.drifts and x is not None:
+                self.drifts[column].update(x, value)
+
+            if column in self.histograms:
+                edges, counts = self.histograms[column]
+                # A última classe inclui o limite superior, como no histogram
+                index = len(edges) - 1 if value == edges[-1] else \
+                    np.searchsorted(edges, value, side='right')
+                counts[index] += 1
+
+    def merge(self, other):
+        """
+        Junta as estatísticas de outro agregador (de outro processo ou lote)
+        neste. Os dois devem ter os mesmos limites de histograma
+
+        :param other: O outro agregador
+        :type other: OnlineAggregator
+
+        :return: O próprio agregador
+        :rtype: OnlineAggregator
+        """
+        for column, moments in other.moments.items():
+            self.moments.setdefault(column, _Moments()).merge(moments)
+
+        for column, drift in other.drifts.items():
+            self.drifts.setdefault(column, _Drift()).merge(drift)
+
+        for column, (edges, counts) in other.histograms.items():
+            if column not in self.histograms:
+                self.histograms[column] = (edges.copy(), counts.copy())
+            elif not np.array_equal(self.histograms[column][0], edges):
+                raise ValueError(f'Os histogramas de {column} têm limites '
+                                 f'diferentes')
+            else:
+                self.histograms[column][1][:] += counts
+
+        self.count += other.count
+        return self
+
+    def snapshot(self):
+        """
+        Retorna as estatísticas atuais
+
+        :return: Uma tabela indexada pela coluna, com count, mean, var,
+            std, min, max e drift_slope (NaN nas colunas sem deriva)
+        :rtype: pd.DataFrame
+        """
+        rows = dict()
+        for column, moments in self.moments.items():
+            var = moments.m2 / (moments.count - 1) if moments.count > 1 \
+                else np.nan
+            drift = self.drifts.get(column)
+            rows[column] = {
+                'count': moments.count,
+                'mean': moments.mean,
+                'var': var,
+                'std': np.sqrt(var),
+                'min': moments.min,
+                'max': moments.max,
+                'drift_slope': np.nan if drift is None else drift.slope}
+
+        return pd.DataFrame.from_dict(
+            rows, orient='index',
+            columns=['count', 'mean', 'var', 'std', 'min', 'max',
+                     'drift_slope'])
+
+    def histogram(self, column):
+        """
+        Retorna o histograma de uma coluna
+
+        :param column: O nome da coluna
+        :type column: str
+
+        :return: As contagens de cada classe, os limites das classes e as
+            contagens abaixo e acima dos limites
+        :rtype: (np.ndarray, np.ndarray, int, int)
+        """
+        edges, counts = self.histograms[column]
+        return counts[1:-1].copy(), edges.copy(), counts[0], counts[-1]
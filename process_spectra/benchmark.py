@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Esse módulo compara os estimadores do vale ressonante em espectros
+sintéticos, com o vale em uma posição conhecida. Para cada estimador e nível
+de ruído, mede a vazão (espectros por segundo), o viés e o erro RMS da
+posição, para escolher o estimador mais barato que atende à precisão
+necessária.
+"""
+
+import inspect
+import time
+
+import numpy as np
+import pandas as pd
+
+from process_spectra.funcs import find_valley, get_approximate_valley
+from process_spectra.utils import gauss, lorentz
+
+
+FWHM_TO_SIGMA = 1 / (2 * np.sqrt(2 * np.log(2)))
+
+
+def synthetic_spectra(n_spectra, model='lorentz', wl_limits=(1500, 1600),
+                      wl_step=0.05, depth=15, fwhm=3, baseline=-40,
+                      noise=0.05, center_range=None, seed=None):
+    """
+    Gera espectros (em dB) com um vale de formato conhecido, em posições
+    aleatórias, com ruído gaussiano
+
+    :param n_spectra: O número de espectros
+    :type n_spectra: int
+
+    :param model: O formato do vale: 'lorentz' ou 'gauss' (usa as funções
+        do utils)
+    :type model: str
+
+    :param wl_limits: Os limites do grid
+    :type wl_limits: (float, float)
+
+    :param wl_step: O passo do grid
+    :type wl_step: float
+
+    :param depth: A profundidade do vale, em dB
+    :type depth: float
+
+    :param fwhm: A largura do vale (FWHM)
+    :type fwhm: float
+
+    :param baseline: O nível fora do vale, em dB
+    :type baseline: float
+
+    :param noise: O desvio padrão do ruído, em dB
+    :type noise: float
+
+    :param center_range: O intervalo das posições dos vales. Por padrão é o
+        terço central do grid
+    :type center_range: (float, float)
+
+    :param seed: A semente do gerador
+    :type seed: int
+
+    :return: Os espectros (shape (m, n, 2)) e as posições verdadeiras dos
+        vales
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    rng = np.random.default_rng(seed)
+
+    wl = np.arange(wl_limits[0], wl_limits[1], wl_step)
+    if center_range is None:
+        span = wl_limits[1] - wl_limits[0]
+        center_range = (wl_limits[0] + span / 3, wl_limits[1] - span / 3)
+    centers = rng.uniform(*center_range, size=n_spectra)
+
+    if model == 'lorentz':
+        powers = lorentz(wl[None, :], -depth, centers[:, None], fwhm,
+                         baseline)
+    elif model == 'gauss':
+        powers = gauss(wl[None, :], -depth, centers[:, None],
+                       fwhm * FWHM_TO_SIGMA, baseline)
+    else:
+        raise ValueError(f'{model} é um modelo inválido, os implementados '
+                         f'são "lorentz" e "gauss"')
+
+    if noise:
+        powers = powers + rng.normal(0, noise, powers.shape)
+
+    spectra = np.empty(powers.shape + (2, ))
+    spectra[..., 0] = wl
+    spectra[..., 1] = powers
+
+    return spectra, centers
+
+
+def default_estimators(fwhm=3, prominence=5):
+    """
+    Os estimadores comparados por padrão: o ponto do grid, os estimadores em
+    forma fechada do find_valley e os ajustes do get_approximate_valley com
+    a lorentziana e a gaussiana
+
+    :param fwhm: A largura esperada do vale, usada na janela dos ajustes
+    :type fwhm: float
+
+    :param prominence: A proeminência mínima dos vales
+    :type prominence: float
+
+    :return: Um dicionário com o nome e o par (passo, kwargs) de cada um
+    :rtype: dict
+    """
+    estimators = {'grid': (find_valley, {'prominence': prominence})}
+
+    for name in ['parabolic', 'gaussian', 'centroid', 'lorentz']:
+        estimators[name] = (find_valley, {'prominence': prominence,
+                                          'estimator': name})
+
+    for name, function in [('fit_lorentz', lorentz), ('fit_gauss', gauss)]:
+        estimators[name] = (get_approximate_valley,
+                            {'approx_func': function,
+                             'prominence': prominence, 'dwl': fwhm})
+
+    return estimators
+
+
+def _resonant_wl(info):
+    if info.get('resonant_wl') is not None:
+        return info['resonant_wl']
+    if 'best_index' in info:
+        return info.get(f"resonant_wl_{info['best_index']}")
+    return None
+
+
+def run_estimator(step, kwargs, spectra):
+    """
+    Roda um estimador em todos os espectros
+
+    :param step: O passo (find_valley, get_approximate_valley ou outro que
+        preencha o 'resonant_wl')
+    :type step: function
+
+    :param kwargs: Os argumentos do passo
+    :type kwargs: dict
+
+    :param spectra: Os espectros
+    :type spectra: np.ndarray
+
+    :return: As posições estimadas (NaN onde falhou) e o tempo total, em
+        segundos
+    :rtype: (np.ndarray, float)
+    """
+    estimates = np.full(len(spectra), np.nan)
+
+    start = time.perf_counter()
+    for i, spectrum in enumerate(spectra):
+        try:
+            _, info = step(spectrum, {'name': f'synthetic_{i}'}, **kwargs)
+        except Exception:
+            continue
+
+        wl = _resonant_wl(info)
+        if wl is not None:
+            estimates[i] = wl
+    elapsed = time.perf_counter() - start
+
+    return estimates, elapsed
+
+
+def benchmark(estimators=None, noise_levels=(0.01, 0.05, 0.2),
+              n_spectra=100, model='lorentz', fwhm=3, seed=None,
+              **synthetic_kwargs):
+    """
+    Compara os estimadores em espectros sintéticos
+
+    :param estimators: Um dicionário com o nome e o par (passo, kwargs) de
+        cada estimador. Se for None, usa o default_estimators
+    :type estimators: dict
+
+    :param noise_levels: Os desvios padrão do ruído testados, em dB
+    :type noise_levels: list
+
+    :param n_spectra: O número de espectros por nível de ruído
+    :type n_spectra: int
+
+    :param model: O formato do vale sintético ('lorentz' ou 'gauss')
+    :type model: str
+
+    :param fwhm: A largura do vale sintético
+    :type fwhm: float
+
+    :param seed: A semente do gerador, para os resultados serem
+        reproduzíveis
+    :type seed: int
+
+    :param synthetic_kwargs: Outros argumentos do synthetic_spectra
+
+    :return: Uma tabela com uma linha por nível de ruído e estimador, com
+        as colunas noise, estimator, spectra_per_second, bias, rms,
+        max_error e failures (o erro é estimado - verdadeiro)
+    :rtype: pd.DataFrame
+    """
+    if estimators is None:
+        estimators = default_estimators(fwhm)
+
+    rows = list()
+    for k, noise in enumerate(noise_levels):
+        spectra, centers = synthetic_spectra(
+            n_spectra, model, fwhm=fwhm, noise=noise,
+            seed=None if seed is None else seed + k, **synthetic_kwargs)
+
+        for name, (step, kwargs) in estimators.items():
+            if 'quiet' in inspect.signature(step).parameters:
+                kwargs = {'quiet': True, **kwargs}
+            estimates, elapsed = run_estimator(step, kwargs, spectra)
+
+            errors = estimates - centers
+            valid = errors[np.isfinite(errors)]
+
+            rows.append({
+                'noise': noise,
+                'estimator': name,
+                'spectra_per_second': len(spectra) / elapsed,
+                'bias': valid.mean() if len(valid) else np.nan,
+                'rms': np.sqrt(np.mean(valid ** 2)) if len(valid) else np.nan,
+                'max_error': np.abs(valid).max() if len(valid) else np.nan,
+                'failures': len(errors) - len(valid)})
+
+    return pd.DataFrame(rows)
+
+
+def cheapest_estimator(results, max_rms):
+    """
+    Escolhe o estimador mais rápido com erro RMS abaixo do limite em todos
+    os níveis de ruído testados
+
+    :param results: A tabela retornada pelo benchmark
+    :type results: pd.DataFrame
+
+    :param max_rms: O erro RMS máximo aceito
+    :type max_rms: float
+
+    :return: O nome do estimador, ou None se nenhum atender
+    :rtype: str
+    """
+    summary = results.groupby('estimator').agg(
+        rms=('rms', 'max'), failures=('failures', 'sum'),
+        spectra_per_second=('spectra_per_second', 'min'))
+    summary = summary[(summary['rms'] <= max_rms) &
+                      (summary['failures'] == 0)]
+
+    if summary.empty:
+        return None
+    return summary['spectra_per_second'].idxmax()
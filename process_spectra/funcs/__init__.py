@@ -3,14 +3,25 @@ Esse módulo contêm as funções usadas no processo de análise, seja as de
 carregamento, de extração ou filtragem do espectro
 """
 
+import inspect
 import os
+from datetime import datetime
+from functools import lru_cache, wraps
+
 import numpy as np
 from process_spectra.utils import lorentz
-from scipy import signal as sg
 from scipy.interpolate import interp1d
 from scipy.optimize import curve_fit
 from matplotlib import pyplot as plt
 from process_spectra import utils
+from process_spectra.funcs import _context
+from process_spectra.funcs.render import decimate_trace
+from process_spectra.utils.budget import check_budget, has_budget
+from process_spectra.utils.correlation import cross_correlation_shift
+from process_spectra.utils.references import resolve_reference
+from process_spectra.utils.savgol import savgol_filter
+from process_spectra.utils.spectrum import Spectrum, WavelengthGrid
+from process_spectra.utils.valley import estimate_valley
 
 
 def load_from_optisystem(filename,
@@ -19,7 +30,8 @@ def load_from_optisystem(filename,
                          wl_multiplier=1,
                          dtype=np.float64,
                          ignore_errors=False,
-                         name_function=None):
+                         name_function=None,
+                         skip_rows=0):
     """
     Carrega o espectro e retorna o espectro (np array, comprimentos de onda e
     potência) e o dicionário com o nome extraído
@@ -57,6 +69,10 @@ def load_from_optisystem(filename,
         Por padrão, o nome é extraído como o nome do arquivo sem extensões.
     :type name_function: function
 
+    :param skip_rows: Quantas linhas de cabeçalho ignorar no início do
+        arquivo. 0 por padrão
+    :type skip_rows: int
+
     :return: um np array 2d com os valores (comprimentos de onda e
         potência) e o dicionário com o nome extraído
     :rtype: (np.ndarray, dict)
@@ -69,22 +85,13 @@ def load_from_optisystem(filename,
     if not quiet:
         print(f'Carregando {info["name"]}')
 
-    def conv(text):
-        text = text.replace(b'E', b'e')
-        text = text.replace(b',', b'.')
-        return float(text)
-
     if ignore_errors:
         try:
-            spectrum = np.loadtxt(filename, dtype=dtype,
-                                  converters={0: conv, 1: conv},
-                                  delimiter=delimiter)
+            spectrum = read_columns(filename, delimiter, 2, dtype, skip_rows)
         except ValueError:
             return None, info
     else:
-        spectrum = np.loadtxt(filename, dtype=dtype,
-                              converters={0: conv, 1: conv},
-                              delimiter=delimiter)
+        spectrum = read_columns(filename, delimiter, 2, dtype, skip_rows)
 
     if spectrum[0, 0] > spectrum[-1, 0]:
         spectrum = spectrum[::-1]
@@ -94,7 +101,13 @@ def load_from_optisystem(filename,
     return spectrum, info
 
 
-def load_from_optigrating(filename, quiet=False):
+def load_from_optigrating(filename,
+                          quiet=False,
+                          delimiter=' ',
+                          wl_multiplier=1e-6,
+                          ignore_errors=False,
+                          name_function=None,
+                          skip_rows=0):
     """Função para carregar o espectro de transmitância do arquivo do
     optigrating.
 
@@ -104,30 +117,258 @@ def load_from_optigrating(filename, quiet=False):
     :param quiet: Se o programa deve printar o progresso
     :type quiet: bool
 
+    :param delimiter: O delimitador entre as três colunas (comprimento de
+        onda, parte real e parte imaginária). Espaço por padrão
+    :type delimiter: str
+
+    :param wl_multiplier: O valor que multiplica os comprimentos de onda
+        para que fiquem em metros. 1e-6 por padrão (o optigrating salva em um)
+    :type wl_multiplier: float
+
+    :param ignore_errors: Se for True, retorna o spectrum como None quando
+        não conseguir carregar o arquivo, ao invés de parar o programa
+    :type ignore_errors: bool
+
+    :param name_function: A função que vai identificar o nome, como no
+        load_from_optisystem
+    :type name_function: function
+
+    :param skip_rows: Quantas linhas de cabeçalho ignorar no início do
+        arquivo. 0 por padrão
+    :type skip_rows: int
+
     :return: um np array 2d com os valores (comprimentos de onda e
         potência) e o dicionário com o nome extraído
     :rtype: (np.ndarray, dict)
     """
 
-    info = {'name': utils.remove_extension(filename)}
+    name_function = name_function or utils.remove_extension
+
+    info = {'name': name_function(filename)}
 
     if not quiet:
         print(f'Carregando {info["name"]}')
 
-    complex_spectrum = np.genfromtxt(filename, dtype=np.float64, delimiter=' ')
-    spectrum = np.zeros((complex_spectrum.shape[0], 2))
+    try:
+        complex_spectrum = read_columns(filename, delimiter, 3,
+                                        skip_rows=skip_rows)
+    except ValueError:
+        if ignore_errors:
+            return None, info
+        raise
 
-    spectrum[::, 0] = complex_spectrum[::, 0] * 1e-6
-    spectrum[::, 1] = \
-        (complex_spectrum[::, 1]**2 + complex_spectrum[::, 2]**2)**(1/2)
+    spectrum = np.empty((complex_spectrum.shape[0], 2))
 
-    spectrum[::, 1] = np.array(list(map(
-        lambda x: 10 * np.log10(x), spectrum[::, 1]         # escalar pra dB
-    )))
+    spectrum[::, 0] = complex_spectrum[::, 0] * wl_multiplier
+    spectrum[::, 1] = 10 * np.log10(np.hypot(complex_spectrum[::, 1],
+                                             complex_spectrum[::, 2]))
 
     return spectrum, info
 
 
+def read_columns(filename, delimiter, columns, dtype=np.float64,
+                 skip_rows=0):
+    """
+    Lê um arquivo de texto com colunas numéricas de uma vez só. O arquivo
+    inteiro é convertido em uma única chamada do numpy, ao invés de um
+    conversor por valor. Vírgulas são tratadas como separador decimal,
+    a não ser que sejam o próprio delimitador
+
+    :param filename: O nome do arquivo
+    :type filename: str
+
+    :param delimiter: O delimitador entre as colunas. None ou espaço
+        significam qualquer espaço em branco
+    :type delimiter: str
+
+    :param columns: O número de colunas esperado
+    :type columns: int
+
+    :param dtype: O tipo do array de saída
+    :type dtype: np.dtype
+
+    :param skip_rows: Quantas linhas do início (cabeçalho) ignorar
+    :type skip_rows: int
+
+    :return: O array com shape (linhas, columns)
+    :rtype: np.ndarray
+    """
+    with open(filename, 'rb') as file:
+        for _ in range(skip_rows):
+            file.readline()
+        text = file.read()
+
+    delimiter = (delimiter or ' ').strip()
+    if delimiter != ',':
+        text = text.replace(b',', b'.')
+    if delimiter:
+        text = text.replace(delimiter.encode(), b' ')
+
+    values = np.array(text.split(), dtype=dtype)
+    if values.size == 0 or values.size % columns:
+        raise ValueError(f'{filename} não tem {columns} colunas numéricas')
+
+    return values.reshape(-1, columns)
+
+
+def sniff_format(filename, n_bytes=4096):
+    """
+    Detecta o formato de um arquivo de espectro a partir dos primeiros bytes:
+    o delimitador, se usa vírgula como separador decimal, o número de colunas
+    e quantas linhas de cabeçalho (não numéricas) precisam ser puladas
+
+    :param filename: O nome do arquivo
+    :type filename: str
+
+    :param n_bytes: Quantos bytes do início do arquivo analisar
+    :type n_bytes: int
+
+    :return: Um dicionário com 'delimiter', 'decimal_comma', 'columns' e
+        'skip_rows'. O delimitador ' ' representa qualquer espaço em branco
+    :rtype: dict
+    """
+    with open(filename, 'rb') as file:
+        lines = file.read(n_bytes).splitlines()
+
+    # A última linha pode ter sido cortada no meio
+    lines = [line.strip() for line in lines[:-1] or lines]
+
+    for skip_rows, line in enumerate(lines):
+        if not line:
+            continue
+
+        if b';' in line:
+            delimiter = ';'
+        elif b'\t' in line:
+            delimiter = '\t'
+        elif b',' in line and (b'.' in line or len(line.split()) == 1):
+            delimiter = ','
+            # Uma coluna com vírgula decimal (como 1549,5) também tem só uma
+            # vírgula por linha. Se todas as linhas forem assim (sem ponto,
+            # sem outro delimitador e só dígitos depois da vírgula), a
+            # vírgula é decimal
+            if all(_single_decimal_comma(x) for x in lines[skip_rows:] if x):
+                delimiter = ' '
+        else:
+            delimiter = ' '
+
+        decimal_comma = delimiter != ',' and b',' in line
+
+        fields = line.replace(b',', b'.') if decimal_comma else line
+        if delimiter.strip():
+            fields = fields.replace(delimiter.encode(), b' ')
+        fields = fields.split()
+
+        try:
+            [float(x) for x in fields]
+        except ValueError:
+            continue  # linha de cabeçalho
+
+        return {'delimiter': delimiter, 'decimal_comma': decimal_comma,
+                'columns': len(fields), 'skip_rows': skip_rows}
+
+    raise ValueError(f'Não foi possível detectar o formato de {filename}')
+
+
+def _single_decimal_comma(line):
+    if line.count(b',') != 1 or b'.' in line or len(line.split()) != 1:
+        return False
+    return line.split(b',')[1].isdigit()
+
+
+# Os carregadores registrados: nome -> (função de detecção, de carregamento)
+loaders = dict()
+
+
+def register_loader(name, detect_function, load_function):
+    """
+    Registra uma função de carregamento para ser usada pelo load_spectrum.
+    Os carregadores registrados por último são testados primeiro, então é
+    possível sobrescrever os padrões
+
+    :param name: O nome do formato
+    :type name: str
+
+    :param detect_function: Uma função que recebe o dicionário retornado
+        pelo sniff_format e retorna True se o arquivo for desse formato
+    :type detect_function: function
+
+    :param load_function: A função de carregamento. Deve aceitar o filename,
+        quiet, ignore_errors, delimiter e skip_rows. Os outros argumentos
+        passados ao load_spectrum só são repassados se estiverem na
+        assinatura (ou se ela tiver **kwargs)
+    :type load_function: function
+
+    :return: None
+    """
+    loaders.pop(name, None)
+    loaders[name] = (detect_function, load_function)
+
+
+register_loader('optisystem',
+                lambda fmt: fmt['columns'] == 2,
+                load_from_optisystem)
+register_loader('optigrating',
+                lambda fmt: fmt['columns'] == 3,
+                load_from_optigrating)
+
+
+def _accepted_kwargs(function, kwargs):
+    parameters = inspect.signature(function).parameters
+    if any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+        return kwargs
+    return {k: v for k, v in kwargs.items() if k in parameters}
+
+
+def load_spectrum(filename, quiet=False, ignore_errors=False, **kwargs):
+    """
+    Carrega um espectro de qualquer formato registrado, detectando o formato
+    pelo cabeçalho do arquivo (ver sniff_format e register_loader). Com isso,
+    pastas com espectros de instrumentos diferentes podem ser carregadas sem
+    configuração por arquivo
+
+    :param filename: O nome do arquivo do espectro
+    :type filename: str
+
+    :param quiet: Se o programa deve printar o progresso
+    :type quiet: bool
+
+    :param ignore_errors: Se for True, retorna o spectrum como None quando o
+        formato não for reconhecido ou o arquivo não abrir
+    :type ignore_errors: bool
+
+    :param kwargs: Outros argumentos para a função de carregamento. Têm
+        prioridade sobre o que foi detectado (como o delimiter). Os que a
+        função do formato detectado não aceita (como o dtype no optigrating)
+        são ignorados
+
+    :return: um np array 2d com os valores (comprimentos de onda e
+        potência) e o dicionário com o nome extraído
+    :rtype: (np.ndarray, dict)
+    """
+    try:
+        fmt = sniff_format(filename)
+    except (ValueError, OSError):
+        if not ignore_errors:
+            raise
+        fmt = None
+
+    for name in reversed(list(loaders)):
+        detect_function, load_function = loaders[name]
+        if fmt is not None and detect_function(fmt):
+            kwargs = {'delimiter': fmt['delimiter'],
+                      'skip_rows': fmt['skip_rows'], **kwargs}
+            kwargs = _accepted_kwargs(load_function, kwargs)
+            return load_function(filename, quiet=quiet,
+                                 ignore_errors=ignore_errors, **kwargs)
+
+    if not ignore_errors:
+        raise ValueError(f'Formato de {filename} não reconhecido: {fmt}')
+
+    name_function = kwargs.get('name_function') or utils.remove_extension
+    return None, {'name': name_function(filename)}
+
+
 def mask_spectrum(spectrum, _, wl_limits, quiet=False):
     """
     Corta o espectro com base em um intervalo de comprimento de onda
@@ -144,23 +385,31 @@ def mask_spectrum(spectrum, _, wl_limits, quiet=False):
     :param quiet: Se o programa deve printar o progresso
     :type quiet: bool
 
-    :return: O espectro cortado e um dicionário vazio
+    :return: O espectro cortado (uma view do original, se os comprimentos
+        de onda estiverem em ordem crescente) e um dicionário vazio
     :rtype: (np.ndarray, dict)
     """
 
     if not quiet:
         print(f'Cortando')
 
-    region = np.where((min(wl_limits) <= spectrum[::, 0]) &
-                      (spectrum[::, 0] <= max(wl_limits)))
-    masked = spectrum[region]
+    wls = spectrum[::, 0]
+    if len(wls) and wls[0] <= wls[-1]:
+        start = np.searchsorted(wls, min(wl_limits), side='left')
+        stop = np.searchsorted(wls, max(wl_limits), side='right')
+        masked = spectrum[start:stop]
+    else:
+        region = np.where((min(wl_limits) <= wls) & (wls <= max(wl_limits)))
+        masked = spectrum[region]
 
     return masked, dict()
 
 
 def filter_spectrum(spectrum, _, window_length, polyorder, quiet=False):
     """
-    Filtra o espectro utilizando o filtro de Savitzky–Golay
+    Filtra o espectro utilizando o filtro de Savitzky–Golay. Os coeficientes
+    ficam em cache (ver utils.savgol), então repetir o filtro com os mesmos
+    parâmetros em vários espectros só custa a convolução
 
     :param spectrum: O espectro
     :type spectrum: np.ndarray
@@ -186,13 +435,49 @@ def filter_spectrum(spectrum, _, window_length, polyorder, quiet=False):
     if not quiet:
         print(f'Filtrando')
 
-    filtered = spectrum * 1  # só pra copiar rápido
-    filtered[::, 1] = sg.savgol_filter(spectrum[::, 1],
-                                       window_length, polyorder)
+    filtered = np.empty_like(spectrum)
+    filtered[::, 0] = spectrum[::, 0]
+    filtered[::, 1] = savgol_filter(spectrum[::, 1], window_length, polyorder)
 
     return filtered, dict()
 
 
+def filter_spectra(spectra, window_length, polyorder, deriv=0):
+    """
+    Filtra vários espectros de uma vez com o filtro de Savitzky–Golay. Os
+    espectros devem ter o mesmo número de pontos (por exemplo, depois de
+    interpolados com os mesmos parâmetros)
+
+    :param spectra: Os espectros, como uma lista de arrays (n, 2) ou um array
+        com shape (m, n, 2)
+    :type spectra: list, np.ndarray
+
+    :param window_length: O tamanho da 'janela do filtro' (ímpar)
+    :type window_length: int
+
+    :param polyorder: A ordem dos polinômios usados nos cálculos do filtro
+    :type polyorder: int
+
+    :param deriv: A ordem da derivada em relação ao comprimento de onda. 0
+        por padrão (só filtra). Se for maior que 0, a coluna de potência da
+        saída passa a ser a derivada, com o passo médio do grid
+    :type deriv: int
+
+    :return: Os espectros filtrados, com shape (m, n, 2)
+    :rtype: np.ndarray
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    wl = spectra[0, ::, 0]
+    delta = (wl[-1] - wl[0]) / (len(wl) - 1)
+
+    filtered = np.empty_like(spectra)
+    filtered[..., 0] = spectra[..., 0]
+    filtered[..., 1] = savgol_filter(spectra[..., 1], window_length,
+                                     polyorder, deriv=deriv, delta=delta)
+
+    return filtered
+
+
 def interpolate_spectrum(spectrum, _, wl_step, wl_limits=None,
                          kind='cubic', quiet=False):
     """
@@ -227,19 +512,45 @@ def interpolate_spectrum(spectrum, _, wl_step, wl_limits=None,
         print(f'Interpolando')
 
     wl_limits = wl_limits or (spectrum[0, 0], spectrum[-1, 0])
-    wl = [x for x in np.arange(wl_limits[0], wl_limits[1], wl_step)]
+    grid = _interpolation_grid(float(wl_limits[0]), float(wl_limits[1]),
+                               float(wl_step))
 
     xs = spectrum[::, 0]
     ys = spectrum[::, 1]
 
     f = interp1d(xs, ys, kind=kind)
-    interpolated = np.array(
-        [x for x in zip(wl, f(wl))],
-        dtype=np.float64)
+    interpolated = np.column_stack((grid.values, f(grid.values)))
+
+    # Os passos seguintes (como o simulate_gain) comparam o grid pela
+    # identidade (ver funcs._context)
+    _context.bind_grid(interpolated, grid)
 
     return interpolated, dict()
 
 
+@lru_cache(maxsize=32)
+def _interpolation_grid(start, stop, step):
+    """O grid do interpolate_spectrum, criado uma vez por parâmetros"""
+    return WavelengthGrid.of(np.arange(start, stop, step))
+
+
+def _check_same_grid(spectrum, other):
+    """
+    Levanta um ValueError se o outro espectro não estiver no grid do
+    espectro. Se o outro for um Spectrum, compara os grids pela identidade
+    """
+    if isinstance(other, Spectrum):
+        same_grid = _context.grid(spectrum) is other.grid
+    else:
+        same_grid = len(spectrum) == len(other) and \
+            np.array_equal(spectrum[::, 0], other[::, 0])
+
+    if not same_grid:
+        raise ValueError('Os espectros devem ter os wavelengths iguais. Por '
+                         'favor interpole os dois com os mesmos parâmetros '
+                         'para equalizar isso.')
+
+
 def simulate_gain(spectrum, _, other, unit='dB'):
     """
     Simula o efeito da associação de dois espectros. Pode ser usado para
@@ -250,8 +561,12 @@ def simulate_gain(spectrum, _, other, unit='dB'):
     :param spectrum: Um dos espectros
     :type spectrum: np.ndarray
 
-    :param other: O outro espectro
-    :type other: np.ndarray
+    :param other: O outro espectro. Pode ser um utils.spectrum.Spectrum,
+        que guarda a conversão para a unidade pedida, então um espectro usado
+        em muitas chamadas (como o da fonte) é convertido uma vez só, ou uma
+        referência registrada (ver utils.references), que também é mapeada
+        uma vez só em cada processo
+    :type other: np.ndarray, Spectrum, SharedReference
 
     :param unit: A unidade dos espectros. dB por padrão
     :type unit: string
@@ -259,28 +574,108 @@ def simulate_gain(spectrum, _, other, unit='dB'):
     :return: O espectro resultante
     :rtype: np.ndarray
     """
+    if unit not in ('dB', 'scalar'):
+        raise ValueError('Unidade inválida. As implementadas são "dB" e '
+                         '"scalar"')
 
-    if (spectrum[::, 0] != other[::, 0]).any():
-        raise ValueError('Os espectros devem ter os wavelengths iguais. Por '
-                         'favor interpole os dois com os mesmos parâmetros '
-                         'para equalizar isso.')
+    other = resolve_reference(other)
+
+    _check_same_grid(spectrum, other)
+    if isinstance(other, Spectrum):
+        other_values = other.log if unit == 'dB' else other.linear
+    else:
+        other_values = other[::, 1]
 
     final_spectrum = spectrum * 1          # só pra copiar
 
     if unit == 'dB':
-        final_spectrum[::, 1] += other[::, 1]
-    elif unit == 'scalar':
-        final_spectrum[::, 1] *= other[::, 1]
+        final_spectrum[::, 1] += other_values
     else:
-        raise ValueError('Unidade inválida. As implementadas são "dB" e '
-                         '"scalar"')
+        final_spectrum[::, 1] *= other_values
     return final_spectrum, dict()
 
 
-def find_valley(spectrum, _, prominence=5, ignore_errors=False, quiet=False):
+def get_wavelength_shift(spectrum, _, reference, max_shift=None,
+                         quiet=False):
+    """
+    Estima o deslocamento em comprimento de onda do espectro em relação a um
+    espectro de referência, pela correlação cruzada (ver
+    utils.correlation). Os dois devem estar no mesmo grid uniforme (por
+    exemplo, interpolados com os mesmos parâmetros)
+
+    :param spectrum: O espectro
+    :type spectrum: np.ndarray
+
+    :param _: Ignorado. O programa entrega o info, e essa função não usa
+    :type _: Any
+
+    :param reference: O espectro de referência
+    :type reference: np.ndarray, Spectrum
+
+    :param max_shift: O deslocamento máximo procurado, em comprimento de
+        onda. Sem limite se for None. Se o deslocamento passar dele, o
+        'wl_shift' fica NaN
+    :type max_shift: float
+
+    :param quiet: Se o programa deve printar o progresso
+    :type quiet: bool
+
+    :return: O espectro original e um dicionário com o 'wl_shift' (positivo
+        quando o espectro está em comprimentos de onda maiores)
+    :rtype: (np.ndarray, dict)
+    """
+    if not quiet:
+        print('Calculando o deslocamento')
+
+    wl = spectrum[::, 0]
+    _check_same_grid(spectrum, reference)
+    reference = reference.values if isinstance(reference, Spectrum) \
+        else reference[::, 1]
+
+    step = (wl[-1] - wl[0]) / (len(wl) - 1)
+    shift = cross_correlation_shift(spectrum[::, 1], reference, step,
+                                    max_shift)
+
+    return spectrum, {'wl_shift': float(shift)}
+
+
+def get_wavelength_shifts(spectra, reference, max_shift=None):
+    """
+    Estima o deslocamento de vários espectros de uma vez, como o
+    get_wavelength_shift, com as FFTs calculadas em conjunto
+
+    :param spectra: Os espectros, como uma lista de arrays (n, 2) ou um array
+        com shape (m, n, 2), todos no grid da referência
+    :type spectra: list, np.ndarray
+
+    :param reference: O espectro de referência
+    :type reference: np.ndarray, Spectrum
+
+    :param max_shift: O deslocamento máximo procurado, em comprimento de
+        onda. Sem limite se for None
+    :type max_shift: float
+
+    :return: Os deslocamentos, um por espectro
+    :rtype: np.ndarray
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    wl = spectra[0, ::, 0]
+    _check_same_grid(spectra[0], reference)
+    reference = reference.values if isinstance(reference, Spectrum) \
+        else reference[::, 1]
+
+    step = (wl[-1] - wl[0]) / (len(wl) - 1)
+
+    return cross_correlation_shift(spectra[..., 1], reference, step,
+                                   max_shift)
+
+
+def find_valley(spectrum, _, prominence=5, ignore_errors=False,
+                estimator=None, coarse_factor=None, quiet=False):
     """
     Tenta achar o vale ressonante do espectro. Se achar, retorna as
-    coordenadas no dicionário
+    coordenadas no dicionário. Por padrão retorna o ponto do grid, mas pode
+    refinar a posição entre amostras com um estimador em forma fechada
 
     :param spectrum: O espectro
     :type spectrum: np.ndarray
@@ -295,6 +690,16 @@ def find_valley(spectrum, _, prominence=5, ignore_errors=False, quiet=False):
         o vale. Se for True ignora e continua.
     :type ignore_errors: bool
 
+    :param estimator: O estimador para refinar o vale (ver
+        utils.valley.estimate_valley): 'parabolic', 'gaussian', 'centroid'
+        ou 'lorentz'. Se for None, usa o ponto do grid
+    :type estimator: str
+
+    :param coarse_factor: Se for passado, procura os vales primeiro em uma
+        versão reduzida do espectro e só depois na resolução completa ao
+        redor dos candidatos (ver utils.valley.find_valleys)
+    :type coarse_factor: int
+
     :param quiet: Se o programa deve printar o progresso
     :type quiet: bool
 
@@ -307,7 +712,8 @@ def find_valley(spectrum, _, prominence=5, ignore_errors=False, quiet=False):
 
     xs = spectrum[::, 0]
     ys = spectrum[::, 1]
-    valleys, properties = sg.find_peaks(-ys, prominence=prominence)
+    valleys, properties = _context.valleys(spectrum, prominence,
+                                           coarse_factor)
 
     info = dict()
 
@@ -325,6 +731,10 @@ def find_valley(spectrum, _, prominence=5, ignore_errors=False, quiet=False):
     try:
         best_match = np.argmax(properties['prominences'])
         x, y = xs[valleys[best_match]], ys[valleys[best_match]]
+        if estimator is not None:
+            x, y = estimate_valley(xs, ys, valleys[best_match],
+                                   properties['prominences'][best_match],
+                                   estimator)
         info['resonant_wl'] = x
         info['resonant_wl_power'] = y
     except ValueError:  # Did not find any, so argmax will fail
@@ -336,7 +746,7 @@ def find_valley(spectrum, _, prominence=5, ignore_errors=False, quiet=False):
 
 def get_approximate_valley(spectrum, info, approx_func=lorentz, prominence=5,
                            resolution_proximity=2, p0=None, dwl=2,
-                           plot=False):
+                           coarse_factor=None, max_nfev=10000, plot=False):
     """
     Aproxima a região do vale como uma curva determinada na 'approx_func',
         depois extrai o comprimento de onda ressonante a partir da curva
@@ -350,8 +760,11 @@ def get_approximate_valley(spectrum, info, approx_func=lorentz, prominence=5,
     :param info: O dicionário com as informações (não é usado)
     :type info: dict
 
-    :param approx_func: A função de approximação (lorentziana por padrão)
-    :type approx_func: function
+    :param approx_func: A função de approximação (lorentziana por padrão).
+        Também pode ser o nome de um estimador em forma fechada ('parabolic',
+        'gaussian', 'centroid' ou 'lorentz', ver utils.valley), que não usa o
+        curve_fit e é muito mais rápido
+    :type approx_func: function, str
 
     :param prominence: A prominência mínima dos vales
     :type prominence: float
@@ -368,6 +781,18 @@ def get_approximate_valley(spectrum, info, approx_func=lorentz, prominence=5,
     :param dwl: Espaçamento ao redor do vale que será usado para ajuste da função
     :type valley_samples: float
 
+    :param coarse_factor: Se for passado, procura os vales primeiro em uma
+        versão reduzida do espectro e só depois na resolução completa ao
+        redor dos candidatos (ver utils.valley.find_valleys)
+    :type coarse_factor: int
+
+    :param max_nfev: O número máximo de avaliações da função em cada ajuste.
+        Se for atingido, o vale fica como o ponto mínimo do grid. A
+        quantidade de vales em que isso aconteceu fica em 'fit_fallbacks'.
+        Se o limite do passo acabar (ver utils.budget), o BudgetExceeded é
+        levantado, para o MassSpectraData usar o fallback do passo
+    :type max_nfev: int
+
     :param plot: Se deve ou não plotar os gráficos com aproximações. Se for
         True, o script deve estar rodando em um caminho que possui uma pasta
         chamada 'plots/'. Esse parâmetro serve para ajudar a ajustar os p0 e
@@ -381,10 +806,9 @@ def get_approximate_valley(spectrum, info, approx_func=lorentz, prominence=5,
 
     wl = spectrum[::, 0]
     power = spectrum[::, 1]
-    resolution = np.mean(np.diff(wl))
+    resolution = _context.resolution(spectrum)
 
-    peaks, peak_info = sg.find_peaks(-power, prominence=prominence,
-                                  plateau_size=0, wlen=None)
+    peaks, peak_info = _context.valleys(spectrum, prominence, coarse_factor)
 
     _info = dict()
 
@@ -394,23 +818,41 @@ def get_approximate_valley(spectrum, info, approx_func=lorentz, prominence=5,
 
     _info['valley_count'] = len(peaks)
 
+    closed_form = isinstance(approx_func, str)
+    _info['fit_fallbacks'] = 0
+
+    if has_budget():
+        @wraps(approx_func)
+        def fit_func(x, *params):
+            check_budget()
+            return approx_func(x, *params)
+    else:
+        fit_func = approx_func
+
     for i in range(len(peaks)):
         wl0 = wl[peaks[i]]
-        mask = (spectrum[:, 0] > wl0 - dwl/2) & (spectrum[:, 0] < wl0 + dwl/2)
-        valley = spectrum[mask, ::]
 
-        try:
-            popt, _ = curve_fit(approx_func, valley[::, 0], valley[::, 1],
-                                p0=None, max_nfev=10000,
-                                bounds=((-np.inf, wl0-resolution_proximity*resolution, 1e-10, -np.inf),
-                                        (+np.inf, wl0+resolution_proximity*resolution, 100, np.inf)))
+        if closed_form:
+            resonant_wl, resonant_power = estimate_valley(
+                wl, power, peaks[i], peak_info['prominences'][i], approx_func)
+        else:
+            start = np.searchsorted(wl, wl0 - dwl/2, side='right')
+            stop = np.searchsorted(wl, wl0 + dwl/2, side='left')
+            valley = spectrum[start:stop]
 
-            resonant_wl = popt[1]
-            resonant_power = approx_func(popt[1], *popt)
+            try:
+                popt, _ = curve_fit(fit_func, valley[::, 0], valley[::, 1],
+                                    p0=None, max_nfev=max_nfev,
+                                    bounds=((-np.inf, wl0-resolution_proximity*resolution, 1e-10, -np.inf),
+                                            (+np.inf, wl0+resolution_proximity*resolution, 100, np.inf)))
 
-        except RuntimeError:
-            resonant_wl = wl[peaks[i]]
-            resonant_power = power[peaks[i]]
+                resonant_wl = popt[1]
+                resonant_power = approx_func(popt[1], *popt)
+
+            except RuntimeError:
+                resonant_wl = wl[peaks[i]]
+                resonant_power = power[peaks[i]]
+                _info['fit_fallbacks'] += 1
 
         if len(peaks) == 1:
             _info['resonant_wl'] = resonant_wl
@@ -419,7 +861,9 @@ def get_approximate_valley(spectrum, info, approx_func=lorentz, prominence=5,
             _info[f'resonant_wl_{i}'] = resonant_wl
             _info[f'resonant_wl_power_{i}'] = resonant_power
 
-        if plot:
+        if plot and closed_form:
+            ax.plot(resonant_wl, resonant_power, 'xk')
+        elif plot:
             ax.plot(valley[::, 0], approx_func(valley[::, 0] * 1e6, *popt))  # debug
 
     # Get the index to the best prominence. Can be useful for interrogation
@@ -451,6 +895,88 @@ def get_max_power(spectrum, _):
     return spectrum, info
 
 
+def guard_step(predicate, reason=None):
+    """
+    Cria um passo de guarda a partir de um predicado. Se o predicado
+    retornar False, o passo encerra o processamento do espectro (retorna o
+    espectro None) e coloca o motivo na coluna 'rejected'. O dicionário do
+    espectro rejeitado não tem as chaves dos passos seguintes, então essas
+    colunas ficam vazias (NaN) na tabela (e só existem se algum espectro
+    passou pela guarda)
+
+    :param predicate: Uma função predicate(spectrum, info, **kwargs) que
+        retorna True se o espectro deve continuar
+    :type predicate: function
+
+    :param reason: O motivo registrado. Por padrão é o nome do predicado
+    :type reason: str
+
+    :return: O passo. Pode ser enviado com pickle (para um
+        ProcessPoolExecutor) se o predicado puder
+    :rtype: function
+    """
+    return _GuardStep(predicate, reason)
+
+
+class _GuardStep:
+    """O passo criado pelo guard_step"""
+    def __init__(self, predicate, reason=None):
+        self.predicate = predicate
+        self.reason = reason or getattr(predicate, '__name__', 'guard')
+        self.__name__ = \
+            f'guard_{getattr(predicate, "__name__", "predicate")}'
+        self.__doc__ = predicate.__doc__
+
+    def __call__(self, spectrum, info, **kwargs):
+        if self.predicate(spectrum, info, **kwargs):
+            return spectrum, dict()
+        return None, {'rejected': self.reason}
+
+
+def valley_found(_, info):
+    """
+    Predicado para o guard_step: se o find_valley (ou o
+    get_approximate_valley) achou o vale
+
+    :param _: Ignorado. O espectro
+    :type _: Any
+
+    :param info: O dicionário com as informações
+    :type info: dict
+
+    :rtype: bool
+    """
+    wl = info.get('resonant_wl')
+    if wl is None and info.get('valley_count'):
+        wl = info.get(f"resonant_wl_{info.get('best_index', 0)}")
+
+    return wl is not None and wl == wl and wl != 0
+
+
+def channel_alive(spectrum, info, min_power=-80):
+    """
+    Predicado para o guard_step: se a potência máxima do espectro passa de
+    min_power (um canal desligado ou sem sinal fica no nível de ruído). Usa
+    o 'max_power' do get_max_power se ele já tiver rodado
+
+    :param spectrum: O espectro
+    :type spectrum: np.ndarray
+
+    :param info: O dicionário com as informações
+    :type info: dict
+
+    :param min_power: A potência mínima, em dB
+    :type min_power: float
+
+    :rtype: bool
+    """
+    max_power = info.get('max_power')
+    if max_power is None:
+        max_power = spectrum[:, 1].max()
+
+    return max_power >= min_power
+
+
 def fill_name_zeros(spectrum, info, zeros=4):
     """
     Adiciona zeros na parte numérica do nome pra facilitar a ordenação
@@ -496,8 +1022,35 @@ def set_name_numbers(spectrum, info):
     return spectrum, info
 
 
+def set_timestamp(spectrum, info, fmt='%Y%m%d_%H_%M_%S_%f'):
+    """
+    Extrai o instante de aquisição do nome (como 20230503_13_57_44_600) e
+    coloca no dicionário como 'timestamp'. Com isso, o dataframe do
+    MassSpectraData ganha um índice de datas no final do run
+
+    :param spectrum: O espectro
+    :type spectrum: np.ndarray
+
+    :param info: O dicionário com o nome
+    :type info: dict
+
+    :param fmt: O formato do nome, como no datetime.strptime
+    :type fmt: str
+
+    :return: O espectro original e o dicionário com o instante (None se o
+        nome não estiver no formato)
+    :rtype: (np.ndarray, dict)
+    """
+    try:
+        timestamp = datetime.strptime(info['name'], fmt)
+    except ValueError:
+        timestamp = None
+
+    return spectrum, {'timestamp': timestamp}
+
+
 def plot_spectrum(spectrum, info, plot_opts=None, subplots=None, save_folder=None,
-                  quiet=False):
+                  max_points=None, quiet=False):
     """
     Plota o espectro em um gráfico, com o vale marcado com um x, se tiver
     sido encontrado
@@ -514,16 +1067,25 @@ def plot_spectrum(spectrum, info, plot_opts=None, subplots=None, save_folder=Non
 
     :param subplots: Os objetos criados pelo matplotlib para fazer um plot,
         retornados pelo 'plt.subplots()'. Geralmente salvos como (fig, ax).
+        Se não for passado, a figura é criada e fechada aqui (depois de
+        salva, se tiver save_folder), então para mostrar ou continuar
+        desenhando na figura ela deve ser passada
     :type subplots: tuple
 
     :param save_folder: A pasta para salvar as imagens dos plots, se for
         None, não salva
     :type save_folder: str, path
 
+    :param max_points: O número máximo de pontos plotados (ver
+        render.decimate_trace). None por padrão (plota todos)
+    :type max_points: int
+
     :param quiet: Se o programa deve printar sobre o progresso
     :type quiet: bool
 
-    :return: None
+    :return: O espectro original e um dicionário vazio. Para plotar muitos
+        espectros sem atrasar o processamento, ver render.SpectrumRenderer
+    :rtype: (np.ndarray, dict)
     """
     if not quiet:
         print(f'Plotando')
@@ -542,8 +1104,7 @@ def plot_spectrum(spectrum, info, plot_opts=None, subplots=None, save_folder=Non
     ax.set_xlabel('Wavelength (nm)')
     ax.set_ylabel('Optical power (dBm)')
 
-    xs = spectrum[::, 0]
-    ys = spectrum[::, 1]
+    xs, ys = decimate_trace(spectrum[::, 0], spectrum[::, 1], max_points)
 
     ax.plot(xs, ys)
     if 'resonant_wl' in info.keys():
@@ -556,4 +1117,7 @@ def plot_spectrum(spectrum, info, plot_opts=None, subplots=None, save_folder=Non
                                  f'_{info["name"]}.png')
         fig.savefig(full_path, transparent=False)
 
+    if subplots is None:
+        plt.close(fig)
+
     return spectrum, dict()
@@ -0,0 +1,169 @@
+"""
+O contexto de um espectro enquanto os passos rodam nele. Os passos só
+trocam dados pelo info (que vai para o csv), então o find_valley e o
+get_approximate_valley procuravam os mesmos vales e calculavam a resolução
+do grid cada um. Dentro de um spectrum_context (aberto pelo
+MassSpectraData.process_file e pelos outros executores), os vales (ver
+valleys) e a resolução (ver resolution) ficam em cache por espectro. O cache
+é do objeto do espectro e do seu conteúdo, então um passo que retorna um
+espectro novo (como o filter_spectrum) ou que modifica o espectro no lugar
+não reaproveita o que foi calculado antes. Fora de um contexto, tudo é
+calculado na hora.
+
+O stream_key identifica a sequência de espectros de um passo com estado
+(como o funcs.coadd.SpectrumAverager). No ParameterSweep, cada combinação
+dos passos anteriores é uma sequência (ver stream).
+
+O contexto também liga cada espectro ao seu WavelengthGrid (ver grid e
+bind_grid), para a verificação do grid nos passos ser uma comparação de
+identidade. Essa ligação é só pelo objeto do espectro: os passos não devem
+modificar os comprimentos de onda no lugar.
+
+Os resultados em cache são compartilhados e não devem ser modificados.
+"""
+
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+
+from process_spectra.utils.spectrum import WavelengthGrid
+from process_spectra.utils.valley import find_valleys
+
+
+# id do espectro -> (espectro, assinatura do conteúdo, cache) e
+# ('grid', id do espectro) -> (espectro, grid). O espectro fica guardado para
+# o id não ser reaproveitado por outro array enquanto o contexto estiver
+# aberto
+_caches = ContextVar('process_spectra_spectrum_context', default=None)
+
+# A sequência de espectros atual (ver stream)
+_stream = ContextVar('process_spectra_stream', default=None)
+
+
+@contextmanager
+def spectrum_context():
+    """Abre um contexto novo (vazio) para os passos de um espectro"""
+    token = _caches.set(dict())
+    try:
+        yield
+    finally:
+        _caches.reset(token)
+
+
+def cached(spectrum, key, function, *args):
+    """
+    Retorna function(*args), calculado uma vez só por espectro e chave
+    dentro do contexto atual
+
+    :param spectrum: O espectro a que o resultado se refere
+    :type spectrum: np.ndarray
+
+    :param key: A chave do resultado (deve incluir os parâmetros que mudam
+        o resultado)
+    :type key: Hashable
+
+    :param function: A função que calcula o resultado
+
+    :return: O resultado
+    """
+    caches = _caches.get()
+    if caches is None:
+        return function(*args)
+
+    # O crc32 custa bem menos que a busca dos vales (~1%), e detecta um
+    # passo que modificou o espectro no lugar
+    signature = (spectrum.shape, zlib.crc32(np.ascontiguousarray(spectrum)))
+
+    entry = caches.get(id(spectrum))
+    if entry is None or entry[0] is not spectrum or entry[1] != signature:
+        entry = caches[id(spectrum)] = (spectrum, signature, dict())
+
+    results = entry[2]
+    if key not in results:
+        results[key] = function(*args)
+    return results[key]
+
+
+def valleys(spectrum, prominence, coarse_factor=None):
+    """
+    Os vales do espectro (ver utils.valley.find_valleys), em cache
+
+    :return: Os índices dos vales e o dicionário com as proeminências e as
+        bases
+    :rtype: (np.ndarray, dict)
+    """
+    return cached(spectrum, ('valleys', prominence, coarse_factor),
+                  find_valleys, spectrum[::, 1], prominence, coarse_factor)
+
+
+def _resolution(wavelengths):
+    return (wavelengths[-1] - wavelengths[0]) / (len(wavelengths) - 1)
+
+
+def resolution(spectrum):
+    """
+    O passo médio do grid do espectro (= np.mean(np.diff(wl))), em cache
+
+    :rtype: float
+    """
+    return cached(spectrum, 'resolution', _resolution, spectrum[::, 0])
+
+
+def bind_grid(spectrum, grid):
+    """
+    Liga o espectro ao seu grid, no contexto atual. Usado pelos passos que
+    já sabem o grid do espectro que retornam (como o interpolate_spectrum)
+
+    :param spectrum: O espectro
+    :type spectrum: np.ndarray
+
+    :param grid: O grid dos comprimentos de onda do espectro
+    :type grid: WavelengthGrid
+
+    :return: O grid
+    :rtype: WavelengthGrid
+    """
+    caches = _caches.get()
+    if caches is not None:
+        caches[('grid', id(spectrum))] = (spectrum, grid)
+    return grid
+
+
+def grid(spectrum):
+    """
+    O WavelengthGrid do espectro. Se o espectro já foi ligado a um grid no
+    contexto atual, é só uma consulta; se não, o grid é buscado (O(n)) e
+    ligado
+
+    :rtype: WavelengthGrid
+    """
+    caches = _caches.get()
+    if caches is not None:
+        entry = caches.get(('grid', id(spectrum)))
+        if entry is not None and entry[0] is spectrum:
+            return entry[1]
+
+    return bind_grid(spectrum, WavelengthGrid.of(spectrum[::, 0]))
+
+
+@contextmanager
+def stream(key):
+    """
+    Define a sequência de espectros dos passos chamados dentro do with. Os
+    passos com estado guardam um estado para cada sequência
+
+    :param key: A chave da sequência
+    :type key: Hashable
+    """
+    token = _stream.set(key)
+    try:
+        yield
+    finally:
+        _stream.reset(token)
+
+
+def stream_key():
+    """A chave da sequência atual (None fora de um stream)"""
+    return _stream.get()
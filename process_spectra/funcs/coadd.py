@@ -0,0 +1,182 @@
+"""
+Esse módulo tem o SpectrumAverager, um passo com estado que faz a média de
+espectros consecutivos para reduzir o ruído (co-adição). Os últimos K
+espectros ficam em um buffer circular no grid compartilhado, e a soma é
+atualizada incrementalmente (soma o novo e subtrai o mais antigo), então o
+custo por espectro não depende de K.
+
+Como o passo só tem resultado quando a janela está cheia (e pode reduzir o
+número de linhas), ele retorna (None, None) para os espectros que não geram
+saída, o que faz o MassSpectraData descartar a linha.
+
+O passo tem estado, então os espectros devem chegar em ordem: no
+ParameterSweep cada combinação dos passos anteriores tem o seu buffer, e o
+MassSpectraData.aiter_results não aceita o passo com mais de um arquivo ao
+mesmo tempo.
+"""
+
+import numpy as np
+
+from process_spectra.funcs import _context
+
+
+class SpectrumAverager:
+    """
+    Média (ou mediana) móvel dos últimos K espectros, ou média por blocos
+    de K espectros sem sobreposição. O método coadd é o passo do
+    MassSpectraData. Os espectros devem chegar em ordem e no mesmo grid
+    (por exemplo, depois do interpolate_spectrum)
+    """
+    def __init__(self, window=4, mode='mean', decimate=1, linear=False,
+                 resum_interval=1000):
+        """
+        Inicia o objeto
+
+        :param window: O número K de espectros na média
+        :type window: int
+
+        :param mode: 'mean' (média móvel), 'median' (mediana móvel, O(K) por
+            ponto) ou 'block' (média de blocos de K espectros, sem
+            sobreposição)
+        :type mode: str
+
+        :param decimate: Entrega só uma a cada decimate saídas da média
+            móvel (no modo 'block' a saída já é uma a cada K)
+        :type decimate: int
+
+        :param linear: Se deve fazer a média na potência linear (W) ao invés
+            de em dB. A saída volta para dB
+        :type linear: bool
+
+        :param resum_interval: A cada quantos espectros a soma é recalculada
+            do buffer, para o erro de arredondamento da atualização
+            incremental não acumular
+        :type resum_interval: int
+        """
+        if mode not in ('mean', 'median', 'block'):
+            raise ValueError(f'{mode} é um modo inválido, os implementados '
+                             f'são "mean", "median" e "block"')
+        if window < 1:
+            raise ValueError('A janela deve ter pelo menos 1 espectro')
+
+        self.window = window
+        self.mode = mode
+        self.decimate = max(int(decimate), 1)
+        self.linear = linear
+        self.resum_interval = resum_interval
+
+        self.reset()
+
+    def reset(self):
+        """
+        Esvazia os buffers (por exemplo, entre medições diferentes)
+
+        :return: None
+        """
+        self.windows = dict()
+
+    def _add(self, window, values, name):
+        if window.count == self.window:
+            window.total -= window.buffer[window.position]
+        else:
+            window.count += 1
+
+        window.buffer[window.position] = values
+        window.names[window.position] = name
+        window.total += values
+        window.position = (window.position + 1) % self.window
+
+        if window.received % self.resum_interval == 0:
+            window.total = window.buffer[:window.count].sum(axis=0)
+
+    def _output(self, window):
+        if self.mode == 'median':
+            average = np.median(window.buffer[:window.count], axis=0)
+        else:
+            average = window.total / window.count
+
+        if self.linear:
+            average = 10 * np.log10(average)
+
+        return average
+
+    def coadd(self, spectrum, info, quiet=False):
+        """
+        Passo que adiciona o espectro na janela e retorna a média quando
+        tiver saída. Em um ParameterSweep, cada combinação dos passos
+        anteriores tem a sua janela (ver funcs._context.stream)
+
+        :param spectrum: O espectro
+        :type spectrum: np.ndarray
+
+        :param info: O dicionário com as informações
+        :type info: dict
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+
+        :return: O espectro médio e um dicionário com 'coadd_count' (o
+            número de espectros na média) e 'coadd_first' (o nome do mais
+            antigo), ou (None, None) se não tiver saída para esse espectro
+        :rtype: (np.ndarray, dict)
+        """
+        if not quiet:
+            print('Co-adicionando')
+
+        grid = _context.grid(spectrum)
+        key = _context.stream_key()
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = _Window(grid, self.window)
+        elif grid is not window.grid:
+            raise ValueError('Os espectros devem ter os wavelengths iguais. '
+                             'Por favor interpole todos com os mesmos '
+                             'parâmetros para equalizar isso.')
+
+        values = spectrum[::, 1]
+        if self.linear:
+            values = 10 ** (values / 10)
+
+        window.received += 1
+        self._add(window, values, info.get('name'))
+
+        if window.count < self.window:
+            return None, None
+
+        if self.mode == 'block':
+            average = self._output(window)
+            first = window.names[window.position]
+            window.count = 0
+            window.position = 0
+            window.total[:] = 0
+        else:
+            window.emitted += 1
+            if (window.emitted - 1) % self.decimate:
+                return None, None
+            average = self._output(window)
+            first = window.names[window.position]
+
+        result = np.empty_like(spectrum, dtype=np.float64)
+        result[::, 0] = window.grid.values
+        result[::, 1] = average
+
+        return result, {'coadd_count': self.window, 'coadd_first': first}
+
+    # O resultado depende da ordem dos espectros (ver aiter_results)
+    coadd.stateful = True
+
+
+class _Window:
+    """O buffer circular de uma sequência de espectros"""
+    __slots__ = ('grid', 'buffer', 'names', 'total', 'count', 'position',
+                 'received', 'emitted')
+
+    def __init__(self, grid, size):
+        self.grid = grid
+        self.buffer = np.empty((size, len(grid)))
+        self.names = [None] * size
+        self.total = np.zeros(len(grid))
+        self.count = 0              # espectros no buffer
+        self.position = 0           # próxima posição do buffer
+        self.received = 0
+        self.emitted = 0
@@ -11,13 +11,13 @@ das fbgs.
 import os.path
 
 import numpy as np
-from math import sin, pi
+from math import pi
 
 import pandas as pd
 
-from process_spectra.utils import get_power
-from process_spectra.utils.fbg import get_fbg_reflectance
-from process_spectra.funcs import simulate_gain
+from process_spectra.utils import dBmW_to_W, trapz_weights
+from process_spectra.utils.accel import fbg_powers as fbg_powers_kernel
+from process_spectra.utils.spectrum import Spectrum
 
 
 def simulate_piezo_fbg(spectrum,
@@ -33,11 +33,16 @@ def simulate_piezo_fbg(spectrum,
                        sensitivity=6.475e-12,
                        max_harmonic_index=2,
                        save_samples_folder=None,
+                       sample_store=None,
+                       n_realizations=None,
+                       seed=None,
+                       lookup=False,
+                       lookup_tolerance=1e-6,
                        quiet=False):
     """
     Essa função simula a atuação de uma fbg acoplada com um piezoelétrico ao
-        longo do tempo. Vale notar que por enquanto a função é extremamente
-        lenta. Se for usar ela em tempo real, deve pensar em otimizar
+        longo do tempo. A potência de todos os instantes é calculada por um
+        kernel só, que usa o Numba se estiver instalado (ver utils.accel)
 
         |Artigo de onde foram pegos os dados do piezoelétrico:
     @article{dante2016temperature,
@@ -102,6 +107,32 @@ def simulate_piezo_fbg(spectrum,
         potência das amostras. Se for None, não salva
     :type save_samples_folder: str
 
+    :param sample_store: Um store onde acrescentar as amostras de potência
+        (ver utils.samples.SampleStore), com o nome do espectro. Evita criar
+        um arquivo por espectro, como no save_samples_folder
+    :type sample_store: SampleStore
+
+    :param n_realizations: Se for passado, roda um conjunto de Monte Carlo
+        do ruído elétrico (ver noise_ensemble): a potência sem ruído é
+        calculada uma vez e o ruído é aplicado em n_realizations
+        realizações. As colunas de magnitude e fase ficam com a média (a
+        fase é a média circular) e ganham colunas _std com o desvio padrão
+    :type n_realizations: int
+
+    :param seed: A semente do gerador do ruído no modo de conjunto, para os
+        resultados serem reproduzíveis
+    :type seed: int
+
+    :param lookup: Se for True, a potência refletida é calculada uma vez em
+        função do deslocamento de bragg (ver bragg_shift_table) e cada
+        instante é só uma interpolação nessa tabela. Compensa em simulações
+        longas ou com taxa de amostragem alta
+    :type lookup: bool
+
+    :param lookup_tolerance: O erro máximo da interpolação da tabela,
+        relativo à maior potência
+    :type lookup_tolerance: float
+
     :param quiet: Se o programa deve printar o progresso
     :type quiet: bool
 
@@ -118,48 +149,385 @@ def simulate_piezo_fbg(spectrum,
 
     sim_time = np.arange(0, total_time, 1/sample_rate)
 
-    wls = spectrum[::, 0]
+    source = Spectrum.from_array(spectrum, unit='dBm')
+    wls = source.wavelengths
 
-    fbg_powers = []
-    for t in sim_time:
-        piezo_voltage = amplitude * sin(2*pi*frequency*t)
-        piezo_modulation = piezo_voltage * sensitivity
+    # Somar a refletância em dB e integrar em W é o mesmo que integrar a
+    # refletância linear pesada pelo espectro em W, que não muda no tempo
+    weighted_source = source.weights * source.linear
 
-        reflectance = get_fbg_reflectance(fbg_wl_bragg + piezo_modulation,
-                                          fbg_fwhm, wls)
+    piezo_voltage = amplitude * np.sin(2*pi*frequency*sim_time)
+    piezo_modulation = piezo_voltage * sensitivity
 
-        reflected_spectrum, _ = simulate_gain(spectrum, '', reflectance)
-        reflected_spectrum = reflected_spectrum[::, 1]
+    if lookup:
+        shifts, table = bragg_shift_table(
+            wls, weighted_source, fbg_wl_bragg, fbg_fwhm,
+            abs(amplitude * sensitivity), lookup_tolerance)
+        fbg_powers = np.interp(piezo_modulation, shifts, table)
+    else:
+        # Um kernel só para todos os instantes (ver utils.accel)
+        fbg_powers = fbg_powers_kernel(fbg_wl_bragg + piezo_modulation,
+                                       fbg_fwhm, wls, weighted_source)
 
-        fbg_powers.append(
-            get_power(reflected_spectrum, wls, noise=electrical_noise))
+    _info = {}
 
-    fourier_frequencies = np.fft.fftfreq(len(fbg_powers), d=1/sample_rate)
-    fourier_frequencies = np.fft.fftshift(fourier_frequencies)
+    if n_realizations:
+        realizations, samples = noise_ensemble(
+            fbg_powers, sample_rate, frequency, electrical_noise,
+            n_realizations, max_harmonic_index, seed, return_samples=True)
+        summary = summarize_ensemble(realizations)
 
-    fourier_transform = np.fft.fft(np.array(fbg_powers))
-    fourier_transform = np.fft.fftshift(fourier_transform) / len(fbg_powers)
-    fourier_transform_mag = np.abs(fourier_transform)
-    fourier_transform_phase = np.angle(fourier_transform, deg=True)
+        for i, row in summary.iterrows():
+            for column in ['mag', 'mag_std', 'phase', 'phase_std']:
+                _info[f'{fbg_label}_harmonic{i}_{column}'] = row[column]
 
-    _info = {}
+        if save_samples_folder:
+            save_samples(samples, save_samples_folder, info)
+        if sample_store is not None:
+            sample_store.append(info['name'], samples)
 
-    for i in range(max_harmonic_index + 1):
-        harmonic_freq = i*frequency
-        _info[f'{fbg_label}_harmonic{i}_mag'] = \
-            fourier_transform_mag[np.where(fourier_frequencies == harmonic_freq)][0]
+        return spectrum, _info
+
+    if electrical_noise:
+        fbg_powers += np.random.randn(len(fbg_powers))*electrical_noise
 
+    transform = harmonic_transform(fbg_powers, sample_rate, frequency,
+                                   max_harmonic_index)
+
+    for i in range(max_harmonic_index + 1):
+        _info[f'{fbg_label}_harmonic{i}_mag'] = np.abs(transform[i])
         _info[f'{fbg_label}_harmonic{i}_phase'] = \
-            fourier_transform_phase[np.where(fourier_frequencies == harmonic_freq)][0]
+            np.angle(transform[i], deg=True)
 
     if save_samples_folder:
         save_samples(fbg_powers, save_samples_folder, info)
+    if sample_store is not None:
+        sample_store.append(info['name'], fbg_powers)
 
     return spectrum, _info
 
 
+def bragg_shift_table(wls, weights, fbg_wl_bragg, fbg_fwhm, max_shift,
+                      tolerance=1e-6, initial_points=17, max_points=4097):
+    """
+    Calcula a potência refletida pela fbg em função do deslocamento do
+    comprimento de onda de bragg, em [-max_shift, max_shift]. O grid é
+    adaptativo: começa uniforme e os intervalos em que a interpolação linear
+    erra mais que a tolerância no ponto do meio são divididos, até todos
+    atenderem (ou até max_points pontos)
+
+    :param wls: Os comprimentos de onda do espectro
+    :type wls: np.ndarray
+
+    :param weights: Os pesos da integral (pesos do trapézio vezes o
+        espectro em W, como no simulate_piezo_fbg)
+    :type weights: np.ndarray
+
+    :param fbg_wl_bragg: O comprimento de onda de bragg sem deslocamento
+    :type fbg_wl_bragg: float
+
+    :param fbg_fwhm: A largura da fbg
+    :type fbg_fwhm: float
+
+    :param max_shift: O maior deslocamento (amplitude * sensitivity)
+    :type max_shift: float
+
+    :param tolerance: O erro máximo da interpolação, relativo à maior
+        potência da tabela
+    :type tolerance: float
+
+    :param initial_points: O número de pontos do grid inicial
+    :type initial_points: int
+
+    :param max_points: O número máximo de pontos da tabela
+    :type max_points: int
+
+    :return: Os deslocamentos (crescentes) e as potências
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    def powers(shifts):
+        return fbg_powers_kernel(fbg_wl_bragg + shifts, fbg_fwhm, wls,
+                                 weights)
+
+    if max_shift <= 0:
+        return np.zeros(1), powers(np.zeros(1))
+
+    shifts = np.linspace(-max_shift, max_shift, initial_points)
+    table = powers(shifts)
+    limit = tolerance * np.abs(table).max()
+
+    active = np.ones(len(shifts) - 1, dtype=bool)
+    while active.any():
+        intervals = np.flatnonzero(active)
+        if len(shifts) + len(intervals) > max_points:
+            break
+
+        middle = (shifts[intervals] + shifts[intervals + 1]) / 2
+        middle_powers = powers(middle)
+        error = np.abs(middle_powers -
+                       (table[intervals] + table[intervals + 1]) / 2)
+
+        split = error > limit
+        shifts = np.insert(shifts, intervals[split] + 1, middle[split])
+        table = np.insert(table, intervals[split] + 1, middle_powers[split])
+
+        # Só as duas metades dos intervalos divididos continuam ativas
+        active = np.zeros(len(active), dtype=bool)
+        active[intervals[split]] = True
+        active = np.repeat(active, np.where(active, 2, 1))
+
+    return shifts, table
+
+
+def harmonic_transform(powers, sample_rate, frequency, max_harmonic_index=2):
+    """
+    Calcula a transformada de Fourier das amostras de potência (normalizada
+    pelo número de amostras) nas frequências dos harmônicos. As frequências
+    dos harmônicos devem estar no grid da fft, como nas taxas de amostragem
+    padrão do simulate_piezo_fbg
+
+    :param powers: As amostras de potência. Se for 2D, cada linha é uma série
+    :type powers: np.ndarray
+
+    :param sample_rate: A taxa de amostragem, em Hz
+    :type sample_rate: float
+
+    :param frequency: A frequência fundamental, em Hz
+    :type frequency: float
+
+    :param max_harmonic_index: O harmônico máximo
+    :type max_harmonic_index: int
+
+    :return: Os valores complexos da transformada, um por harmônico (no
+        último eixo)
+    :rtype: np.ndarray
+    """
+    powers = np.asarray(powers)
+    n = powers.shape[-1]
+
+    fourier_frequencies = np.fft.fftfreq(n, d=1/sample_rate)
+    bins = [np.flatnonzero(fourier_frequencies == i*frequency)[0]
+            for i in range(max_harmonic_index + 1)]
+
+    return np.fft.fft(powers, axis=-1)[..., bins] / n
+
+
+def noise_ensemble(powers, sample_rate, frequency, electrical_noise,
+                   n_realizations, max_harmonic_index=2, seed=None,
+                   return_samples=False):
+    """
+    Aplica n_realizations realizações do ruído elétrico (normal, com desvio
+    padrão electrical_noise) na série de potência sem ruído e calcula os
+    harmônicos de cada uma. O ruído de todas as realizações é gerado de uma
+    vez por um np.random.Generator com a semente passada
+
+    :param powers: As amostras de potência sem ruído
+    :type powers: np.ndarray
+
+    :param sample_rate: A taxa de amostragem, em Hz
+    :type sample_rate: float
+
+    :param frequency: A frequência do piezoelétrico, em Hz
+    :type frequency: float
+
+    :param electrical_noise: O desvio padrão do ruído
+    :type electrical_noise: float
+
+    :param n_realizations: O número de realizações
+    :type n_realizations: int
+
+    :param max_harmonic_index: O harmônico máximo
+    :type max_harmonic_index: int
+
+    :param seed: A semente do gerador
+    :type seed: int
+
+    :param return_samples: Se deve retornar também as amostras com ruído,
+        um array (n_realizations, amostras)
+    :type return_samples: bool
+
+    :return: Uma tabela com uma linha por realização e harmônico, com as
+        colunas realization, harmonic, mag e phase (em graus)
+    :rtype: pd.DataFrame, (pd.DataFrame, np.ndarray)
+    """
+    rng = np.random.default_rng(seed)
+    powers = np.asarray(powers, dtype=np.float64)
+
+    samples = rng.standard_normal((n_realizations, len(powers)))
+    samples *= electrical_noise or 0
+    samples += powers
+
+    transform = harmonic_transform(samples, sample_rate, frequency,
+                                   max_harmonic_index)
+    harmonics = transform.shape[1]
+
+    df = pd.DataFrame({
+        'realization': np.repeat(np.arange(n_realizations), harmonics),
+        'harmonic': np.tile(np.arange(harmonics), n_realizations),
+        'mag': np.abs(transform).ravel(),
+        'phase': np.angle(transform, deg=True).ravel()})
+
+    if return_samples:
+        return df, samples
+    return df
+
+
+def summarize_ensemble(df):
+    """
+    Resume as realizações do noise_ensemble por harmônico. A média e o
+    desvio da fase são circulares, para não serem afetados pela volta em
+    ±180°
+
+    :param df: A tabela retornada pelo noise_ensemble
+    :type df: pd.DataFrame
+
+    :return: Uma tabela indexada pelo harmônico, com as colunas mag,
+        mag_std, phase e phase_std
+    :rtype: pd.DataFrame
+    """
+    phasors = np.exp(1j*np.deg2rad(df['phase'].to_numpy()))
+    grouped = pd.DataFrame({'harmonic': df['harmonic'].to_numpy(),
+                            'mag': df['mag'].to_numpy(),
+                            'phasor': phasors}).groupby('harmonic')
+
+    mean_phasor = grouped['phasor'].apply(lambda x: np.mean(x.to_numpy()))
+    resultant = np.clip(np.abs(mean_phasor.to_numpy()), 1e-300, 1)
+    circular_variance = np.maximum(-2*np.log(resultant), 0)
+
+    return pd.DataFrame({
+        'mag': grouped['mag'].mean(),
+        'mag_std': grouped['mag'].std(ddof=1),
+        'phase': np.angle(mean_phasor.to_numpy(), deg=True),
+        'phase_std': np.rad2deg(np.sqrt(circular_variance))},
+        index=mean_phasor.index)
+
+
 def save_samples(samples: list, path: str, info: dict):
     """Salva a lista de samples da função principal do .py"""
 
     array = np.array(samples)
     np.save(os.path.join(path, info["name"]), array)
+
+
+def simulate_piezo_fbg_grid(spectrum,
+                            frequency,
+                            amplitude,
+                            fbg_wl_bragg,
+                            fbg_fwhm,
+                            total_time=None,
+                            sample_rate=None,
+                            electrical_noise=None,
+                            sensitivity=6.475e-12,
+                            max_harmonic_index=2,
+                            seed=None,
+                            max_elements=2**24):
+    """
+    Simula a fbg acoplada ao piezoelétrico (como o simulate_piezo_fbg) para
+    todas as combinações dos parâmetros de uma vez, sobre o mesmo espectro.
+    A refletância de vários pontos e instantes é calculada em blocos e a
+    integração da potência vira um produto de matrizes com os pesos do
+    trapézio, ao invés de um laço por instante
+
+    :param spectrum: O espectro (em dB)
+    :type spectrum: np.ndarray
+
+    :param frequency: A(s) frequência(s) da tensão no piezoelétrico
+    :type frequency: float, list
+
+    :param amplitude: A(s) amplitude(s) da tensão no piezoelétrico
+    :type amplitude: float, list
+
+    :param fbg_wl_bragg: O(s) comprimento(s) de onda ressonante(s) da fbg
+    :type fbg_wl_bragg: float, list
+
+    :param fbg_fwhm: A(s) largura(s) da fbg
+    :type fbg_fwhm: float, list
+
+    :param total_time: A duração da simulação em segundos. 4 ciclos de cada
+        frequência por padrão
+    :type total_time: float
+
+    :param sample_rate: A taxa de amostragem em Hz. Por padrão é
+        (max_harmonic_index + 1) * 2 * frequency, para cada frequência
+    :type sample_rate: float
+
+    :param electrical_noise: O desvio padrão do ruído elétrico somado a cada
+        amostra de potência. Sem ruído por padrão
+    :type electrical_noise: float
+
+    :param sensitivity: A sensitividade do piezoelétrico (ver
+        simulate_piezo_fbg)
+    :type sensitivity: float
+
+    :param max_harmonic_index: O harmônico máximo calculado. 2 por padrão
+    :type max_harmonic_index: int
+
+    :param seed: A semente do gerador do ruído
+    :type seed: int
+
+    :param max_elements: O número máximo de elementos de cada bloco de
+        refletância (pontos x instantes x comprimentos de onda), que limita a
+        memória usada
+    :type max_elements: int
+
+    :return: Uma tabela com uma linha por combinação e harmônico, com as
+        colunas frequency, amplitude, fbg_wl_bragg, fbg_fwhm, harmonic, mag e
+        phase (em graus). O mag e a phase são os mesmos do simulate_piezo_fbg
+    :rtype: pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    wls = spectrum[::, 0]
+    weighted_spectrum = dBmW_to_W(spectrum[::, 1]) * trapz_weights(wls)
+
+    grid = np.meshgrid(np.atleast_1d(frequency), np.atleast_1d(amplitude),
+                       np.atleast_1d(fbg_wl_bragg), np.atleast_1d(fbg_fwhm),
+                       indexing='ij')
+    grid = [x.ravel().astype(np.float64) for x in grid]
+    harmonics = np.arange(max_harmonic_index + 1)
+
+    rows = []
+    for freq in np.unique(grid[0]):
+        selected = grid[0] == freq
+        amplitudes, wl_braggs, fwhms = (x[selected] for x in grid[1:])
+
+        sim_time = np.arange(0, total_time or 4/freq,
+                             1/(sample_rate or (max_harmonic_index + 1)*freq*2))
+        shifts = np.sin(2*pi*freq*sim_time) * sensitivity
+
+        centers = wl_braggs[:, None] + amplitudes[:, None] * shifts[None, :]
+        half_widths = fwhms[:, None, None] / 2
+
+        chunk = max(max_elements // (len(sim_time) * len(wls)), 1)
+        powers = np.empty((len(amplitudes), len(sim_time)))
+        for start in range(0, len(amplitudes), chunk):
+            stop = start + chunk
+            # (1 + u**8)**-1, com o u**8 por quadrados sucessivos
+            u = (wls[None, None, :] - centers[start:stop, :, None]) \
+                / half_widths[start:stop]
+            u *= u
+            u *= u
+            u *= u
+            u += 1
+            powers[start:stop] = (1 / u) @ weighted_spectrum
+
+        if electrical_noise:
+            powers += rng.standard_normal(powers.shape) * electrical_noise
+
+        # DFT só nas frequências dos harmônicos, normalizada como no fft
+        kernel = np.exp(-2j*pi*freq*np.outer(sim_time, harmonics))
+        transform = powers @ kernel / len(sim_time)
+
+        for h in harmonics:
+            rows.append(pd.DataFrame({
+                'frequency': freq,
+                'amplitude': amplitudes,
+                'fbg_wl_bragg': wl_braggs,
+                'fbg_fwhm': fwhms,
+                'harmonic': h,
+                'mag': np.abs(transform[:, h]),
+                'phase': np.angle(transform[:, h], deg=True)}))
+
+    return pd.concat(rows, ignore_index=True).sort_values(
+        ['frequency', 'amplitude', 'fbg_wl_bragg', 'fbg_fwhm', 'harmonic'],
+        ignore_index=True)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Esse módulo permite plotar os espectros sem atrasar o processamento. Os
+plots são guardados como tarefas e renderizados em paralelo por um conjunto
+de workers, usando o backend Agg do matplotlib diretamente (sem o pyplot),
+então as figuras são descartadas assim que salvas.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+def decimate_trace(xs, ys, max_points):
+    """
+    Reduz um traço para no máximo max_points pontos, mantendo o mínimo e o
+    máximo de cada intervalo. Como a tela não mostra mais pontos do que
+    pixels, o gráfico fica visualmente igual (os vales não somem)
+
+    :param xs: Os valores de x (ordenados)
+    :type xs: np.ndarray
+
+    :param ys: Os valores de y
+    :type ys: np.ndarray
+
+    :param max_points: O número máximo de pontos da saída. Se for None ou
+        maior que o traço, ele é retornado sem alteração
+    :type max_points: int
+
+    :return: Os xs e ys reduzidos
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    n = len(ys)
+    if max_points is None or n <= max_points:
+        return xs, ys
+
+    bins = max(max_points // 2, 1)
+    size = -(-n // bins)                    # divisão arredondando pra cima
+    padded = np.pad(ys, (0, bins * size - n), mode='edge').reshape(bins, size)
+
+    offsets = np.arange(bins) * size
+    idx = np.concatenate([offsets + padded.argmin(axis=1),
+                          offsets + padded.argmax(axis=1)])
+    idx = np.unique(np.minimum(idx, n - 1))
+
+    return xs[idx], ys[idx]
+
+
+def render_job(job):
+    """
+    Renderiza uma tarefa de plot e salva a imagem. É executada pelos workers,
+    mas pode ser chamada diretamente
+
+    :param job: Um dicionário com 'traces' (lista de (xs, ys)), 'markers'
+        (lista de (x, y)), 'plot_opts', 'filename', 'figsize' e 'dpi'
+    :type job: dict
+
+    :return: O nome do arquivo salvo
+    :rtype: str
+    """
+    fig = Figure(figsize=job['figsize'], dpi=job['dpi'])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    plot_opts = job['plot_opts']
+    ax.set_xlim(plot_opts['xlim'])
+    ax.set_ylim(plot_opts['ylim'])
+    ax.set_xlabel('Wavelength (nm)')
+    ax.set_ylabel('Optical power (dBm)')
+
+    for xs, ys in job['traces']:
+        ax.plot(xs, ys)
+    for x, y in job['markers']:
+        ax.plot(x, y, 'xk')
+
+    fig.savefig(job['filename'], transparent=False)
+
+    return job['filename']
+
+
+class SpectrumRenderer:
+    """
+    Uma classe que junta os plots dos espectros e renderiza em segundo plano.
+    O método plot_spectrum pode ser usado como passo do MassSpectraData no
+    lugar do funcs.plot_spectrum: ele só guarda os dados (já reduzidos para a
+    resolução da tela) e volta, enquanto os workers fazem o plot.
+
+    Deve ser fechado no final (close ou usando com 'with'), para esperar os
+    plots pendentes e salvar a figura compartilhada. O plot_spectrum pode ser
+    chamado de várias threads ao mesmo tempo (como no
+    MassSpectraData.aiter_results com threads), mas não de outros processos.
+    """
+    def __init__(self, save_folder=None, out_filename=None, plot_opts=None,
+                 max_points=2000, workers=None, executor='process',
+                 max_pending=64, figsize=(6.4, 4.8), dpi=100):
+        """
+        Inicia o objeto
+
+        :param save_folder: A pasta para salvar um plot por espectro. Se for
+            None, não salva os plots individuais
+        :type save_folder: str, path
+
+        :param out_filename: O arquivo para salvar uma figura com todos os
+            espectros juntos (como no exemplo get_resonant_info). Se for None,
+            essa figura não é feita
+        :type out_filename: str, path
+
+        :param plot_opts: Opções do plot, com 'xlim' e 'ylim'. Por padrão,
+            usa os limites do espectro e (-100, 0)
+        :type plot_opts: dict
+
+        :param max_points: O número máximo de pontos por traço (ver
+            decimate_trace). None para não reduzir
+        :type max_points: int
+
+        :param workers: O número de workers. Usa o padrão do executor se for
+            None
+        :type workers: int
+
+        :param executor: 'process' ou 'thread', o tipo de worker
+        :type executor: str
+
+        :param max_pending: O número máximo de plots esperando na fila. Quando
+            é atingido, o plot_spectrum espera o mais antigo terminar, para
+            a memória não crescer sem limite
+        :type max_pending: int
+
+        :param figsize: O tamanho das figuras, em polegadas
+        :type figsize: (float, float)
+
+        :param dpi: A resolução das figuras
+        :type dpi: int
+        """
+        if executor not in ('process', 'thread'):
+            raise ValueError(f'{executor} é um executor inválido, os '
+                             f'implementados são "process" e "thread"')
+
+        self.save_folder = save_folder
+        self.out_filename = out_filename
+        self.plot_opts = plot_opts
+        self.max_points = max_points
+        self.workers = workers
+        self.executor = executor
+        self.max_pending = max_pending
+        self.figsize = figsize
+        self.dpi = dpi
+
+        self._pool = None
+        self._pending = list()
+        self._traces = list()
+        self._markers = list()
+        self._xlim = None
+        # Protege o pool, a fila e a figura compartilhada
+        self._lock = threading.RLock()
+
+    def _submit(self, job):
+        with self._lock:
+            if self._pool is None:
+                pool_class = ProcessPoolExecutor \
+                    if self.executor == 'process' else ThreadPoolExecutor
+                self._pool = pool_class(self.workers)
+
+            self._pending = [x for x in self._pending if not x.done()]
+            while len(self._pending) >= self.max_pending:
+                self._pending.pop(0).result()
+
+            self._pending.append(self._pool.submit(render_job, job))
+
+    def plot_spectrum(self, spectrum, info, quiet=False):
+        """
+        Passo que guarda o plot do espectro, com o vale marcado com um x se
+        tiver sido encontrado. Os argumentos e o retorno são como no
+        funcs.plot_spectrum
+
+        :param spectrum: O espectro
+        :type spectrum: np.ndarray
+
+        :param info: O dicionário com as informações
+        :type info: dict
+
+        :param quiet: Se o programa deve printar sobre o progresso
+        :type quiet: bool
+
+        :return: O espectro original e um dicionário vazio
+        :rtype: (np.ndarray, dict)
+        """
+        if not quiet:
+            print(f'Agendando plot')
+
+        xs, ys = decimate_trace(spectrum[::, 0], spectrum[::, 1],
+                                self.max_points)
+        xs, ys = np.array(xs), np.array(ys)
+
+        markers = []
+        if info.get('resonant_wl') is not None:
+            markers.append((info['resonant_wl'], info['resonant_wl_power']))
+
+        if self.save_folder is not None:
+            plot_opts = self.plot_opts or {'xlim': (xs[0], xs[-1]),
+                                           'ylim': (-100, 0)}
+            filename = os.path.join(self.save_folder, f'_{info["name"]}.png')
+            self._submit({'traces': [(xs, ys)], 'markers': markers,
+                          'plot_opts': plot_opts, 'filename': filename,
+                          'figsize': self.figsize, 'dpi': self.dpi})
+
+        if self.out_filename is not None:
+            with self._lock:
+                self._traces.append((xs, ys))
+                self._markers.extend(markers)
+                self._xlim = self._xlim or (xs[0], xs[-1])
+
+        return spectrum, dict()
+
+    def close(self):
+        """
+        Salva a figura compartilhada (se tiver), espera os plots pendentes e
+        encerra os workers. Erros dos workers são levantados aqui
+
+        :return: None
+        """
+        with self._lock:
+            if self.out_filename is not None and self._traces:
+                plot_opts = self.plot_opts or {'xlim': self._xlim,
+                                               'ylim': (-100, 0)}
+                self._submit({'traces': self._traces,
+                              'markers': self._markers,
+                              'plot_opts': plot_opts,
+                              'filename': self.out_filename,
+                              'figsize': self.figsize, 'dpi': self.dpi})
+                self._traces, self._markers = list(), list()
+
+            try:
+                for future in self._pending:
+                    future.result()
+            finally:
+                self._pending = list()
+                if self._pool is not None:
+                    self._pool.shutdown()
+                    self._pool = None
+
+    def __getstate__(self):
+        # Em outro processo, os traços da figura compartilhada se perderiam
+        raise TypeError('O SpectrumRenderer não pode ser enviado para outro '
+                        'processo. Use threads (ou o iter_results)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Esse módulo cria um índice dos espectros de uma ou mais pastas, a partir do
+instante de aquisição que está no nome dos arquivos (como em
+20230503_13_57_44_600.txt). O índice fica salvo em cada pasta e só é
+atualizado para os arquivos novos ou modificados, então selecionar os
+espectros de um intervalo de tempo não precisa listar e filtrar tudo de novo.
+"""
+
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from process_spectra.utils import remove_extension
+
+
+TIMESTAMP_FORMAT = '%Y%m%d_%H_%M_%S_%f'
+INDEX_FILENAME = '.spectra_index.csv'
+INDEX_COLUMNS = ['path', 'timestamp', 'size', 'mtime_ns']
+
+
+def parse_timestamp(filename, fmt=TIMESTAMP_FORMAT):
+    """
+    Extrai o instante de aquisição do nome do arquivo
+
+    :param filename: O nome (ou caminho) do arquivo
+    :type filename: str
+
+    :param fmt: O formato do nome, como no datetime.strptime. O padrão é o
+        dos arquivos de exemplo (20230503_13_57_44_600)
+    :type fmt: str
+
+    :return: O instante, ou None se o nome não estiver no formato
+    :rtype: datetime
+    """
+    try:
+        return datetime.strptime(remove_extension(filename), fmt)
+    except ValueError:
+        return None
+
+
+class SpectraIndex:
+    """
+    Um índice dos espectros de algumas pastas, ordenado pelo instante de
+    aquisição
+    """
+    def __init__(self, directories, fmt=TIMESTAMP_FORMAT,
+                 extensions=('.txt', ), index_filename=INDEX_FILENAME,
+                 update=True):
+        """
+        Inicia o índice, carregando o que já está salvo nas pastas
+
+        :param directories: A pasta ou uma lista de pastas
+        :type directories: str, list
+
+        :param fmt: O formato do nome dos arquivos (ver parse_timestamp)
+        :type fmt: str
+
+        :param extensions: As extensões dos arquivos de espectro
+        :type extensions: tuple
+
+        :param index_filename: O nome do arquivo do índice salvo em cada
+            pasta. Se for None, o índice não é salvo
+        :type index_filename: str
+
+        :param update: Se deve atualizar o índice ao iniciar
+        :type update: bool
+        """
+        if isinstance(directories, (str, os.PathLike)):
+            directories = [directories]
+
+        self.directories = [os.fspath(x) for x in directories]
+        self.fmt = fmt
+        self.extensions = tuple(extensions)
+        self.index_filename = index_filename
+
+        self.df = pd.DataFrame(columns=INDEX_COLUMNS)
+
+        if update:
+            self.update()
+
+    def __len__(self):
+        return len(self.df)
+
+    def _load(self, directory):
+        if self.index_filename is None:
+            return pd.DataFrame(columns=INDEX_COLUMNS)
+
+        path = os.path.join(directory, self.index_filename)
+        if not os.path.isfile(path):
+            return pd.DataFrame(columns=INDEX_COLUMNS)
+
+        df = pd.read_csv(path, parse_dates=['timestamp'])
+        df['path'] = [os.path.join(directory, x) for x in df['path']]
+        return df
+
+    def _save(self, directory, df):
+        if self.index_filename is None:
+            return
+
+        df = df.assign(path=[os.path.basename(x) for x in df['path']])
+        df.to_csv(os.path.join(directory, self.index_filename), index=False)
+
+    def update(self):
+        """
+        Atualiza o índice: lê só os arquivos novos ou com tamanho ou data de
+        modificação diferentes e remove os que não existem mais
+
+        :return: O número de arquivos novos ou modificados
+        :rtype: int
+        """
+        frames = list()
+        changed = 0
+
+        for directory in self.directories:
+            old = self._load(directory).set_index('path')
+
+            rows = list()
+            new = 0
+            for entry in os.scandir(directory):
+                if not entry.is_file() or \
+                        not entry.name.endswith(self.extensions):
+                    continue
+
+                stat = entry.stat()
+                path = os.path.join(directory, entry.name)
+
+                if path in old.index and \
+                        old.at[path, 'size'] == stat.st_size and \
+                        old.at[path, 'mtime_ns'] == stat.st_mtime_ns:
+                    timestamp = old.at[path, 'timestamp']
+                else:
+                    timestamp = parse_timestamp(entry.name, self.fmt)
+                    new += 1
+
+                rows.append((path, timestamp, stat.st_size, stat.st_mtime_ns))
+
+            df = pd.DataFrame(rows, columns=INDEX_COLUMNS)
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+
+            if new or len(df) != len(old):
+                self._save(directory, df)
+            frames.append(df)
+            changed += new
+
+        frames = [x for x in frames if len(x)]
+        df = pd.concat(frames, ignore_index=True) if frames else \
+            pd.DataFrame(columns=INDEX_COLUMNS)
+        self.df = df.sort_values(['timestamp', 'path'], na_position='last',
+                                 ignore_index=True)
+
+        return changed
+
+    def select(self, start=None, end=None):
+        """
+        Seleciona os espectros com instante de aquisição em [start, end).
+        Arquivos sem instante no nome não entram
+
+        :param start: O início do intervalo (datetime ou str, como
+            '2023-05-03 13:00'). Sem limite se for None
+        :type start: datetime, str
+
+        :param end: O fim do intervalo (não incluso). Sem limite se for None
+        :type end: datetime, str
+
+        :return: As linhas do índice (path, timestamp, size, mtime_ns)
+        :rtype: pd.DataFrame
+        """
+        timestamps = pd.DatetimeIndex(self.df['timestamp'].dropna())
+
+        first = 0 if start is None else \
+            timestamps.searchsorted(pd.Timestamp(start), side='left')
+        last = len(timestamps) if end is None else \
+            timestamps.searchsorted(pd.Timestamp(end), side='left')
+
+        return self.df.iloc[first:last]
+
+    def filenames(self, start=None, end=None):
+        """
+        Os caminhos dos espectros em [start, end), em ordem de aquisição.
+        Pode ser passado direto para o MassSpectraData
+
+        :param start: O início do intervalo (ver select)
+        :type start: datetime, str
+
+        :param end: O fim do intervalo (ver select)
+        :type end: datetime, str
+
+        :return: A lista de caminhos
+        :rtype: list
+        """
+        return list(self.select(start, end)['path'])
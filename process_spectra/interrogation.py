@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Esse módulo roda os passos de processamento em espectros que chegam ao vivo
+(de um socket ou pipe local), ao invés de arquivos.
+
+Os espectros chegam em um protocolo binário simples: cada quadro tem um
+cabeçalho com a assinatura b'PSPC', o número de sequência, o instante de
+aquisição e o número de pontos, seguido dos pontos (comprimento de onda e
+potência, float64 little-endian, intercalados). Os quadros vão para um
+buffer circular de tamanho fixo, e uma thread aplica os passos em cada
+espectro, publicando os resultados com estatísticas de latência e de quadros
+descartados.
+"""
+
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from process_spectra.funcs._context import spectrum_context
+from process_spectra.utils import lorentz
+
+
+FRAME_MAGIC = b'PSPC'
+FRAME_HEADER = struct.Struct('<4sIdI')
+
+# De quanto em quanto tempo o serve verifica se o stop foi chamado enquanto
+# espera a conexão, em segundos
+ACCEPT_INTERVAL = 0.1
+
+
+def encode_frame(spectrum, sequence, timestamp=None):
+    """
+    Codifica um espectro em um quadro do protocolo
+
+    :param spectrum: O espectro, com shape (n, 2)
+    :type spectrum: np.ndarray
+
+    :param sequence: O número de sequência do quadro
+    :type sequence: int
+
+    :param timestamp: O instante de aquisição (time.time()). Usa o instante
+        atual por padrão
+    :type timestamp: float
+
+    :return: Os bytes do quadro
+    :rtype: bytes
+    """
+    timestamp = time.time() if timestamp is None else timestamp
+    payload = np.ascontiguousarray(spectrum, dtype='<f8')
+    header = FRAME_HEADER.pack(FRAME_MAGIC, sequence & 0xFFFFFFFF, timestamp,
+                               payload.shape[0])
+
+    return header + payload.tobytes()
+
+
+def _read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    """
+    Lê um quadro de um stream binário (um arquivo, pipe ou o makefile('rb')
+    de um socket)
+
+    :param stream: O stream, com um método read
+    :type stream: io.BufferedReader
+
+    :return: O número de sequência, o instante de aquisição e o espectro
+        (um array que pode ser modificado), ou None se o stream acabou
+    :rtype: (int, float, np.ndarray)
+    """
+    header = _read_exactly(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+
+    magic, sequence, timestamp, n_points = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ValueError('Quadro inválido, o stream perdeu o sincronismo')
+
+    payload = _read_exactly(stream, n_points * 16)
+    if payload is None:
+        return None
+
+    # O payload é um bytearray, então o array não é somente leitura
+    spectrum = np.frombuffer(payload, dtype='<f8').reshape(n_points, 2)
+
+    return sequence, timestamp, spectrum
+
+
+def simulate_feed(stream, n_spectra, rate=100, wl_limits=(1.5e-6, 1.6e-6),
+                  wl_step=50e-12, drift=1e-12, noise=0.05, seed=None):
+    """
+    Simula um interrogador, escrevendo no stream espectros com um vale
+    lorentziano que se desloca com o tempo. Serve como fonte local para
+    testar o InterrogationEngine
+
+    :param stream: O stream de saída, com um método write
+    :type stream: io.BufferedWriter
+
+    :param n_spectra: Quantos espectros enviar
+    :type n_spectra: int
+
+    :param rate: A taxa de envio, em espectros por segundo. Se for None,
+        envia o mais rápido possível
+    :type rate: float
+
+    :param wl_limits: Os limites do grid de comprimento de onda
+    :type wl_limits: (float, float)
+
+    :param wl_step: O passo do grid
+    :type wl_step: float
+
+    :param drift: O deslocamento do vale por espectro
+    :type drift: float
+
+    :param noise: O desvio padrão do ruído, em dB
+    :type noise: float
+
+    :param seed: A semente do gerador de números aleatórios
+    :type seed: int
+
+    :return: None
+    """
+    rng = np.random.default_rng(seed)
+    wl = np.arange(wl_limits[0], wl_limits[1], wl_step)
+    center = (wl_limits[0] + wl_limits[1]) / 2
+    spectrum = np.empty((len(wl), 2))
+    spectrum[::, 0] = wl
+
+    start = time.perf_counter()
+    for i in range(n_spectra):
+        spectrum[::, 1] = lorentz(wl, -20, center + i * drift, 2e-9, -10)
+        spectrum[::, 1] += rng.normal(0, noise, len(wl))
+        stream.write(encode_frame(spectrum, i))
+
+        if rate:
+            delay = start + (i + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    stream.flush()
+
+
+class RingBuffer:
+    """
+    Um buffer circular de tamanho fixo, seguro para uma thread escrevendo e
+    outra lendo. Quando está cheio, pode bloquear quem escreve
+    (backpressure) ou descartar o item mais antigo, o que limita a latência
+    """
+    def __init__(self, capacity, policy='drop'):
+        """
+        Inicia o buffer
+
+        :param capacity: O número máximo de itens
+        :type capacity: int
+
+        :param policy: 'drop' para descartar o item mais antigo quando
+            cheio ou 'block' para esperar espaço
+        :type policy: str
+        """
+        if policy not in ('drop', 'block'):
+            raise ValueError(f'{policy} é uma política inválida, as '
+                             f'implementadas são "drop" e "block"')
+
+        self.capacity = capacity
+        self.policy = policy
+        self.dropped = 0
+
+        self._items = deque()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def closed(self):
+        """Se o buffer foi fechado"""
+        return self._closed
+
+    def put(self, item):
+        """
+        Coloca um item no buffer
+
+        :param item: O item
+        :type item: Any
+
+        :return: True se o item entrou, False se o buffer estava fechado
+        :rtype: bool
+        """
+        with self._condition:
+            if self.policy == 'block':
+                while len(self._items) >= self.capacity and not self._closed:
+                    self._condition.wait()
+            elif len(self._items) >= self.capacity:
+                self._items.popleft()
+                self.dropped += 1
+
+            if self._closed:
+                return False
+
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Retira o item mais antigo, esperando até ter um
+
+        :param timeout: O tempo máximo de espera em segundos
+        :type timeout: float
+
+        :return: O item, ou None se o buffer foi fechado e está vazio (ou o
+            tempo acabou)
+        :rtype: Any
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Fecha o buffer. Os itens que já estão nele ainda podem ser lidos
+
+        :return: None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class InterrogationEngine:
+    """
+    Aplica uma sequência de passos (como no MassSpectraData) em espectros que
+    chegam ao vivo e publica os resultados
+    """
+    def __init__(self, capacity=64, policy='drop', on_result=None,
+                 latency_window=1000, quiet=True):
+        """
+        Inicia o objeto
+
+        :param capacity: O tamanho do buffer circular de espectros
+        :type capacity: int
+
+        :param policy: O que fazer quando o processamento está atrasado e o
+            buffer enche: 'drop' descarta os espectros mais antigos e
+            'block' para a leitura (backpressure)
+        :type policy: str
+
+        :param on_result: Uma função chamada com o dicionário de informações
+            de cada espectro processado. Se for None, os resultados ficam em
+            self.results (até latency_window resultados)
+        :type on_result: function
+
+        :param latency_window: Quantas latências recentes guardar para as
+            estatísticas
+        :type latency_window: int
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+        """
+        self.buffer = RingBuffer(capacity, policy)
+        self.on_result = on_result
+        self.quiet = quiet
+
+        self.steps = list()
+        self.kwargs = list()
+
+        self.results = deque(maxlen=latency_window)
+        self.received = 0
+        self.processed = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._threads = list()
+
+    def add_step(self, step, kwargs=None):
+        """
+        Adiciona um passo, como no MassSpectraData.add_step
+
+        :param step: A função a ser adicionada
+        :type step: function
+
+        :param kwargs: Os argumentos da função
+        :type kwargs: dict, optional
+
+        :return: None
+        """
+        self.steps.append(step)
+        self.kwargs.append(kwargs or dict())
+
+    def process(self, sequence, timestamp, spectrum):
+        """
+        Aplica os passos em um espectro e publica o resultado
+
+        Os passos seguem a mesma convenção do MassSpectraData.process_file:
+        o espectro None encerra os passos e (None, None) descarta o espectro
+
+        :return: O dicionário de informações (None se foi descartado)
+        :rtype: dict
+        """
+        info = {'name': str(sequence), 'sequence': sequence,
+                'timestamp': timestamp}
+
+        with spectrum_context():
+            for c, step in enumerate(self.steps):
+                if spectrum is None:
+                    break
+
+                spectrum, _info = step(spectrum, info, **self.kwargs[c])
+                if _info is None:
+                    self.processed += 1
+                    return None
+                info = {**info, **_info}
+
+        info['latency'] = time.time() - timestamp
+        self._latencies.append(info['latency'])
+        self.processed += 1
+
+        if self.on_result is None:
+            self.results.append(info)
+        else:
+            self.on_result(info)
+
+        return info
+
+    def _read(self, stream):
+        try:
+            while True:
+                frame = read_frame(stream)
+                if frame is None:
+                    break
+                # Conta antes do put, para o received nunca ser menor que o
+                # processed
+                self.received += 1
+                if not self.buffer.put(frame):
+                    break
+        finally:
+            self.buffer.close()
+
+    def _work(self):
+        while True:
+            frame = self.buffer.get()
+            if frame is None:
+                break
+            try:
+                self.process(*frame)
+            except Exception as error:
+                self.errors += 1
+                if not self.quiet:
+                    print(f'Erro no espectro {frame[0]}: {error}')
+
+    def start(self, stream):
+        """
+        Começa a ler os quadros do stream e processar em segundo plano
+
+        :param stream: O stream binário de entrada (arquivo, pipe ou o
+            makefile('rb') de um socket)
+        :type stream: io.BufferedReader
+
+        :return: None
+        """
+        self._threads = [threading.Thread(target=self._read, args=(stream, ),
+                                          daemon=True),
+                         threading.Thread(target=self._work, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def serve(self, address=('127.0.0.1', 0)):
+        """
+        Abre um socket TCP local e processa os quadros da primeira conexão
+
+        :param address: O endereço (host, porta). A porta 0 escolhe uma
+            livre
+        :type address: (str, int)
+
+        :return: O endereço em que o socket está escutando
+        :rtype: (str, int)
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(address)
+        server.listen(1)
+
+        # O accept espera com timeout para o stop funcionar antes de alguém
+        # conectar
+        server.settimeout(ACCEPT_INTERVAL)
+
+        def accept():
+            with server:
+                while True:
+                    try:
+                        connection, _ = server.accept()
+                        break
+                    except socket.timeout:
+                        if self.buffer.closed:
+                            return
+            connection.settimeout(None)
+            with connection, connection.makefile('rb') as stream:
+                self._read(stream)
+
+        self._threads = [threading.Thread(target=accept, daemon=True),
+                         threading.Thread(target=self._work, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+        return server.getsockname()[:2]
+
+    def stop(self):
+        """
+        Para de aceitar espectros (e de esperar a conexão, no serve). Os que
+        já estão no buffer ainda são processados
+
+        :return: None
+        """
+        self.buffer.close()
+
+    def join(self, timeout=None):
+        """
+        Espera o stream acabar e todos os espectros serem processados
+
+        :param timeout: O tempo máximo de espera por thread, em segundos
+        :type timeout: float
+
+        :return: None
+        """
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        """
+        Retorna as estatísticas de processamento
+
+        :return: Um dicionário com os espectros recebidos, processados,
+            descartados, com erro, o tamanho atual do buffer e a latência
+            (média, p99 e máxima, em segundos) dos mais recentes
+        :rtype: dict
+        """
+        latencies = np.array(self._latencies)
+        stats = {'received': self.received, 'processed': self.processed,
+                 'dropped': self.buffer.dropped, 'errors': self.errors,
+                 'buffered': len(self.buffer)}
+
+        if len(latencies):
+            stats['latency_mean'] = latencies.mean()
+            stats['latency_p99'] = np.percentile(latencies, 99)
+            stats['latency_max'] = latencies.max()
+
+        return stats
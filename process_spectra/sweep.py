@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Esse módulo roda a mesma sequência de passos com várias combinações de
+parâmetros. As combinações formam uma árvore: cada espectro é carregado uma
+vez, e cada passo é calculado uma vez para cada prefixo de parâmetros
+diferente, se ramificando só nos passos que têm uma grade de valores.
+"""
+
+from itertools import product
+
+import pandas as pd
+
+from process_spectra.funcs import load_spectrum
+from process_spectra.funcs._context import spectrum_context, stream
+
+
+class ParameterSweep:
+    """
+    Uma classe parecida com o MassSpectraData, mas em que os passos podem
+    ter uma grade de valores para alguns argumentos. O resultado é uma tabela
+    longa, com uma linha por espectro e combinação de parâmetros
+    """
+    def __init__(self, filenames, out_filename=None, load_function=None):
+        """
+        Inicia o objeto
+
+        :param filenames: Um array like com os nomes dos arquivos dos
+            espectros a serem abertos
+        :type filenames: list
+
+        :param out_filename: O arquivo de saída
+        :type out_filename: str
+
+        :param load_function: A função de carregamento dos espectros.
+            funcs.load_spectrum por padrão
+        :type load_function: function
+        """
+        self.filenames = list(filenames)
+        self.load_spectrum = load_function or load_spectrum
+        self.out_filename = out_filename
+
+        self.steps = list()
+        self.labels = list()
+        self.variants = list()
+
+        self.df = pd.DataFrame(columns=['name', 'parameter_set'])
+
+    def add_step(self, step, kwargs=None, grid=None):
+        """
+        Adiciona um passo
+
+        :param step: A função a ser adicionada, como no MassSpectraData
+        :type step: function
+
+        :param kwargs: Os argumentos fixos da função
+        :type kwargs: dict, optional
+
+        :param grid: Um dicionário com o nome de argumentos e a lista de
+            valores a testar para cada um. Todas as combinações são testadas
+        :type grid: dict, optional
+
+        :return: None
+        """
+        kwargs = kwargs or dict()
+        grid = grid or dict()
+
+        label = getattr(step, '__name__', 'step')
+        if label in self.labels:
+            label = f'{label}_{len(self.steps)}'
+
+        variants = list()
+        for values in product(*grid.values()):
+            params = dict(zip(grid.keys(), values))
+            variants.append(({f'{label}.{k}': v for k, v in params.items()},
+                             {**kwargs, **params}))
+
+        self.steps.append(step)
+        self.labels.append(label)
+        self.variants.append(variants)
+
+    @property
+    def n_parameter_sets(self):
+        """O número de combinações de parâmetros"""
+        total = 1
+        for variants in self.variants:
+            total *= len(variants)
+        return total
+
+    def _walk(self, level, spectrum, info, params, parameter_set, rows):
+        if level == len(self.steps):
+            rows.append({'name': info['name'],
+                         'parameter_set': parameter_set, **params, **info})
+            return
+
+        if spectrum is None:
+            # O ramo acabou antes dos últimos passos (ver
+            # MassSpectraData.process_file). O resultado é o mesmo para
+            # todas as combinações dos passos que não rodaram, então tem uma
+            # linha para cada uma, com o número da combinação completo
+            for variants in product(*(enumerate(variants) for variants
+                                      in self.variants[level:])):
+                _params, _parameter_set = dict(params), parameter_set
+                for k, (v, (labels, _)) in enumerate(variants):
+                    _params.update(labels)
+                    _parameter_set = _parameter_set * \
+                        len(self.variants[level + k]) + v
+                rows.append({'name': info['name'],
+                             'parameter_set': _parameter_set, **_params,
+                             **info})
+            return
+
+        # Os passos com estado (como o SpectrumAverager) guardam um estado
+        # para cada combinação dos passos anteriores
+        variants = self.variants[level]
+        for v, (labels, kwargs) in enumerate(variants):
+            with stream((level, parameter_set)):
+                _spectrum, _info = self.steps[level](spectrum, info,
+                                                     **kwargs)
+            if _info is None:
+                continue
+            self._walk(level + 1, _spectrum, {**info, **_info},
+                       {**params, **labels},
+                       parameter_set * len(variants) + v, rows)
+
+    def process_file(self, filename, **load_kwargs):
+        """
+        Carrega um espectro e roda todas as combinações nele
+
+        :param filename: O nome do arquivo do espectro
+        :type filename: str
+
+        :return: Uma lista com o dicionário de informações de cada
+            combinação, incluindo os parâmetros e o 'parameter_set' (o número
+            da combinação)
+        :rtype: list
+        """
+        spectrum, info = self.load_spectrum(filename, **load_kwargs)
+
+        # As combinações que repetem um passo no mesmo espectro reaproveitam
+        # os resultados em cache (ver funcs._context)
+        rows = list()
+        with spectrum_context():
+            self._walk(0, spectrum, info, dict(), 0, rows)
+
+        return rows
+
+    def run(self, quiet=False, **load_kwargs):
+        """
+        Roda todas as combinações em todos os espectros e guarda a tabela em
+        self.df
+
+        :param quiet: Se o programa deve printar o progresso
+        :type quiet: bool
+
+        :return: None
+        """
+        rows = list()
+        for i, filename in enumerate(self.filenames):
+            if not quiet:
+                padding = 5 * "-"
+                print(f'\n{padding}calculando {i + 1}/'
+                      f'{len(self.filenames)} '
+                      f'({self.n_parameter_sets} combinações){padding}')
+
+            rows.extend(self.process_file(filename, **load_kwargs))
+
+        self.df = pd.concat([self.df, pd.DataFrame(rows)],
+                            ignore_index=True, axis=0, join='outer')
+
+        if self.out_filename:
+            self.export_csv(self.out_filename)
+
+    def export_csv(self, export_name):
+        """
+        Exporta a tabela atual como um csv
+
+        :param export_name: O nome do arquivo de saída
+        :type export_name: str
+
+        :return: None
+        """
+        if export_name[-4:] != '.csv':
+            export_name += '.csv'
+
+        self.df.sort_values(['parameter_set', 'name']).\
+            to_csv(export_name, index=False, sep=',', decimal='.')
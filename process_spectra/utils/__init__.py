@@ -5,8 +5,10 @@ import numpy as np
 import os
 from scipy.interpolate import interp1d
 
+from process_spectra.utils.accel import kernel
 
-def get_power(y, x=None, unit='dBm', noise=None):
+
+def get_power(y, x=None, unit='dBm', noise=None, weights=None):
     """
     Calcula a potência de um espectro (integral com np.trapz)
 
@@ -23,6 +25,10 @@ def get_power(y, x=None, unit='dBm', noise=None):
         como variância na geração de um aleatório
     :type noise: float
 
+    :param weights: Os pesos do trapézio do grid (ver trapz_weights). Se
+        forem passados, o x é ignorado e a integral vira um produto escalar
+    :type weights: np array
+
     :return: A potência calculada, em Watts
     """
 
@@ -32,7 +38,10 @@ def get_power(y, x=None, unit='dBm', noise=None):
         raise ValueError(f'{unit} é uma unidade inválida, '
                          f'as implementadas são "dBm" e "W"')
 
-    power = np.trapz(np.abs(y), x)          # A potência fica bem baixa,
+    if weights is not None:
+        power = np.dot(weights, np.abs(y))
+    else:
+        power = np.trapz(np.abs(y), x)      # A potência fica bem baixa,
                                             # na casa dos 1e-18
 
     if noise:
@@ -41,6 +50,26 @@ def get_power(y, x=None, unit='dBm', noise=None):
     return power
 
 
+def trapz_weights(x):
+    """
+    Calcula os pesos da regra do trapézio para o grid x, de forma que
+    np.trapz(y, x) == np.dot(trapz_weights(x), y). Com os pesos calculados
+    uma vez, integrar vários espectros no mesmo grid vira um produto escalar
+
+    :param x: O grid (comprimentos de onda)
+    :type x: np array
+
+    :return: Os pesos, um por ponto do grid
+    :rtype: np array
+    """
+    dx = np.diff(x)
+    weights = np.zeros(len(x))
+    weights[:-1] += dx / 2
+    weights[1:] += dx / 2
+
+    return weights
+
+
 def dBmW_to_W(dBm):
     """
     Transforma de dBmW para W
@@ -115,10 +144,11 @@ def gauss(x, a, x0, sigma, bias):
     :param bias: O deslocamento vertical
     :type bias: float
 
-    :return: O valor no ponto específicado
+    :return: O valor no ponto específicado (calculado pelo backend atual,
+        ver utils.accel)
     :rtype: Mesmo de x
     """
-    return a*np.exp(-(x-x0)**2/(2*sigma**2)) + bias
+    return kernel('gauss')(x, a, x0, sigma, bias)
 
 
 def lorentz(x, a, x0, w, bias):
@@ -140,7 +170,8 @@ def lorentz(x, a, x0, w, bias):
     :param bias: O deslocamento vertical
     :type bias: float
 
-    :return: O valor no ponto específicado
+    :return: O valor no ponto específicado (calculado pelo backend atual,
+        ver utils.accel)
     :rtype: Mesmo de x
     """
-    return a*(1 + ((x - x0)/(w/2))**2)**(-1) + bias
+    return kernel('lorentz')(x, a, x0, w, bias)
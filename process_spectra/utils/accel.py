@@ -0,0 +1,173 @@
+"""
+Esse módulo tem os kernels numéricos mais chamados do pacote (as funções de
+ajuste, a refletância da fbg e o laço de integração da simulação do
+piezoelétrico) em duas versões: uma em NumPy puro e uma compilada com o
+Numba, que não aloca arrays temporários. O Numba é opcional: se estiver
+instalado é usado automaticamente, e se não estiver os kernels em NumPy são
+usados. O Numba só é importado quando um kernel dele é pedido pela primeira
+vez, e cada kernel só é compilado na primeira chamada (para os tipos dos
+argumentos), então importar o pacote não compila nada.
+
+A escolha pode ser forçada com a variável de ambiente
+PROCESS_SPECTRA_BACKEND ('numpy', 'numba' ou 'auto') ou com o set_backend.
+"""
+
+import os
+from importlib.util import find_spec
+
+import numpy as np
+
+
+BACKEND_ENV = 'PROCESS_SPECTRA_BACKEND'
+
+
+def _lorentz(x, a, x0, w, bias):
+    return a*(1 + ((x - x0)/(w/2))**2)**(-1) + bias
+
+
+def _gauss(x, a, x0, sigma, bias):
+    return a*np.exp(-(x-x0)**2/(2*sigma**2)) + bias
+
+
+def _fbg_reflectance(wl_bragg, fwhm, wls):
+    return (1 + ((wls - wl_bragg)/(fwhm/2))**8)**(-1)
+
+
+def _fbg_powers(wl_braggs, fwhm, wls, weights):
+    powers = np.empty(len(wl_braggs))
+    for i, wl_bragg in enumerate(wl_braggs):
+        powers[i] = np.dot(_fbg_reflectance(wl_bragg, fwhm, wls), weights)
+    return powers
+
+
+def _build_numba():
+    import numba
+
+    # Sem assinaturas, os ufuncs são compilados na primeira chamada
+    @numba.vectorize(cache=True)
+    def lorentz(x, a, x0, w, bias):
+        u = (x - x0) / (w / 2)
+        return a / (1 + u * u) + bias
+
+    @numba.vectorize(cache=True)
+    def gauss(x, a, x0, sigma, bias):
+        return a * np.exp(-(x - x0) ** 2 / (2 * sigma ** 2)) + bias
+
+    @numba.vectorize(cache=True)
+    def fbg_reflectance(wl_bragg, fwhm, wl):
+        u = (wl - wl_bragg) / (fwhm / 2)
+        u2 = u * u
+        u4 = u2 * u2
+        return 1 / (1 + u4 * u4)
+
+    @numba.njit(parallel=True, cache=True)
+    def fbg_powers(wl_braggs, fwhm, wls, weights):
+        half_width = fwhm / 2
+        powers = np.empty(len(wl_braggs))
+        for i in numba.prange(len(wl_braggs)):
+            total = 0.
+            for j in range(len(wls)):
+                u = (wls[j] - wl_braggs[i]) / half_width
+                u2 = u * u
+                u4 = u2 * u2
+                total += weights[j] / (1 + u4 * u4)
+            powers[i] = total
+        return powers
+
+    def _fbg_reflectance(wl_bragg, fwhm, wls):
+        return fbg_reflectance(wl_bragg, fwhm, wls)
+
+    def _fbg_powers(wl_braggs, fwhm, wls, weights):
+        return fbg_powers(np.ascontiguousarray(wl_braggs, dtype=np.float64),
+                          float(fwhm),
+                          np.ascontiguousarray(wls, dtype=np.float64),
+                          np.ascontiguousarray(weights, dtype=np.float64))
+
+    return {'lorentz': lorentz, 'gauss': gauss,
+            'fbg_reflectance': _fbg_reflectance, 'fbg_powers': _fbg_powers}
+
+
+backends = {'numpy': {'lorentz': _lorentz, 'gauss': _gauss,
+                      'fbg_reflectance': _fbg_reflectance,
+                      'fbg_powers': _fbg_powers}}
+
+# O backend numba é criado na primeira vez que for pedido (ver kernel)
+numba_available = find_spec('numba') is not None
+
+
+def set_backend(name='auto'):
+    """
+    Escolhe o backend dos kernels
+
+    :param name: 'numpy', 'numba' ou 'auto' (o Numba se estiver instalado)
+    :type name: str
+
+    :return: O nome do backend escolhido
+    :rtype: str
+    """
+    global backend
+
+    name = name.lower()
+    if name == 'auto':
+        name = 'numba' if numba_available else 'numpy'
+    elif name not in ('numpy', 'numba'):
+        raise ValueError(f'{name} é um backend inválido, os implementados '
+                         f'são "numpy", "numba" e "auto"')
+    elif name == 'numba' and not numba_available:
+        raise ImportError('O backend numba precisa do pacote numba '
+                          'instalado')
+
+    backend = name
+    return backend
+
+
+backend = None
+set_backend(os.environ.get(BACKEND_ENV, 'auto'))
+
+
+def kernel(name, backend_name=None):
+    """
+    Retorna um kernel
+
+    :param name: O nome do kernel: 'lorentz', 'gauss', 'fbg_reflectance' ou
+        'fbg_powers'
+    :type name: str
+
+    :param backend_name: O backend. O atual (ver set_backend) por padrão
+    :type backend_name: str
+
+    :rtype: function
+    """
+    backend_name = backend_name or backend
+    if backend_name == 'numba' and 'numba' not in backends:
+        backends['numba'] = _build_numba()
+    return backends[backend_name][name]
+
+
+def fbg_powers(wl_braggs, fwhm, wls, weights, backend_name=None):
+    """
+    Calcula, para cada comprimento de onda de bragg, a integral da
+    refletância (linear) da fbg pesada pelos pesos. Com os pesos do trapézio
+    multiplicados pelo espectro da fonte em W, é a potência refletida em
+    cada instante da simulação do piezoelétrico
+
+    :param wl_braggs: Os comprimentos de onda de bragg (um por instante)
+    :type wl_braggs: np.ndarray
+
+    :param fwhm: A largura da fbg
+    :type fwhm: float
+
+    :param wls: Os comprimentos de onda do espectro
+    :type wls: np.ndarray
+
+    :param weights: Os pesos da integral, um por comprimento de onda
+    :type weights: np.ndarray
+
+    :param backend_name: O backend. O atual (ver set_backend) por padrão
+    :type backend_name: str
+
+    :return: As potências, uma por comprimento de onda de bragg
+    :rtype: np.ndarray
+    """
+    return kernel('fbg_powers', backend_name)(np.asarray(wl_braggs), fwhm,
+                                              wls, weights)
@@ -0,0 +1,88 @@
+"""
+Esse módulo limita o tempo e o número de avaliações de passos caros (como o
+curve_fit do get_approximate_valley). O limite é definido com o time_budget e
+os passos verificam com o check_budget dentro dos laços caros; se o limite
+for ultrapassado, o check_budget levanta um BudgetExceeded, que o passo (ou
+o MassSpectraData) trata usando um caminho alternativo mais barato.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class BudgetExceeded(Exception):
+    """Levantada pelo check_budget quando o tempo ou as avaliações acabam"""
+
+
+# (instante limite, avaliações restantes) do limite atual
+_budget = ContextVar('budget', default=None)
+
+
+@contextmanager
+def time_budget(seconds=None, evaluations=None):
+    """
+    Define um limite de tempo e/ou de avaliações para o código dentro do
+    with. Limites aninhados valem o mais restritivo
+
+    :param seconds: O tempo máximo, em segundos. Sem limite se for None
+    :type seconds: float
+
+    :param evaluations: O número máximo de chamadas do check_budget. Sem
+        limite se for None
+    :type evaluations: int
+
+    :return: None
+    """
+    deadline = None if seconds is None else time.perf_counter() + seconds
+    outer = _budget.get()
+
+    if outer is not None:
+        outer_deadline, outer_evaluations = outer
+        if outer_deadline is not None:
+            deadline = outer_deadline if deadline is None else \
+                min(deadline, outer_deadline)
+        if outer_evaluations is not None:
+            evaluations = outer_evaluations[0] if evaluations is None else \
+                min(evaluations, outer_evaluations[0])
+
+    counter = None if evaluations is None else [evaluations]
+    token = _budget.set((deadline, counter))
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+        if outer is not None and outer[1] is not None and counter is not None:
+            outer[1][0] -= evaluations - counter[0]
+
+
+def has_budget():
+    """
+    Retorna se algum limite está definido, para os passos evitarem o custo
+    da verificação quando não precisam
+
+    :rtype: bool
+    """
+    return _budget.get() is not None
+
+
+def check_budget():
+    """
+    Conta uma avaliação e verifica os limites atuais
+
+    :raises BudgetExceeded: Se o tempo ou as avaliações acabaram
+
+    :return: None
+    """
+    budget = _budget.get()
+    if budget is None:
+        return
+
+    deadline, counter = budget
+    if counter is not None:
+        counter[0] -= 1
+        if counter[0] < 0:
+            raise BudgetExceeded('Limite de avaliações atingido')
+
+    if deadline is not None and time.perf_counter() > deadline:
+        raise BudgetExceeded('Limite de tempo atingido')
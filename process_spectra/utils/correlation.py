@@ -0,0 +1,102 @@
+"""
+Esse módulo estima o deslocamento em comprimento de onda entre espectros pela
+correlação cruzada, calculada com a FFT (O(n log n)). O pico da correlação
+é refinado entre amostras com a interpolação parabólica de 3 pontos (ver
+utils.valley.parabolic_vertex). Não precisa achar nem ajustar vales, então
+serve para acompanhar a deriva de um espectro em relação a uma referência.
+"""
+
+import numpy as np
+from scipy import fft
+
+from process_spectra.utils.valley import parabolic_vertex
+
+
+def remove_baseline(ys, edge_fraction=0.05):
+    """
+    Remove a reta que passa pela média das bordas do espectro (no último
+    eixo), para o espectro ficar perto de zero nas pontas. Sem isso, o
+    patamar do espectro domina a correlação e puxa o pico para o atraso 0
+
+    :param ys: As potências (um espectro por linha, se for 2D)
+    :type ys: np.ndarray
+
+    :param edge_fraction: A fração dos pontos usada em cada borda
+    :type edge_fraction: float
+
+    :return: As potências sem a linha de base
+    :rtype: np.ndarray
+    """
+    n = ys.shape[-1]
+    k = max(int(n * edge_fraction), 1)
+
+    left = ys[..., :k].mean(axis=-1, keepdims=True)
+    right = ys[..., n - k:].mean(axis=-1, keepdims=True)
+    x_left, x_right = (k - 1) / 2, n - 1 - (k - 1) / 2
+
+    slope = (right - left) / max(x_right - x_left, 1)
+    return ys - (left + slope * (np.arange(n) - x_left))
+
+
+def cross_correlation_shift(ys, reference, step=1., max_shift=None):
+    """
+    Estima o deslocamento de cada espectro em relação à referência. Os
+    espectros e a referência devem estar no mesmo grid uniforme. A linha de
+    base de cada um é removida antes da correlação (ver remove_baseline)
+
+    :param ys: As potências do espectro, ou de vários espectros (um por
+        linha)
+    :type ys: np.ndarray
+
+    :param reference: As potências da referência
+    :type reference: np.ndarray
+
+    :param step: O passo do grid. O deslocamento é retornado nessa unidade
+        (1 retorna em amostras)
+    :type step: float
+
+    :param max_shift: O deslocamento máximo procurado, na unidade do step.
+        Sem limite se for None
+    :type max_shift: float
+
+    :return: O(s) deslocamento(s). Positivo quando o espectro está em
+        comprimentos de onda maiores que a referência. NaN quando o pico da
+        correlação fica na borda da janela procurada (o deslocamento passa
+        do max_shift)
+    :rtype: float, np.ndarray
+    """
+    ys = np.asarray(ys, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    n = ys.shape[-1]
+
+    if reference.shape != (n, ):
+        raise ValueError('A referência deve ter o mesmo número de pontos '
+                         'dos espectros')
+
+    n_fft = fft.next_fast_len(2 * n - 1, real=True)
+    spectra = fft.rfft(remove_baseline(ys), n_fft, axis=-1)
+    spectra *= np.conj(fft.rfft(remove_baseline(reference), n_fft))
+    correlation = fft.irfft(spectra, n_fft, axis=-1)
+
+    # Reordena para os atrasos -(n - 1), ..., n - 1
+    max_lag = n - 1
+    if max_shift is not None:
+        max_lag = int(min(max(np.ceil(abs(max_shift) / step), 1), n - 1))
+    correlation = np.concatenate((correlation[..., n_fft - max_lag:],
+                                  correlation[..., :max_lag + 1]), axis=-1)
+    lags = np.arange(-max_lag, max_lag + 1, dtype=np.float64)
+
+    # O parabolic_vertex procura mínimos, então usa a correlação negativa.
+    # Na borda da janela o pico não tem os dois vizinhos, e a parábola
+    # extrapolaria para fora da janela
+    peaks = np.atleast_1d(correlation.argmax(axis=-1))
+    rows = correlation.reshape(-1, len(lags))
+
+    shifts = np.full(len(rows), np.nan)
+    for i, (row, peak) in enumerate(zip(rows, peaks)):
+        if 0 < peak < len(lags) - 1:
+            shift = parabolic_vertex(lags, -row, peak)[0]
+            shifts[i] = np.clip(shift, lags[peak] - 1, lags[peak] + 1)
+
+    shifts *= step
+    return shifts[0] if correlation.ndim == 1 else shifts
@@ -2,6 +2,8 @@
 
 import numpy as np
 
+from process_spectra.utils.accel import kernel
+
 
 def get_fbg_reflectance(wl_bragg, fwhm, wls, unit='dB'):
     """
@@ -35,13 +37,12 @@ def get_fbg_reflectance(wl_bragg, fwhm, wls, unit='dB'):
     :return: Retorna um np array com o espectro de refleção da FBG
 
     """
-    r = (1 + ((wls - wl_bragg)/(fwhm/2))**8)**(-1)
+    r = kernel('fbg_reflectance')(wl_bragg, fwhm, wls)
     if unit == 'dB':
         r = 10*np.log10(r)
     elif unit != 'scalar':
         raise ValueError('Unidade inválida. As implementadas são "dB" e '
                          '"scalar"')
 
-    return np.array([x for x in zip(wls, r)],
-                    dtype=np.float64)
+    return np.column_stack((wls, r)).astype(np.float64, copy=False)
 
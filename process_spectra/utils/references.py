@@ -0,0 +1,217 @@
+"""
+Esse módulo tem um registro de espectros de referência com nome (como o
+espectro do LED usado no simulate_gain). Cada referência fica em um bloco de
+memória compartilhada (multiprocessing.shared_memory), e o que é passado
+para os passos e para os processos de trabalho é só um SharedReference, um
+descritor pequeno. Cada processo mapeia o bloco uma vez só e reaproveita o
+mesmo Spectrum (e o mesmo grid) em todas as chamadas.
+
+No Python 3.7 (sem shared_memory) o registro funciona, mas o descritor leva
+uma cópia do espectro ao ser enviado para outro processo.
+"""
+
+import numpy as np
+
+from process_spectra.utils.spectrum import Spectrum
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# Os blocos já mapeados neste processo: nome do bloco -> (bloco, Spectrum)
+_attached = dict()
+
+
+class SharedReference:
+    """
+    O descritor de uma referência registrada. Pode ser passado como kwarg
+    dos passos e enviado para outros processos (o pickle leva só o nome do
+    bloco, o tamanho e a unidade)
+    """
+    __slots__ = ('name', 'block_name', 'size', 'unit', '_data')
+
+    def __init__(self, name, block_name, size, unit, data=None):
+        self.name = name
+        self.block_name = block_name
+        self.size = size
+        self.unit = unit
+        self._data = data
+
+    def __reduce__(self):
+        data = self._data if self.block_name is None else None
+        return SharedReference, (self.name, self.block_name, self.size,
+                                 self.unit, data)
+
+    def __repr__(self):
+        return f'SharedReference({self.name!r}, {self.size} pontos, ' \
+               f'{self.unit})'
+
+    @property
+    def spectrum(self):
+        """
+        O espectro da referência. Na primeira chamada em cada processo, o
+        bloco é mapeado e o Spectrum é criado; depois é só uma consulta
+
+        :rtype: Spectrum
+        """
+        if self.block_name is None:
+            if self._data is None:
+                raise ValueError(f'A referência {self.name} não tem dados')
+            if not isinstance(self._data, Spectrum):
+                self._data = Spectrum(self._data[0], self._data[1],
+                                      self.unit)
+            return self._data
+
+        attached = _attached.get(self.block_name)
+        if attached is None:
+            block = _attach(self.block_name)
+
+            array = np.ndarray((2, self.size), dtype=np.float64,
+                               buffer=block.buf)
+            array.setflags(write=False)
+
+            attached = (block, Spectrum(array[0], array[1], self.unit))
+            _attached[self.block_name] = attached
+
+        return attached[1]
+
+
+def _attach(block_name):
+    # Quem apaga o bloco é o registro que o criou. No Python 3.13+ o bloco é
+    # mapeado sem ser registrado no resource_tracker; antes disso ele é
+    # registrado, o que não tem efeito nos processos criados pelo
+    # multiprocessing (que usam o resource_tracker do processo principal)
+    try:
+        return shared_memory.SharedMemory(name=block_name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=block_name)
+
+
+class ReferenceRegistry:
+    """
+    O registro das referências. Quem cria o registro é dono dos blocos de
+    memória e deve chamar o close (ou usar como context manager) no fim
+    """
+    def __init__(self, shared=True):
+        """
+        Inicia o registro
+
+        :param shared: Se deve usar memória compartilhada. Se for False (ou
+            se o Python não tiver o shared_memory), as referências ficam na
+            memória do processo e são copiadas ao serem enviadas
+        :type shared: bool
+        """
+        self.shared = shared and shared_memory is not None
+        self.references = dict()
+        self._blocks = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.references
+
+    def __getitem__(self, name):
+        return self.references[name]
+
+    def register(self, name, spectrum, unit='dBm'):
+        """
+        Registra uma referência. Se o nome já existir, a anterior é
+        substituída
+
+        :param name: O nome da referência
+        :type name: str
+
+        :param spectrum: O espectro, como um array (n, 2) ou um Spectrum
+        :type spectrum: np.ndarray, Spectrum
+
+        :param unit: A unidade dos valores (ver Spectrum). Ignorada se o
+            spectrum for um Spectrum
+        :type unit: str
+
+        :return: O descritor da referência
+        :rtype: SharedReference
+        """
+        if isinstance(spectrum, Spectrum):
+            wavelengths, values, unit = \
+                spectrum.wavelengths, spectrum.values, spectrum.unit
+        else:
+            spectrum = np.asarray(spectrum, dtype=np.float64)
+            wavelengths, values = spectrum[::, 0], spectrum[::, 1]
+
+        if name in self.references:
+            self.unregister(name)
+
+        size = len(wavelengths)
+        if not self.shared:
+            reference = SharedReference(name, None, size, unit,
+                                        Spectrum(wavelengths, values, unit))
+            self.references[name] = reference
+            return reference
+
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(16 * size, 1))
+        array = np.ndarray((2, size), dtype=np.float64, buffer=block.buf)
+        array[0] = wavelengths
+        array[1] = values
+        array.setflags(write=False)
+
+        # Este processo já tem o bloco mapeado
+        _attached[block.name] = (block, Spectrum(array[0], array[1], unit))
+
+        reference = SharedReference(name, block.name, size, unit)
+        self.references[name] = reference
+        self._blocks[name] = block
+
+        return reference
+
+    def unregister(self, name):
+        """
+        Remove uma referência e apaga o seu bloco de memória
+
+        :param name: O nome da referência
+        :type name: str
+
+        :return: None
+        """
+        reference = self.references.pop(name)
+
+        block = self._blocks.pop(name, None)
+        if block is not None:
+            _attached.pop(reference.block_name, None)
+            try:
+                block.close()
+            except BufferError:
+                # Ainda tem arrays usando o bloco. O mapeamento é desfeito
+                # quando eles forem coletados
+                pass
+            block.unlink()
+
+    def close(self):
+        """
+        Remove todas as referências
+
+        :return: None
+        """
+        for name in list(self.references):
+            self.unregister(name)
+
+
+def resolve_reference(reference):
+    """
+    Retorna o Spectrum de uma referência, ou o próprio objeto se não for um
+    SharedReference
+
+    :param reference: A referência
+    :type reference: SharedReference, Spectrum, np.ndarray
+
+    :rtype: Spectrum, np.ndarray
+    """
+    if isinstance(reference, SharedReference):
+        return reference.spectrum
+    return reference
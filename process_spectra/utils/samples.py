@@ -0,0 +1,172 @@
+"""
+Esse módulo tem o SampleStore, um arquivo único onde as amostras de
+potência do simulate_piezo_fbg são acrescentadas, ao invés de um .npy por
+espectro. A pasta do store tem o arquivo de dados (os valores em float64,
+um trecho depois do outro) e um índice de texto com o nome, a posição e o
+formato de cada trecho. Cada escrita trava um arquivo de trava, então
+vários processos podem escrever no mesmo store, e a leitura de um espectro
+é um np.memmap só do seu trecho.
+"""
+
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+DATA_FILE = 'samples.bin'
+INDEX_FILE = 'index.tsv'
+LOCK_FILE = 'lock'
+
+
+@contextmanager
+def _locked(path):
+    with open(path, 'a+b') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        else:
+            # No Windows trava o primeiro byte. O LK_LOCK desiste depois de
+            # ~10 s, então tenta de novo até conseguir
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SampleStore:
+    """
+    O store de amostras. Pode ser passado para o simulate_piezo_fbg (como
+    sample_store) e enviado para outros processos: o pickle leva só o
+    caminho
+    """
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, path):
+        """
+        Abre o store, criando a pasta se não existir
+
+        :param path: O caminho da pasta do store
+        :type path: str
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        self._data_path = os.path.join(path, DATA_FILE)
+        self._index_path = os.path.join(path, INDEX_FILE)
+        self._lock_path = os.path.join(path, LOCK_FILE)
+
+        self._index = dict()
+        self._index_position = 0
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def __repr__(self):
+        return f'SampleStore({self.path!r})'
+
+    def append(self, name, samples):
+        """
+        Acrescenta as amostras de um espectro. Se o nome já existir, a
+        leitura passa a retornar as novas
+
+        :param name: O nome do espectro (o info['name'])
+        :type name: str
+
+        :param samples: As amostras (de qualquer formato)
+        :type samples: np.ndarray
+
+        :return: None
+        """
+        if '\t' in name or '\n' in name:
+            raise ValueError('O nome não pode ter tabulações nem quebras de '
+                             'linha')
+
+        array = np.ascontiguousarray(samples, dtype=self.dtype)
+        shape = ','.join(str(n) for n in array.shape)
+
+        with _locked(self._lock_path):
+            with open(self._data_path, 'ab') as data:
+                offset = data.seek(0, os.SEEK_END)
+                data.write(array.tobytes())
+
+            # O índice é escrito depois dos dados, então quem lê sem a trava
+            # nunca vê um trecho que ainda não foi escrito
+            with open(self._index_path, 'a', encoding='utf-8') as index:
+                index.write(f'{name}\t{offset}\t{shape}\n')
+
+    def _refresh(self):
+        if not os.path.exists(self._index_path):
+            return
+
+        with open(self._index_path, 'rb') as index:
+            index.seek(self._index_position)
+            content = index.read()
+
+        # Ignora a última linha se ela ainda estiver sendo escrita
+        end = content.rfind(b'\n') + 1
+        self._index_position += end
+
+        for line in content[:end].decode('utf-8').splitlines():
+            name, offset, shape = line.split('\t')
+            shape = tuple(int(n) for n in shape.split(',') if n)
+            self._index[name] = (int(offset), shape)
+
+    def names(self):
+        """
+        Os nomes dos espectros no store, na ordem em que foram escritos
+
+        :rtype: list
+        """
+        self._refresh()
+        return list(self._index)
+
+    def __len__(self):
+        return len(self.names())
+
+    def __contains__(self, name):
+        if name not in self._index:
+            self._refresh()
+        return name in self._index
+
+    def __getitem__(self, name):
+        """
+        Lê as amostras de um espectro, sem ler o resto do arquivo
+
+        :param name: O nome do espectro
+        :type name: str
+
+        :return: As amostras, somente leitura
+        :rtype: np.memmap
+        """
+        # Só lê o que foi acrescentado no índice desde a última leitura
+        self._refresh()
+        if name not in self._index:
+            raise KeyError(name)
+
+        offset, shape = self._index[name]
+        if not np.prod(shape, dtype=np.int64):
+            return np.empty(shape, dtype=self.dtype)
+
+        return np.memmap(self._data_path, dtype=self.dtype, mode='r',
+                         offset=offset, shape=shape)
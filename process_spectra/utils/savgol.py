@@ -0,0 +1,157 @@
+"""
+Esse módulo tem o filtro de Savitzky–Golay com os coeficientes guardados em
+cache. Para window_length e polyorder fixos o filtro é só uma convolução, então
+os coeficientes (do centro e das bordas) são calculados uma vez e aplicados a
+um espectro ou a uma pilha de espectros de uma vez só.
+
+O resultado é o mesmo do scipy.signal.savgol_filter com mode='interp'.
+"""
+
+from functools import lru_cache
+from math import factorial
+
+import numpy as np
+from scipy import signal as sg
+from scipy.ndimage import correlate1d
+
+
+# A partir desse tamanho de janela a convolução por FFT fica mais rápida
+FFT_THRESHOLD = 128
+
+
+@lru_cache(maxsize=64)
+def savgol_kernels(window_length, polyorder, deriv=0):
+    """
+    Calcula os coeficientes do filtro para o centro e as matrizes para as
+    bordas, onde o filtro ajusta um polinômio à primeira (e à última) janela
+    e avalia nos pontos que sobram. Os resultados são guardados em cache e
+    são somente leitura
+
+    :param window_length: O tamanho da janela do filtro (ímpar)
+    :type window_length: int
+
+    :param polyorder: A ordem do polinômio, menor que window_length
+    :type polyorder: int
+
+    :param deriv: A ordem da derivada. 0 é o próprio sinal filtrado
+    :type deriv: int
+
+    :return: Os coeficientes do centro (para produto escalar com a janela) e
+        as matrizes da borda esquerda e direita, com passo 1
+    :rtype: (np.ndarray, np.ndarray, np.ndarray)
+    """
+    if window_length % 2 == 0:
+        raise ValueError('O window_length deve ser ímpar')
+    if polyorder >= window_length:
+        raise ValueError('O polyorder deve ser menor que o window_length')
+
+    half = window_length // 2
+    coeffs = sg.savgol_coeffs(window_length, polyorder, deriv=deriv,
+                              use='dot')
+
+    # O polinômio é ajustado em [-1, 1] para a matriz ficar bem condicionada
+    positions = (np.arange(window_length) - half) / max(half, 1)
+    fit = np.linalg.pinv(np.vander(positions, polyorder + 1, increasing=True))
+
+    def evaluation(points):
+        # Derivada de ordem deriv de cada x**k nos pontos, de volta no passo 1
+        matrix = np.zeros((len(points), polyorder + 1))
+        for k in range(deriv, polyorder + 1):
+            scale = factorial(k) / factorial(k - deriv)
+            matrix[:, k] = scale * points ** (k - deriv)
+        return matrix / max(half, 1) ** deriv
+
+    left = evaluation(positions[:half]) @ fit
+    right = evaluation(positions[window_length - half:]) @ fit
+
+    for array in (coeffs, left, right):
+        array.setflags(write=False)
+
+    return coeffs, left, right
+
+
+def savgol_filter(ys, window_length, polyorder, deriv=0, delta=1.0,
+                  method='auto'):
+    """
+    Aplica o filtro de Savitzky–Golay no último eixo de ys, que pode ser um
+    espectro (1d) ou uma pilha de espectros no mesmo grid (2d)
+
+    :param ys: Os valores a filtrar
+    :type ys: np.ndarray
+
+    :param window_length: O tamanho da janela do filtro (ímpar)
+    :type window_length: int
+
+    :param polyorder: A ordem do polinômio, menor que window_length
+    :type polyorder: int
+
+    :param deriv: A ordem da derivada. 0 por padrão (só filtra)
+    :type deriv: int
+
+    :param delta: O espaçamento entre as amostras, usado só nas derivadas
+    :type delta: float
+
+    :param method: 'direct', 'fft' ou 'auto' (escolhe pelo tamanho da janela)
+    :type method: str
+
+    :return: Os valores filtrados, com o mesmo shape de ys
+    :rtype: np.ndarray
+    """
+    ys = np.asarray(ys, dtype=np.float64)
+    n = ys.shape[-1]
+    if window_length > n:
+        raise ValueError('O window_length deve ser menor que o número de '
+                         'pontos do espectro')
+
+    if method == 'auto':
+        method = 'fft' if window_length >= FFT_THRESHOLD else 'direct'
+
+    coeffs, left, right = savgol_kernels(window_length, polyorder, deriv)
+    half = window_length // 2
+
+    if method == 'direct':
+        filtered = correlate1d(ys, coeffs, axis=-1, mode='constant')
+    elif method == 'fft':
+        filtered = np.empty_like(ys)
+        kernel = coeffs[::-1].reshape((1, ) * (ys.ndim - 1) + (-1, ))
+        filtered[..., half:n - half] = sg.fftconvolve(ys, kernel,
+                                                      mode='valid', axes=-1)
+    else:
+        raise ValueError(f'{method} é um método inválido, os implementados '
+                         f'são "direct", "fft" e "auto"')
+
+    filtered[..., :half] = ys[..., :window_length] @ left.T
+    filtered[..., n - half:] = ys[..., n - window_length:] @ right.T
+
+    if deriv:
+        filtered /= delta ** deriv
+
+    return filtered
+
+
+def spectrum_derivative(spectrum, window_length, polyorder, deriv=1):
+    """
+    Calcula a derivada suavizada da potência em relação ao comprimento de
+    onda, considerando o grid uniforme. Útil para achar vales pelos zeros da
+    derivada
+
+    :param spectrum: O espectro
+    :type spectrum: np.ndarray
+
+    :param window_length: O tamanho da janela do filtro (ímpar)
+    :type window_length: int
+
+    :param polyorder: A ordem do polinômio, menor que window_length
+    :type polyorder: int
+
+    :param deriv: A ordem da derivada. 1 por padrão
+    :type deriv: int
+
+    :return: A derivada, com um valor por ponto do espectro
+    :rtype: np.ndarray
+    """
+    wl = spectrum[::, 0]
+    delta = (wl[-1] - wl[0]) / (len(wl) - 1)
+
+    return savgol_filter(spectrum[::, 1], window_length, polyorder,
+                         deriv=deriv, delta=delta)
@@ -0,0 +1,371 @@
+"""
+Esse módulo tem a classe Spectrum, um espectro que sabe a sua unidade e
+guarda as conversões entre o domínio logarítmico e o linear, além dos pesos
+da integração no seu grid. Assim, um espectro usado muitas vezes (como o do
+LED no simulate_gain, ou o espectro no simulate_piezo_fbg) é convertido e
+preparado para integração uma vez só.
+
+Os comprimentos de onda ficam em um WavelengthGrid, que é compartilhado:
+espectros com o mesmo grid usam o mesmo objeto, então comparar grids é
+comparar identidades, e as informações do grid (passo, uniformidade, pesos)
+são calculadas uma vez para todos.
+"""
+
+import weakref
+
+import numpy as np
+
+from process_spectra.utils import trapz_weights
+
+
+# unidade logarítmica -> (unidade linear, fator da conversão)
+LOG_UNITS = {'dBm': ('W', 1e-3), 'dB': ('scalar', 1)}
+LINEAR_UNITS = {linear: (log, factor)
+                for log, (linear, factor) in LOG_UNITS.items()}
+
+
+class WavelengthGrid:
+    """
+    Um grid de comprimentos de onda imutável. Use WavelengthGrid.of para
+    obter o grid, que reaproveita o objeto de um grid igual já existente
+    """
+    __slots__ = ('values', '_step', '_uniform', '_weights', '_crops',
+                 '__weakref__')
+
+    # (tamanho, primeiro, último, hash dos bytes) -> grid
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, values):
+        """
+        Inicia o grid. Prefira o WavelengthGrid.of, que compartilha os grids
+        iguais
+
+        :param values: Os comprimentos de onda, em ordem crescente
+        :type values: np.ndarray
+        """
+        self.values = np.array(values, dtype=np.float64)
+        self.values.setflags(write=False)
+
+        self._step = None
+        self._uniform = None
+        self._weights = None
+        self._crops = dict()
+
+    @classmethod
+    def of(cls, wavelengths):
+        """
+        Retorna o grid dos comprimentos de onda. Se um grid igual já existir,
+        retorna o mesmo objeto
+
+        :param wavelengths: Os comprimentos de onda ou um grid
+        :type wavelengths: np.ndarray, WavelengthGrid
+
+        :return: O grid
+        :rtype: WavelengthGrid
+        """
+        if isinstance(wavelengths, cls):
+            return wavelengths
+
+        values = np.asarray(wavelengths, dtype=np.float64)
+        if len(values) == 0:
+            return cls(values)
+
+        grid = cls._lookup(values)
+        if grid is None:
+            grid = cls(values)
+            cls._interned[grid._key()] = grid
+
+        return grid
+
+    @classmethod
+    def _lookup(cls, values):
+        if len(values) == 0:
+            return None
+
+        grid = cls._interned.get(cls._key_of(values))
+        if grid is not None and np.array_equal(grid.values, values):
+            return grid
+        return None
+
+    @staticmethod
+    def _key_of(values):
+        return (len(values), values[0], values[-1],
+                hash(np.ascontiguousarray(values).tobytes()))
+
+    def _key(self):
+        return self._key_of(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def step(self):
+        """O passo médio do grid"""
+        if self._step is None:
+            n = len(self.values)
+            self._step = (self.values[-1] - self.values[0]) / (n - 1) \
+                if n > 1 else 0.
+        return self._step
+
+    @property
+    def is_uniform(self):
+        """Se o grid tem passo constante (com tolerância relativa de 1e-6)"""
+        if self._uniform is None:
+            self._uniform = len(self.values) < 3 or \
+                bool(np.all(np.abs(np.diff(self.values) - self.step) <=
+                            1e-6 * abs(self.step)))
+        return self._uniform
+
+    @property
+    def weights(self):
+        """Os pesos do trapézio para o grid (ver utils.trapz_weights)"""
+        if self._weights is None:
+            self._weights = trapz_weights(self.values)
+            self._weights.setflags(write=False)
+        return self._weights
+
+    def matches(self, wavelengths):
+        """
+        Verifica se os comprimentos de onda são os desse grid. Para outro
+        grid (ou um Spectrum) é uma comparação de identidade, O(1); para um
+        array, os valores são comparados
+
+        :param wavelengths: Os comprimentos de onda, um grid ou um espectro
+        :type wavelengths: np.ndarray, WavelengthGrid, Spectrum
+
+        :rtype: bool
+        """
+        if isinstance(wavelengths, Spectrum):
+            wavelengths = wavelengths.grid
+        if isinstance(wavelengths, WavelengthGrid):
+            return wavelengths is self
+        if wavelengths is self.values:
+            return True
+
+        return len(wavelengths) == len(self.values) and \
+            np.array_equal(wavelengths, self.values)
+
+    def bounds(self, wl_min, wl_max):
+        """
+        Os índices (início, fim) dos pontos em [wl_min, wl_max], por busca
+        binária
+
+        :param wl_min: O limite inferior
+        :type wl_min: float
+
+        :param wl_max: O limite superior
+        :type wl_max: float
+
+        :rtype: (int, int)
+        """
+        return (int(np.searchsorted(self.values, wl_min, side='left')),
+                int(np.searchsorted(self.values, wl_max, side='right')))
+
+    def crop(self, start, stop):
+        """
+        Retorna o grid dos pontos [start, stop). Os valores são uma view do
+        grid original, e o mesmo corte retorna sempre o mesmo objeto
+
+        :param start: O índice inicial
+        :type start: int
+
+        :param stop: O índice final (não incluso)
+        :type stop: int
+
+        :rtype: WavelengthGrid
+        """
+        start, stop, _ = slice(start, stop).indices(len(self.values))
+        if (start, stop) == (0, len(self.values)):
+            return self
+
+        grid = self._crops.get((start, stop))
+        if grid is None:
+            values = self.values[start:stop]
+            grid = WavelengthGrid._lookup(values)
+            if grid is None:
+                grid = WavelengthGrid.__new__(WavelengthGrid)
+                grid.values = values
+                grid._step = None
+                grid._uniform = self._uniform or None
+                grid._weights = None
+                grid._crops = dict()
+                WavelengthGrid._interned[grid._key()] = grid
+            self._crops[(start, stop)] = grid
+
+        return grid
+
+
+class Spectrum:
+    """
+    Um espectro com unidade. As unidades implementadas são 'dBm' (potência,
+    com 'W' como versão linear) e 'dB' (ganho ou atenuação, com 'scalar'
+    como versão linear)
+    """
+    __slots__ = ('grid', 'values', 'unit', '_linear', '_log')
+
+    def __init__(self, wavelengths, values, unit='dBm'):
+        """
+        Inicia o espectro
+
+        :param wavelengths: Os comprimentos de onda (em ordem crescente) ou
+            o grid
+        :type wavelengths: np.ndarray, WavelengthGrid
+
+        :param values: Os valores, na unidade passada
+        :type values: np.ndarray
+
+        :param unit: A unidade dos valores: 'dBm', 'W', 'dB' ou 'scalar'
+        :type unit: str
+        """
+        if unit not in LOG_UNITS and unit not in LINEAR_UNITS:
+            raise ValueError(f'{unit} é uma unidade inválida, as '
+                             f'implementadas são "dBm", "W", "dB" e "scalar"')
+
+        self.grid = WavelengthGrid.of(wavelengths)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.unit = unit
+
+        if len(self.values) != len(self.grid):
+            raise ValueError('Os valores e os comprimentos de onda devem ter '
+                             'o mesmo tamanho')
+
+        self._linear = self.values if unit in LINEAR_UNITS else None
+        self._log = self.values if unit in LOG_UNITS else None
+
+    @classmethod
+    def from_array(cls, spectrum, unit='dBm'):
+        """
+        Cria o objeto a partir de um espectro no formato usado pelos passos
+        (array (n, 2) com comprimentos de onda e valores)
+
+        :param spectrum: O espectro
+        :type spectrum: np.ndarray
+
+        :param unit: A unidade dos valores
+        :type unit: str
+
+        :return: O espectro com unidade
+        :rtype: Spectrum
+        """
+        return cls(spectrum[::, 0], spectrum[::, 1], unit)
+
+    def to_array(self, unit=None):
+        """
+        Retorna o espectro no formato usado pelos passos
+
+        :param unit: A unidade da saída. A do próprio espectro por padrão
+        :type unit: str
+
+        :return: O array (n, 2)
+        :rtype: np.ndarray
+        """
+        return np.column_stack((self.wavelengths, self.in_unit(unit)))
+
+    def __len__(self):
+        return len(self.grid)
+
+    @property
+    def wavelengths(self):
+        """Os comprimentos de onda (somente leitura)"""
+        return self.grid.values
+
+    def crop(self, wl_min, wl_max):
+        """
+        Corta o espectro em [wl_min, wl_max] por busca binária no grid. O
+        resultado usa views dos arrays (e das conversões já calculadas), sem
+        cópias
+
+        :param wl_min: O limite inferior
+        :type wl_min: float
+
+        :param wl_max: O limite superior
+        :type wl_max: float
+
+        :return: O espectro cortado
+        :rtype: Spectrum
+        """
+        start, stop = self.grid.bounds(wl_min, wl_max)
+
+        cropped = Spectrum.__new__(Spectrum)
+        cropped.grid = self.grid.crop(start, stop)
+        cropped.values = self.values[start:stop]
+        cropped.unit = self.unit
+        cropped._linear = None if self._linear is None else \
+            self._linear[start:stop]
+        cropped._log = None if self._log is None else self._log[start:stop]
+
+        return cropped
+
+    @property
+    def linear_unit(self):
+        """A unidade do domínio linear ('W' ou 'scalar')"""
+        return self.unit if self.unit in LINEAR_UNITS else \
+            LOG_UNITS[self.unit][0]
+
+    @property
+    def log_unit(self):
+        """A unidade do domínio logarítmico ('dBm' ou 'dB')"""
+        return self.unit if self.unit in LOG_UNITS else \
+            LINEAR_UNITS[self.unit][0]
+
+    @property
+    def linear(self):
+        """Os valores no domínio linear (calculados uma vez só)"""
+        if self._linear is None:
+            factor = LOG_UNITS[self.unit][1]
+            self._linear = factor * 10 ** (self.values / 10)
+            self._linear.setflags(write=False)
+        return self._linear
+
+    @property
+    def log(self):
+        """Os valores no domínio logarítmico (calculados uma vez só)"""
+        if self._log is None:
+            factor = LINEAR_UNITS[self.unit][1]
+            self._log = 10 * np.log10(self.values / factor)
+            self._log.setflags(write=False)
+        return self._log
+
+    @property
+    def weights(self):
+        """Os pesos do trapézio do grid (compartilhados com o grid)"""
+        return self.grid.weights
+
+    def in_unit(self, unit=None):
+        """
+        Retorna os valores na unidade pedida
+
+        :param unit: A unidade. A do próprio espectro por padrão
+        :type unit: str
+
+        :return: Os valores
+        :rtype: np.ndarray
+        """
+        if unit is None or unit == self.unit:
+            return self.values
+        if unit == self.linear_unit:
+            return self.linear
+        if unit == self.log_unit:
+            return self.log
+
+        raise ValueError(f'Não é possível converter de {self.unit} '
+                         f'para {unit}')
+
+    def power(self, noise=None):
+        """
+        Calcula a potência total do espectro (integral no domínio linear),
+        como o utils.get_power, mas com um produto escalar com os pesos
+        guardados
+
+        :param noise: O desvio do ruído elétrico somado, como no get_power
+        :type noise: float
+
+        :return: A potência, em W se o espectro for de potência
+        :rtype: float
+        """
+        power = np.dot(self.weights, np.abs(self.linear))
+
+        if noise:
+            power += np.random.randn() * noise
+
+        return power
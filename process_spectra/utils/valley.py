@@ -0,0 +1,285 @@
+"""
+Esse módulo tem estimadores do vale ressonante em forma fechada, que não
+precisam de otimização iterativa (como o curve_fit). Eles refinam a posição
+do ponto mínimo do grid para uma posição entre amostras.
+
+Todos recebem os comprimentos de onda, as potências (em dB), o índice do
+ponto mínimo e a proeminência do vale (como retornada pelo find_peaks), e
+retornam o comprimento de onda e a potência estimados.
+"""
+
+import numpy as np
+from scipy import signal as sg
+
+
+def parabolic_vertex(xs, ys, index, prominence=None):
+    """
+    Interpolação parabólica de 3 pontos: ajusta uma parábola ao mínimo e aos
+    dois vizinhos e retorna o vértice. Aceita um array de índices
+
+    :param xs: Os comprimentos de onda (grid uniforme)
+    :type xs: np.ndarray
+
+    :param ys: As potências
+    :type ys: np.ndarray
+
+    :param index: O índice (ou os índices) do ponto mínimo
+    :type index: int, np.ndarray
+
+    :param prominence: Ignorado, está aqui para manter a mesma assinatura
+    :type prominence: float
+
+    :return: O comprimento de onda e a potência do vértice
+    :rtype: (float, float)
+    """
+    index = np.clip(index, 1, len(ys) - 2)
+    y_left, y_center, y_right = ys[index - 1], ys[index], ys[index + 1]
+
+    curvature = y_left - 2 * y_center + y_right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(curvature > 0,
+                         0.5 * (y_left - y_right) / curvature, 0)
+
+    step = (xs[index + 1] - xs[index - 1]) / 2
+
+    return xs[index] + delta * step, y_center - 0.25 * (y_left - y_right) * delta
+
+
+def gaussian_vertex(xs, ys, index, prominence):
+    """
+    Interpolação gaussiana de 3 pontos: a parábola é ajustada ao logaritmo da
+    profundidade do vale (em relação ao nível definido pela proeminência), o
+    que é exato para um vale com formato gaussiano. Aceita um array de
+    índices
+
+    :param xs: Os comprimentos de onda (grid uniforme)
+    :type xs: np.ndarray
+
+    :param ys: As potências
+    :type ys: np.ndarray
+
+    :param index: O índice (ou os índices) do ponto mínimo
+    :type index: int, np.ndarray
+
+    :param prominence: A proeminência do vale
+    :type prominence: float, np.ndarray
+
+    :return: O comprimento de onda e a potência do vértice
+    :rtype: (float, float)
+    """
+    index = np.clip(index, 1, len(ys) - 2)
+    reference = ys[index] + prominence
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        depths = np.log(np.array([reference - ys[index - 1],
+                                  reference - ys[index],
+                                  reference - ys[index + 1]]))
+        depths = np.nan_to_num(depths, nan=-np.inf)
+
+        log_left, log_center, log_right = depths
+        curvature = log_left - 2 * log_center + log_right
+        delta = np.where(np.isfinite(curvature) & (curvature < 0),
+                         0.5 * (log_left - log_right) / curvature, 0)
+
+    step = (xs[index + 1] - xs[index - 1]) / 2
+    log_depth = log_center - 0.25 * (log_left - log_right) * delta
+
+    return xs[index] + delta * step, reference - np.exp(log_depth)
+
+
+def _half_prominence_window(ys, index, prominence):
+    """
+    Retorna os limites (início, fim) da região contínua ao redor do vale que
+    fica abaixo da metade da proeminência, com pelo menos 3 pontos
+    """
+    threshold = ys[index] + prominence / 2
+    n = len(ys)
+
+    above = np.flatnonzero(ys[index::-1] > threshold)
+    start = index - above[0] + 1 if len(above) else 0
+
+    above = np.flatnonzero(ys[index:] > threshold)
+    stop = index + above[0] if len(above) else n
+
+    start, stop = min(start, max(index - 1, 0)), max(stop, min(index + 2, n))
+
+    return start, stop
+
+
+def centroid(xs, ys, index, prominence):
+    """
+    Centroide do vale: média dos comprimentos de onda pesada pela
+    profundidade, na região abaixo da metade da proeminência
+
+    :param xs: Os comprimentos de onda
+    :type xs: np.ndarray
+
+    :param ys: As potências
+    :type ys: np.ndarray
+
+    :param index: O índice do ponto mínimo
+    :type index: int
+
+    :param prominence: A proeminência do vale
+    :type prominence: float
+
+    :return: O comprimento de onda do centroide e a potência interpolada
+        nele
+    :rtype: (float, float)
+    """
+    start, stop = _half_prominence_window(ys, index, prominence)
+    weights = np.clip(ys[index] + prominence / 2 - ys[start:stop], 0, None)
+
+    if weights.sum() <= 0:
+        return xs[index], ys[index]
+
+    x0 = np.dot(weights, xs[start:stop]) / weights.sum()
+
+    return x0, np.interp(x0, xs, ys)
+
+
+def lorentz_linear(xs, ys, index, prominence):
+    """
+    Ajuste de uma lorentziana por mínimos quadrados lineares. O inverso da
+    profundidade de uma lorentziana é uma parábola, então o ajuste é um
+    polyfit de grau 2 (pesado pela profundidade) na região abaixo da metade
+    da proeminência. Se o ajuste não tiver mínimo, usa a interpolação
+    parabólica
+
+    :param xs: Os comprimentos de onda
+    :type xs: np.ndarray
+
+    :param ys: As potências
+    :type ys: np.ndarray
+
+    :param index: O índice do ponto mínimo
+    :type index: int
+
+    :param prominence: A proeminência do vale
+    :type prominence: float
+
+    :return: O comprimento de onda e a potência do vale ajustado
+    :rtype: (float, float)
+    """
+    start, stop = _half_prominence_window(ys, index, prominence)
+    reference = ys[index] + prominence
+    depths = reference - ys[start:stop]
+
+    if stop - start < 3 or (depths <= 0).any():
+        return parabolic_vertex(xs, ys, index)
+
+    # Centraliza e normaliza o x para o polyfit ficar bem condicionado
+    step = (xs[stop - 1] - xs[start]) / (stop - start - 1)
+    x = (xs[start:stop] - xs[index]) / step
+    c2, c1, c0 = np.polyfit(x, 1 / depths, 2, w=depths ** 2)
+
+    if c2 <= 0:
+        return parabolic_vertex(xs, ys, index)
+
+    x0 = -c1 / (2 * c2)
+    if abs(x0) > stop - start:
+        return parabolic_vertex(xs, ys, index)
+
+    return xs[index] + x0 * step, reference - 1 / (c0 - c1 ** 2 / (4 * c2))
+
+
+estimators = {
+    'parabolic': parabolic_vertex,
+    'gaussian': gaussian_vertex,
+    'centroid': centroid,
+    'lorentz': lorentz_linear,
+}
+
+
+def estimate_valley(xs, ys, index, prominence, estimator='parabolic'):
+    """
+    Estima o vale com um dos estimadores em forma fechada
+
+    :param xs: Os comprimentos de onda
+    :type xs: np.ndarray
+
+    :param ys: As potências
+    :type ys: np.ndarray
+
+    :param index: O índice do ponto mínimo do vale
+    :type index: int
+
+    :param prominence: A proeminência do vale
+    :type prominence: float
+
+    :param estimator: O nome do estimador: 'parabolic', 'gaussian',
+        'centroid' ou 'lorentz'
+    :type estimator: str
+
+    :return: O comprimento de onda e a potência estimados
+    :rtype: (float, float)
+    """
+    try:
+        function = estimators[estimator]
+    except KeyError:
+        raise ValueError(f'{estimator} é um estimador inválido, os '
+                         f'implementados são {list(estimators)}') from None
+
+    x0, y0 = function(xs, ys, index, prominence)
+
+    return float(x0), float(y0)
+
+
+def find_valleys(ys, prominence, coarse_factor=None, coarse_tolerance=0.5):
+    """
+    Acha os vales (mínimos) com proeminência mínima, como o
+    sg.find_peaks(-ys, prominence=prominence). Se o coarse_factor for
+    passado, a busca é feita em duas resoluções: primeiro em uma versão
+    reduzida do espectro (mínimo de cada bloco de coarse_factor pontos), que
+    acha os candidatos, e depois a posição e a proeminência de cada candidato
+    são calculadas na resolução completa. O resultado é o mesmo da busca
+    completa, a não ser que dois vales proeminentes fiquem no mesmo bloco,
+    ou que um bloco tenha um vale mas o seu mínimo seja a borda do espectro
+    (o primeiro ou o último ponto, que não são vales)
+
+    :param ys: As potências
+    :type ys: np.ndarray
+
+    :param prominence: A proeminência mínima dos vales
+    :type prominence: float
+
+    :param coarse_factor: Quantos pontos juntar em cada bloco da busca
+        grosseira. Se for None (ou 1), faz só a busca completa
+    :type coarse_factor: int
+
+    :param coarse_tolerance: A fração da proeminência usada na busca
+        grosseira. A redução diminui um pouco a proeminência aparente, então
+        o limite é relaxado para não perder candidatos
+    :type coarse_tolerance: float
+
+    :return: Os índices dos vales e um dicionário com 'prominences',
+        'left_bases' e 'right_bases', como no find_peaks
+    :rtype: (np.ndarray, dict)
+    """
+    if not coarse_factor or coarse_factor <= 1 or \
+            len(ys) < 4 * coarse_factor:
+        return sg.find_peaks(-ys, prominence=prominence)
+
+    n = len(ys)
+    blocks = -(-n // coarse_factor)
+    padded = np.pad(ys, (0, blocks * coarse_factor - n), mode='edge')
+    padded = padded.reshape(blocks, coarse_factor)
+
+    # O find_peaks não retorna as pontas, então a versão reduzida ganha um
+    # ponto mais baixo (no -ys) em cada lado, para os blocos das bordas
+    # também terem candidatos
+    coarse = -padded.min(axis=1)
+    edge = coarse.min() - 1
+    candidates, _ = sg.find_peaks(np.concatenate(([edge], coarse, [edge])),
+                                  prominence=prominence * coarse_tolerance)
+    candidates -= 1
+
+    peaks = candidates * coarse_factor + padded[candidates].argmin(axis=1)
+    peaks = peaks[(peaks > 0) & (peaks < n - 1)]
+
+    prominences, left_bases, right_bases = sg.peak_prominences(-ys, peaks)
+    keep = prominences >= prominence
+
+    return peaks[keep], {'prominences': prominences[keep],
+                         'left_bases': left_bases[keep],
+                         'right_bases': right_bases[keep]}
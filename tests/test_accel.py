@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+
+from process_spectra.utils import accel
+
+# No CI com o extra accel o numba é obrigatório, para esses testes não serem
+# pulados sem ninguém ver
+if not os.environ.get('PROCESS_SPECTRA_REQUIRE_NUMBA'):
+    pytest.importorskip('numba')
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.mark.parametrize('name, params', [
+    ('lorentz', (-15., 1550., 3., -40.)),
+    ('gauss', (-15., 1550., 1.3, -40.))])
+def test_model_parity(name, params):
+    x = np.linspace(1500, 1600, 2001)
+
+    expected = accel.kernel(name, 'numpy')(x, *params)
+    result = accel.kernel(name, 'numba')(x, *params)
+
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_fbg_reflectance_parity():
+    wls = np.linspace(1549e-9, 1551e-9, 2001)
+
+    expected = accel.kernel('fbg_reflectance', 'numpy')(1550e-9, 0.2e-9, wls)
+    result = accel.kernel('fbg_reflectance', 'numba')(1550e-9, 0.2e-9, wls)
+
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-15)
+
+
+def test_fbg_powers_parity(rng):
+    wls = np.linspace(1549e-9, 1551e-9, 2001)
+    weights = rng.uniform(0, 1e-15, len(wls))
+    wl_braggs = 1550e-9 + rng.uniform(-0.1e-9, 0.1e-9, 50)
+
+    expected = accel.fbg_powers(wl_braggs, 0.2e-9, wls, weights, 'numpy')
+    result = accel.fbg_powers(wl_braggs, 0.2e-9, wls, weights, 'numba')
+
+    np.testing.assert_allclose(result, expected, rtol=1e-10)
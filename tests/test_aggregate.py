@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from process_spectra.aggregate import OnlineAggregator
+
+
+def rows(with_time=True):
+    rng = np.random.default_rng(0)
+    start = datetime(2022, 12, 13)
+    for i in range(200):
+        row = {'name': str(i), 'resonant_wl': 1550 + 0.5 * i +
+               rng.normal(0, 1), 'max_power': -30 + rng.normal(0, .1)}
+        if with_time:
+            row['timestamp'] = start + timedelta(seconds=i)
+        yield row
+
+
+def aggregator():
+    return OnlineAggregator(histograms={'max_power': [-31, -30, -29]})
+
+
+def test_merged_shards_match_single_pass():
+    single, first, second = aggregator(), aggregator(), aggregator()
+    for i, row in enumerate(rows()):
+        single(row)
+        (first if i % 3 else second)(row)
+
+    merged = first.merge(second).snapshot()
+    expected = single.snapshot()
+
+    assert merged['count'].tolist() == expected['count'].tolist()
+    for column in ['mean', 'var', 'min', 'max', 'drift_slope']:
+        np.testing.assert_allclose(merged[column], expected[column],
+                                   rtol=1e-9)
+    assert expected.loc['resonant_wl', 'drift_slope'] == \
+        pytest.approx(0.5, abs=0.01)
+
+    for a, b in zip(first.histogram('max_power'),
+                    single.histogram('max_power')):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_matches_numpy():
+    aggregator = OnlineAggregator()
+    data = list(rows())
+    for row in data:
+        aggregator(row)
+
+    values = np.array([row['resonant_wl'] for row in data])
+    snapshot = aggregator.snapshot()
+
+    assert snapshot.loc['resonant_wl', 'mean'] == pytest.approx(values.mean())
+    assert snapshot.loc['resonant_wl', 'var'] == \
+        pytest.approx(values.var(ddof=1))
+
+
+def test_no_drift_without_time_column():
+    aggregator = OnlineAggregator()
+    for row in rows(with_time=False):
+        aggregator(row)
+
+    snapshot = aggregator.snapshot()
+
+    assert snapshot.loc['resonant_wl', 'count'] == 200
+    assert np.isnan(snapshot.loc['resonant_wl', 'drift_slope'])
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from process_spectra.benchmark import benchmark, cheapest_estimator, \
+    default_estimators, synthetic_spectra
+
+
+def test_synthetic_spectra_are_reproducible():
+    spectra, centers = synthetic_spectra(5, model='gauss', seed=4)
+    again, again_centers = synthetic_spectra(5, model='gauss', seed=4)
+
+    assert spectra.shape == (5, 2000, 2)
+    np.testing.assert_array_equal(spectra, again)
+    np.testing.assert_array_equal(centers, again_centers)
+    assert ((centers > 1533) & (centers < 1567)).all()
+
+    clean, centers = synthetic_spectra(5, noise=0, seed=4)
+    minima = clean[np.arange(5), np.argmin(clean[..., 1], axis=1), 0]
+    np.testing.assert_allclose(minima, centers, atol=0.025 + 1e-9)
+
+    with pytest.raises(ValueError):
+        synthetic_spectra(1, model='voigt')
+
+
+def test_benchmark_columns_and_accuracy():
+    estimators = {name: default_estimators()[name]
+                  for name in ['grid', 'parabolic', 'lorentz']}
+
+    results = benchmark(estimators, noise_levels=(0.01, ), n_spectra=10,
+                        seed=0)
+
+    assert list(results.columns) == [
+        'noise', 'estimator', 'spectra_per_second', 'bias', 'rms',
+        'max_error', 'failures']
+    rms = results.set_index('estimator')['rms']
+    assert (results['failures'] == 0).all()
+    assert rms['grid'] <= 0.05
+    assert rms['lorentz'] < rms['grid']
+
+
+def test_cheapest_estimator():
+    results = pd.DataFrame({
+        'noise': [0.01, 0.01, 0.01, 0.2, 0.2, 0.2],
+        'estimator': ['grid', 'fit', 'fast', 'grid', 'fit', 'fast'],
+        'spectra_per_second': [1000, 10, 500, 1000, 10, 400],
+        'rms': [0.02, 0.001, 0.004, 0.02, 0.003, 0.006],
+        'failures': [0, 0, 0, 0, 0, 1]})
+
+    assert cheapest_estimator(results, 0.05) == 'grid'
+    assert cheapest_estimator(results, 0.01) == 'fit'
+    assert cheapest_estimator(results, 0.0001) is None
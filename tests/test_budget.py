@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from process_spectra import MassSpectraData
+from process_spectra.funcs import filter_spectrum, find_valley, \
+    get_approximate_valley
+from process_spectra.utils import lorentz
+from process_spectra.utils.budget import BudgetExceeded
+
+
+def load(filename):
+    wl = np.arange(1500, 1600, 0.05)
+    return np.column_stack((wl, lorentz(wl, -15, 1550.3, 3, -40))), \
+        {'name': filename}
+
+
+def run(**step):
+    spectra = MassSpectraData(['a'], load_function=load)
+    spectra.add_step(**step)
+    return next(spectra.iter_results(quiet=True))
+
+
+def test_exhausted_budget_takes_fallback():
+    info = run(step=get_approximate_valley, max_evaluations=1,
+               fallback=find_valley,
+               fallback_kwargs={'prominence': 5, 'quiet': True})
+
+    assert info['get_approximate_valley_path'] == 'fallback'
+    assert info['resonant_wl'] == pytest.approx(1550.3)
+    assert 'fit_fallbacks' not in info
+
+
+def test_budget_is_raised_without_fallback():
+    with pytest.raises(BudgetExceeded):
+        run(step=get_approximate_valley, max_evaluations=1)
+
+
+def test_step_within_budget_is_primary():
+    info = run(step=get_approximate_valley, max_time=60)
+
+    assert info['get_approximate_valley_path'] == 'primary'
+    assert info['fit_fallbacks'] == 0
+    assert info['resonant_wl'] == pytest.approx(1550.3, abs=1e-3)
+
+
+def test_uncooperative_step_is_marked_over_budget():
+    info = run(step=filter_spectrum,
+               kwargs={'window_length': 11, 'polyorder': 2, 'quiet': True},
+               max_time=1e-9)
+
+    assert info['filter_spectrum_path'] == 'over_budget'
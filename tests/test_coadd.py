@@ -0,0 +1,76 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from process_spectra import MassSpectraData
+from process_spectra.funcs.coadd import SpectrumAverager
+from process_spectra.sweep import ParameterSweep
+
+
+WAVELENGTHS = np.linspace(1500, 1600, 11)
+
+
+def load(filename):
+    level = float(filename)
+    return np.column_stack((WAVELENGTHS, WAVELENGTHS * 0 + level)), \
+        {'name': filename}
+
+
+def shift(spectrum, _, k):
+    shifted = spectrum.copy()
+    shifted[::, 1] += k
+    return shifted, {}
+
+
+def coadded(spectra):
+    return [info['power'] for info in spectra.iter_results(quiet=True)]
+
+
+def power(spectrum, _):
+    return spectrum, {'power': spectrum[0, 1]}
+
+
+@pytest.mark.parametrize('mode, expected', [
+    ('mean', [2, 3, 4, 5]),
+    ('median', [2, 3, 4, 5]),
+    ('block', [2, 5]),
+])
+def test_modes_match_direct_average(mode, expected):
+    spectra = MassSpectraData([str(n) for n in range(1, 7)],
+                              load_function=load)
+    spectra.add_step(SpectrumAverager(3, mode=mode).coadd,
+                     {'quiet': True})
+    spectra.add_step(power)
+
+    assert coadded(spectra) == pytest.approx(expected)
+
+
+def test_sweep_branches_have_their_own_window():
+    averager = SpectrumAverager(2)
+    sweep = ParameterSweep(['0', '10'], load_function=load)
+    sweep.add_step(shift, grid={'k': [0, 100]})
+    sweep.add_step(averager.coadd, {'quiet': True})
+    sweep.add_step(power)
+
+    rows = [row for filename in sweep.filenames
+            for row in sweep.process_file(filename) if 'power' in row]
+
+    # Sem buffers separados, o segundo arquivo faria a média com o ramo
+    # k=100 do primeiro
+    assert {row['shift.k']: row['power'] for row in rows} == \
+        pytest.approx({0: 5, 100: 105})
+
+
+def test_aiter_results_rejects_stateful_steps():
+    spectra = MassSpectraData(['1', '2'], load_function=load)
+    spectra.add_step(SpectrumAverager(2).coadd, {'quiet': True})
+
+    async def collect(concurrency):
+        return [info async for info in spectra.aiter_results(
+            concurrency=concurrency, quiet=True)]
+
+    with pytest.raises(ValueError):
+        asyncio.run(collect(2))
+
+    assert len(asyncio.run(collect(1))) == 1
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from process_spectra.funcs import _context, find_valley, \
+    get_approximate_valley
+
+
+@pytest.fixture
+def spectrum():
+    wl = np.arange(1500, 1600, 0.05)
+    return np.column_stack((wl, -40 - 15 / (1 + ((wl - 1550.3) / 1.5) ** 2)))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = list()
+    find_valleys = _context.find_valleys
+
+    def counted(*args):
+        calls.append(args)
+        return find_valleys(*args)
+
+    monkeypatch.setattr(_context, 'find_valleys', counted)
+    return calls
+
+
+def test_steps_share_valleys(spectrum, calls):
+    with _context.spectrum_context():
+        _, info = find_valley(spectrum, {}, quiet=True)
+        _, approx = get_approximate_valley(spectrum, {},
+                                           approx_func='parabolic')
+
+    assert len(calls) == 1
+    assert approx['valley_count'] == 1
+    assert abs(approx['resonant_wl'] - info['resonant_wl']) < 0.05
+
+
+def test_in_place_change_invalidates_cache(spectrum, calls):
+    with _context.spectrum_context():
+        _, before = find_valley(spectrum, {}, quiet=True)
+        spectrum[::, 1] = spectrum[::-1, 1]
+        _, after = find_valley(spectrum, {}, quiet=True)
+
+    assert len(calls) == 2
+    assert after['resonant_wl'] == pytest.approx(
+        spectrum[0, 0] + spectrum[-1, 0] - before['resonant_wl'])
+
+
+def test_without_context(spectrum, calls):
+    find_valley(spectrum, {}, quiet=True)
+    find_valley(spectrum, {}, quiet=True)
+
+    assert len(calls) == 2
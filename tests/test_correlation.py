@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from process_spectra.utils import lorentz
+from process_spectra.utils.correlation import cross_correlation_shift
+
+
+STEP = 0.05
+
+
+def valley(center):
+    wl = np.arange(1500, 1600, STEP)
+    return lorentz(wl, -15, center, 3, -40)
+
+
+@pytest.mark.parametrize('shift', [-3.3, -0.02, 0, 0.125, 2.5])
+def test_shift_without_limit(shift):
+    reference = valley(1550)
+
+    result = cross_correlation_shift(valley(1550 + shift), reference, STEP)
+
+    assert result == pytest.approx(shift, abs=0.01)
+
+
+def test_shift_within_limit():
+    result = cross_correlation_shift(valley(1550.3), valley(1550), STEP,
+                                     max_shift=1)
+
+    assert result == pytest.approx(0.3, abs=0.01)
+
+
+def test_shift_beyond_limit_is_nan():
+    # 2.5 amostras com uma janela de 1 amostra
+    result = cross_correlation_shift(valley(1550 + 2.5 * STEP), valley(1550),
+                                     STEP, max_shift=STEP)
+
+    assert np.isnan(result)
+
+
+def test_batch_flags_only_rows_beyond_limit():
+    reference = valley(1550)
+    spectra = np.array([valley(1550.1), valley(1552), valley(1549.8)])
+
+    result = cross_correlation_shift(spectra, reference, STEP, max_shift=1)
+
+    assert result[0] == pytest.approx(0.1, abs=0.01)
+    assert np.isnan(result[1])
+    assert result[2] == pytest.approx(-0.2, abs=0.01)
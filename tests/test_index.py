@@ -0,0 +1,52 @@
+import os
+
+from process_spectra import index as index_module
+from process_spectra.index import SpectraIndex
+
+
+NAMES = ['20230503_13_57_44_600.txt', '20230503_13_58_00_000.txt',
+         '20230503_14_00_00_000.txt', 'notes.txt']
+
+
+def make_folder(path):
+    for name in NAMES:
+        (path / name).write_text('1;2\n')
+    return path
+
+
+def test_update_reads_only_changed_files(tmp_path, monkeypatch):
+    folder = make_folder(tmp_path)
+    assert SpectraIndex(str(folder)).update() == 0
+
+    parsed = list()
+    parse_timestamp = index_module.parse_timestamp
+
+    def counting(filename, fmt):
+        parsed.append(filename)
+        return parse_timestamp(filename, fmt)
+
+    monkeypatch.setattr(index_module, 'parse_timestamp', counting)
+
+    # Um índice novo lê o que foi salvo na pasta
+    spectra_index = SpectraIndex(str(folder))
+    assert parsed == []
+    assert len(spectra_index) == 4
+
+    (folder / NAMES[1]).write_text('1;2\n3;4\n')
+    os.remove(folder / NAMES[2])
+
+    assert spectra_index.update() == 1
+    assert parsed == [NAMES[1]]
+    assert len(spectra_index) == 3
+
+
+def test_select_is_half_open(tmp_path):
+    spectra_index = SpectraIndex(str(make_folder(tmp_path)))
+
+    names = [os.path.basename(x) for x in spectra_index.filenames(
+        '2023-05-03 13:57:44.600', '2023-05-03 14:00')]
+    assert names == NAMES[:2]
+
+    assert len(spectra_index.select(end='2023-05-03 13:57:44.600')) == 0
+    # O arquivo sem instante no nome não entra na seleção
+    assert len(spectra_index.select()) == 3
@@ -0,0 +1,76 @@
+import io
+import threading
+
+import numpy as np
+
+from process_spectra.interrogation import InterrogationEngine, RingBuffer, \
+    encode_frame, read_frame, simulate_feed
+
+
+def test_read_frame_is_writable():
+    spectrum = np.column_stack((np.linspace(1500, 1600, 5), np.zeros(5)))
+    stream = io.BytesIO(encode_frame(spectrum, 7, timestamp=1.5))
+
+    sequence, timestamp, result = read_frame(stream)
+    result[0, 1] = 1
+
+    assert (sequence, timestamp) == (7, 1.5)
+    np.testing.assert_array_equal(result[1:], spectrum[1:])
+    assert read_frame(stream) is None
+
+
+def test_ring_buffer_drops_oldest():
+    buffer = RingBuffer(2, policy='drop')
+    for i in range(5):
+        assert buffer.put(i)
+
+    assert buffer.dropped == 3
+    assert [buffer.get(), buffer.get()] == [3, 4]
+    assert buffer.get(timeout=0) is None
+
+
+def test_ring_buffer_blocks_until_space():
+    buffer = RingBuffer(1, policy='block')
+    buffer.put(0)
+
+    done = threading.Event()
+
+    def put():
+        buffer.put(1)
+        done.set()
+
+    thread = threading.Thread(target=put, daemon=True)
+    thread.start()
+    assert not done.wait(0.1)
+
+    assert buffer.get() == 0
+    assert done.wait(1)
+    assert buffer.get() == 1
+    assert buffer.dropped == 0
+
+    buffer.close()
+    assert not buffer.put(2)
+    assert buffer.get() is None
+
+
+def test_engine_counts_every_frame():
+    stream = io.BytesIO()
+    simulate_feed(stream, 20, rate=None, seed=0)
+    stream.seek(0)
+
+    engine = InterrogationEngine(capacity=64)
+    engine.start(stream)
+    engine.join(5)
+
+    stats = engine.stats()
+    assert stats['received'] == stats['processed'] == 20
+    assert stats['dropped'] == stats['errors'] == 0
+
+
+def test_stop_before_connection():
+    engine = InterrogationEngine()
+    engine.serve()
+    engine.stop()
+    engine.join(2)
+
+    assert not any(thread.is_alive() for thread in engine._threads)
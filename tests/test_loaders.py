@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from process_spectra.funcs import load_spectrum, sniff_format
+
+
+@pytest.mark.parametrize('content, expected', [
+    # optisystem
+    ('1549.5;-30.1\n1549.6;-30.2\n', (';', False, 2, 0)),
+    ('1549,5;-30,1\n1549,6;-30,2\n', (';', True, 2, 0)),
+    # tabulação, com vírgula decimal e cabeçalho
+    ('wl\tpower\n1549,5\t-30,1\n1549,6\t-30,2\n', ('\t', True, 2, 1)),
+    # csv
+    ('wl,power\n1549.5,-30.1\n1549.6,-30.2\n', (',', False, 2, 1)),
+    # espaços
+    ('1549.5   -30.1\n1549.6   -30.2\n', (' ', False, 2, 0)),
+    # optigrating
+    ('1.5495 0.1 0.2\n1.5496 0.1 0.3\n', (' ', False, 3, 0)),
+    # uma coluna com vírgula decimal
+    ('1549,5\n1549,6\n1549,7\n', (' ', True, 1, 0)),
+    # csv de inteiros
+    ('1549,-30\n1550,-31\n1551,-32\n', (',', False, 2, 0)),
+    ('1549,30\n1550.5,31\n1551,32\n', (',', False, 2, 0)),
+])
+def test_sniff_format(tmp_path, content, expected):
+    path = tmp_path / 'spectrum.txt'
+    path.write_text(content)
+
+    fmt = sniff_format(str(path))
+
+    assert (fmt['delimiter'], fmt['decimal_comma'], fmt['columns'],
+            fmt['skip_rows']) == expected
+
+
+def test_load_spectrum_ignores_kwargs_the_loader_does_not_take(tmp_path):
+    path = tmp_path / 'grating.txt'
+    path.write_text('1.5495 0.1 0\n1.5496 0.01 0\n')
+
+    spectrum, info = load_spectrum(str(path), quiet=True, dtype=np.float32)
+
+    assert info['name'] == 'grating'
+    np.testing.assert_allclose(spectrum, [[1.5495e-6, -10], [1.5496e-6, -20]])
+
+
+def test_load_spectrum_decimal_comma(tmp_path):
+    path = tmp_path / 'spectrum.txt'
+    path.write_text('wl;power\n1549,6;-30,2\n1549,5;-30,1\n')
+
+    spectrum, _ = load_spectrum(str(path), quiet=True, dtype=np.float32)
+
+    assert spectrum.dtype == np.float32
+    np.testing.assert_allclose(spectrum, [[1549.5, -30.1], [1549.6, -30.2]],
+                               rtol=1e-6)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from process_spectra.funcs.piezo_fbg import harmonic_transform, \
+    noise_ensemble, simulate_piezo_fbg, simulate_piezo_fbg_grid, \
+    summarize_ensemble
+
+
+@pytest.fixture
+def spectrum():
+    wls = np.linspace(1549e-9, 1551e-9, 2001)
+    return np.column_stack(
+        (wls, -30 - 5 * np.exp(-((wls - 1550e-9) / 0.5e-9) ** 2)))
+
+
+@pytest.mark.parametrize('sensitivity', [6.475e-12, -6.475e-12])
+def test_lookup_matches_direct(spectrum, sensitivity):
+    kwargs = dict(frequency=1000, amplitude=10, fbg_wl_bragg=1550.05e-9,
+                  fbg_fwhm=0.2e-9, sensitivity=sensitivity, quiet=True)
+
+    _, direct = simulate_piezo_fbg(spectrum, {}, **kwargs)
+    _, lookup = simulate_piezo_fbg(spectrum, {}, lookup=True, **kwargs)
+
+    assert direct['fbg_harmonic1_mag'] > 0
+    for i in range(3):
+        mag = f'fbg_harmonic{i}_mag'
+        assert lookup[mag] == pytest.approx(direct[mag], rel=1e-5)
+
+    phase = np.deg2rad(direct['fbg_harmonic1_phase'] -
+                       lookup['fbg_harmonic1_phase'])
+    assert abs(np.angle(np.exp(1j * phase))) < 1e-3
+
+
+def test_grid_matches_point_simulation(spectrum):
+    grid = dict(frequency=[1000, 2000], amplitude=[5, 10],
+                fbg_wl_bragg=[1549.9e-9, 1550.05e-9], fbg_fwhm=0.2e-9)
+
+    df = simulate_piezo_fbg_grid(spectrum, **grid)
+
+    assert len(df) == 2 * 2 * 2 * 3
+    for (frequency, amplitude, wl_bragg), rows in df.groupby(
+            ['frequency', 'amplitude', 'fbg_wl_bragg']):
+        _, expected = simulate_piezo_fbg(
+            spectrum, {}, frequency, amplitude, wl_bragg, 0.2e-9, quiet=True)
+
+        rows = rows.set_index('harmonic')
+        for i in range(3):
+            assert rows.at[i, 'mag'] == \
+                pytest.approx(expected[f'fbg_harmonic{i}_mag'], rel=1e-9)
+
+        phase = np.deg2rad(rows.at[1, 'phase'] -
+                           expected['fbg_harmonic1_phase'])
+        assert abs(np.angle(np.exp(1j * phase))) < 1e-6
+
+
+def test_noise_ensemble_is_reproducible():
+    time = np.arange(0, 4e-3, 1 / 6000)
+    powers = 1e-6 * (1 + 0.1 * np.sin(2 * np.pi * 1000 * time))
+
+    def ensemble(seed):
+        return noise_ensemble(powers, 6000, 1000, 1e-8, 200, seed=seed)
+
+    first = ensemble(1)
+    assert first.shape == (200 * 3, 4)
+    pd.testing.assert_frame_equal(first, ensemble(1))
+    assert not first.equals(ensemble(2))
+
+    summary = summarize_ensemble(first)
+    noiseless = np.abs(harmonic_transform(powers, 6000, 1000))
+    np.testing.assert_allclose(summary['mag'][:2], noiseless[:2], rtol=1e-2)
+    assert (summary['mag_std'] > 0).all()
+
+
+def test_simulation_ensemble_is_reproducible(spectrum):
+    kwargs = dict(frequency=1000, amplitude=10, fbg_wl_bragg=1550.05e-9,
+                  fbg_fwhm=0.2e-9, electrical_noise=1e-9, n_realizations=50,
+                  quiet=True)
+
+    _, first = simulate_piezo_fbg(spectrum, {}, seed=3, **kwargs)
+    _, second = simulate_piezo_fbg(spectrum, {}, seed=3, **kwargs)
+
+    assert first == second
+    assert 'fbg_harmonic1_mag_std' in first
@@ -0,0 +1,82 @@
+import asyncio
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from process_spectra import MassSpectraData
+from process_spectra.funcs import channel_alive, get_max_power, guard_step
+
+
+def load(filename):
+    level = float(filename)
+    wl = np.linspace(1500, 1600, 101)
+    return np.column_stack((wl, np.full(len(wl), level))), {'name': filename}
+
+
+def pipeline():
+    spectra = MassSpectraData(['-30', '-90', '-50'], load_function=load)
+    spectra.add_guard(channel_alive, {'min_power': -80})
+    spectra.add_step(get_max_power)
+    return spectra
+
+
+def test_guard_step_pickles():
+    guard = pickle.loads(pickle.dumps(guard_step(channel_alive)))
+    spectrum, _ = load('-90')
+
+    assert guard.__name__ == 'guard_channel_alive'
+    assert guard(spectrum, {}) == (None, {'rejected': 'channel_alive'})
+
+
+def test_aiter_results_with_process_pool():
+    spectra = pipeline()
+
+    async def collect():
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            return [info async for info in spectra.aiter_results(
+                concurrency=2, executor=executor, quiet=True)]
+
+    results = {info['name']: info for info in asyncio.run(collect())}
+
+    assert results['-90']['rejected'] == 'channel_alive'
+    assert 'max_power' not in results['-90']
+    assert results['-30']['max_power'] == -30
+    assert results['-50']['max_power'] == -50
+
+
+def test_rejected_rows_lack_downstream_columns():
+    spectra = pipeline()
+
+    rows = {info['name']: info for info in spectra.iter_results(quiet=True)}
+    assert set(rows['-90']) == {'name', 'rejected'}
+    assert 'rejected' not in rows['-30']
+
+    spectra.run(quiet=True)
+    df = spectra.df.set_index('name')
+    assert np.isnan(df.loc['-90', 'max_power'])
+    assert df.loc['-30', 'max_power'] == -30
+
+
+def test_iter_results_is_lazy():
+    loaded = list()
+
+    def counting_load(filename):
+        loaded.append(filename)
+        return load(filename)
+
+    spectra = MassSpectraData([str(-k) for k in range(10, 100, 10)],
+                              load_function=counting_load)
+    spectra.add_step(get_max_power)
+    sunk = list()
+    spectra.add_sink(sunk.append)
+
+    results = spectra.iter_results(return_spectrum=True, quiet=True)
+    assert loaded == []
+
+    first = list(islice(results, 2))
+    assert loaded == ['-10', '-20']
+    assert sunk == [info for info, _ in first]
+    assert first[1][1].shape == (101, 2)
+    assert len(spectra.df) == 0
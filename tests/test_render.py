@@ -0,0 +1,32 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from process_spectra.funcs.render import SpectrumRenderer
+
+
+def test_plot_spectrum_from_many_threads(tmp_path):
+    wl = np.linspace(1500, 1600, 101)
+    spectra = [(np.column_stack((wl, np.full(len(wl), -k))),
+                {'name': str(k), 'resonant_wl': 1550,
+                 'resonant_wl_power': -k}) for k in range(40)]
+
+    renderer = SpectrumRenderer(save_folder=str(tmp_path),
+                                out_filename=str(tmp_path / 'all.png'),
+                                executor='thread', workers=2, max_pending=4)
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda x: renderer.plot_spectrum(*x, quiet=True),
+                          spectra))
+
+    assert len(renderer._traces) == len(renderer._markers) == 40
+    renderer.close()
+
+    assert (tmp_path / 'all.png').exists()
+    assert len(list(tmp_path.glob('_*.png'))) == 40
+
+
+def test_renderer_is_not_sent_to_other_processes():
+    with pytest.raises(TypeError):
+        pickle.dumps(SpectrumRenderer())
@@ -0,0 +1,61 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from process_spectra.utils.samples import SampleStore
+
+
+def append(store, name, samples):
+    store.append(name, samples)
+
+
+def test_append_and_read(tmp_path):
+    store = SampleStore(str(tmp_path))
+    samples = np.arange(12.).reshape(3, 4)
+
+    store.append('a', samples)
+    store.append('empty', np.empty((0, 4)))
+
+    np.testing.assert_array_equal(store['a'], samples)
+    assert store['empty'].shape == (0, 4)
+    assert 'a' in store and 'b' not in store
+    with pytest.raises(KeyError):
+        store['b']
+
+
+def test_append_same_name_reads_latest(tmp_path):
+    store = SampleStore(str(tmp_path))
+
+    store.append('a', np.zeros(3))
+    np.testing.assert_array_equal(store['a'], np.zeros(3))
+    store.append('a', np.ones(5))
+
+    np.testing.assert_array_equal(store['a'], np.ones(5))
+    assert store.names() == ['a']
+
+
+def test_sees_appends_from_other_processes(tmp_path):
+    store = SampleStore(str(tmp_path))
+    store.append('a', np.zeros(2))
+    assert store.names() == ['a']
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        list(executor.map(append, [store] * 2, ['b', 'c'],
+                          [np.full(2, 1.), np.full(2, 2.)]))
+
+    assert sorted(store.names()) == ['a', 'b', 'c']
+    assert len(store) == 3
+    np.testing.assert_array_equal(store['c'], [2., 2.])
+
+
+def test_pickle_keeps_only_the_path(tmp_path):
+    store = SampleStore(str(tmp_path))
+    store.append('a', np.arange(3.))
+
+    assert store.__getstate__() == str(tmp_path)
+
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.path == store.path
+    np.testing.assert_array_equal(copy['a'], np.arange(3.))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from scipy import signal as sg
+
+from process_spectra.utils.savgol import savgol_filter, savgol_kernels
+
+
+@pytest.fixture
+def ys():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 10, 501)
+    return np.sin(x) + rng.normal(0, 0.1, (3, len(x)))
+
+
+@pytest.mark.parametrize('method', ['direct', 'fft'])
+@pytest.mark.parametrize('window_length, polyorder, deriv', [
+    (5, 2, 0), (11, 3, 0), (11, 3, 1), (151, 4, 2)])
+def test_matches_scipy(ys, method, window_length, polyorder, deriv):
+    expected = sg.savgol_filter(ys, window_length, polyorder, deriv=deriv,
+                                delta=0.02, mode='interp')
+    result = savgol_filter(ys, window_length, polyorder, deriv=deriv,
+                           delta=0.02, method=method)
+
+    np.testing.assert_allclose(result, expected, rtol=1e-8, atol=1e-8)
+    np.testing.assert_allclose(
+        savgol_filter(ys[0], window_length, polyorder, deriv=deriv,
+                      delta=0.02, method=method), expected[0],
+        rtol=1e-8, atol=1e-8)
+
+
+def test_kernels_are_cached_and_read_only():
+    kernels = savgol_kernels(7, 2)
+
+    assert savgol_kernels(7, 2) is kernels
+    assert not any(array.flags.writeable for array in kernels)
+
+
+@pytest.mark.parametrize('args', [(6, 2), (5, 5)])
+def test_invalid_window(args):
+    with pytest.raises(ValueError):
+        savgol_kernels(*args)
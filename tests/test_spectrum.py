@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from process_spectra.funcs import simulate_gain
+from process_spectra.funcs.coadd import SpectrumAverager
+from process_spectra.utils import get_power
+from process_spectra.utils.references import ReferenceRegistry
+from process_spectra.utils.spectrum import Spectrum, WavelengthGrid
+
+
+@pytest.fixture
+def spectrum():
+    wl = np.linspace(1500, 1600, 201)
+    return np.column_stack((wl, -40 + np.sin(wl)))
+
+
+@pytest.fixture
+def perturbed(spectrum):
+    other = spectrum.copy()
+    other[37, 0] += 0.01
+    return other
+
+
+def test_matches_compares_interior_points(spectrum, perturbed):
+    grid = WavelengthGrid.of(spectrum[::, 0])
+
+    assert grid.matches(spectrum[::, 0])
+    assert grid.matches(Spectrum.from_array(spectrum))
+    assert not grid.matches(perturbed[::, 0])
+    assert not grid.matches(Spectrum.from_array(perturbed))
+
+
+def test_simulate_gain_rejects_other_grid(spectrum, perturbed):
+    with ReferenceRegistry(shared=False) as registry:
+        reference = registry.register('led', spectrum, 'dB')
+
+        simulate_gain(spectrum, {}, reference)
+        with pytest.raises(ValueError):
+            simulate_gain(perturbed, {}, reference)
+
+
+def test_coadd_rejects_other_grid(spectrum, perturbed):
+    averager = SpectrumAverager(window=2)
+    averager.coadd(spectrum, {'name': 'a'}, quiet=True)
+
+    with pytest.raises(ValueError):
+        averager.coadd(perturbed, {'name': 'b'}, quiet=True)
+
+
+def test_interpolated_spectrum_grid_check_is_identity(spectrum, monkeypatch):
+    from process_spectra.funcs import _context, interpolate_spectrum
+
+    with ReferenceRegistry(shared=False) as registry:
+        kwargs = {'wl_step': 0.25, 'wl_limits': (1510, 1590), 'quiet': True}
+        led, _ = interpolate_spectrum(spectrum, {}, **kwargs)
+        reference = registry.register('led', led, 'dB')
+        reference.spectrum
+
+        lookups = list()
+        lookup = WavelengthGrid._lookup.__func__
+        monkeypatch.setattr(
+            WavelengthGrid, '_lookup',
+            classmethod(lambda cls, values: lookups.append(1) or
+                        lookup(cls, values)))
+
+        with _context.spectrum_context():
+            interpolated, _ = interpolate_spectrum(spectrum, {}, **kwargs)
+            gain, _ = simulate_gain(interpolated, {}, reference)
+
+        assert lookups == []
+        np.testing.assert_allclose(gain[::, 1], 2 * led[::, 1])
+
+
+@pytest.mark.parametrize('unit, linear_unit, factor', [
+    ('dBm', 'W', 1e-3), ('dB', 'scalar', 1)])
+def test_unit_conversions_are_cached(spectrum, unit, linear_unit, factor):
+    tagged = Spectrum.from_array(spectrum, unit)
+
+    linear = tagged.linear
+    np.testing.assert_allclose(linear, factor * 10 ** (spectrum[::, 1] / 10))
+    assert tagged.linear is linear
+    assert not linear.flags.writeable
+    assert tagged.in_unit(linear_unit) is linear
+    assert tagged.in_unit(unit) is tagged.values
+
+    back = Spectrum(tagged.grid, linear, linear_unit)
+    np.testing.assert_allclose(back.log, spectrum[::, 1])
+    np.testing.assert_array_equal(back.to_array(unit)[::, 0],
+                                  spectrum[::, 0])
+
+    with pytest.raises(ValueError):
+        tagged.in_unit('dBm' if unit == 'dB' else 'dB')
+
+
+def test_power_matches_get_power(spectrum):
+    tagged = Spectrum.from_array(spectrum)
+
+    assert tagged.power() == pytest.approx(
+        get_power(spectrum[::, 1], spectrum[::, 0]), rel=1e-12)
+
+
+def test_invalid_unit_and_size(spectrum):
+    with pytest.raises(ValueError):
+        Spectrum.from_array(spectrum, 'mW')
+    with pytest.raises(ValueError):
+        Spectrum(spectrum[::, 0], spectrum[:-1, 1])
+
+
+def test_equal_grids_are_shared(spectrum):
+    grid = WavelengthGrid.of(spectrum[::, 0])
+
+    assert WavelengthGrid.of(spectrum[::, 0].copy()) is grid
+    assert WavelengthGrid.of(grid) is grid
+    assert Spectrum.from_array(spectrum).grid is grid
+    assert not grid.values.flags.writeable
+    assert grid.is_uniform
+    assert grid.step == pytest.approx(0.5)
+
+
+def test_crop_is_zero_copy(spectrum):
+    tagged = Spectrum.from_array(spectrum)
+    tagged.linear
+
+    cropped = tagged.crop(1520, 1530)
+
+    np.testing.assert_array_equal(cropped.wavelengths,
+                                  np.linspace(1520, 1530, 21))
+    assert np.shares_memory(cropped.wavelengths, tagged.wavelengths)
+    assert np.shares_memory(cropped.values, tagged.values)
+    assert np.shares_memory(cropped.linear, tagged.linear)
+    assert tagged.crop(1520, 1530).grid is cropped.grid
+    assert WavelengthGrid.of(cropped.wavelengths.copy()) is cropped.grid
+    assert tagged.crop(0, 2000).grid is tagged.grid
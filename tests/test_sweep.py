@@ -0,0 +1,51 @@
+import numpy as np
+
+from process_spectra.funcs import guard_step
+from process_spectra.sweep import ParameterSweep
+
+
+def load(filename):
+    wl = np.linspace(1500, 1600, 11)
+    return np.column_stack((wl, -wl)), {'name': filename}
+
+
+def scale(spectrum, _, k):
+    return spectrum, {'scaled': k}
+
+
+def offset(spectrum, _, m):
+    return spectrum, {'offset': m}
+
+
+def k_is_zero(_, info):
+    return info['scaled'] == 0
+
+
+def test_guarded_branch_keeps_full_parameter_set():
+    sweep = ParameterSweep(['a'], load_function=load)
+    sweep.add_step(scale, grid={'k': [0, 1]})
+    sweep.add_step(guard_step(k_is_zero))
+    sweep.add_step(offset, grid={'m': [0, 1, 2]})
+
+    rows = sweep.process_file('a')
+
+    assert sorted(row['parameter_set'] for row in rows) == list(range(6))
+    for row in rows:
+        assert row['parameter_set'] == \
+            row['scale.k'] * 3 + row['offset.m']
+        if row['scale.k'] == 1:
+            assert row['rejected'] == 'k_is_zero'
+            assert 'offset' not in row
+        else:
+            assert row['offset'] == row['offset.m']
+
+
+def test_failed_load_emits_every_parameter_set():
+    sweep = ParameterSweep(['a'], load_function=lambda f: (None,
+                                                           {'name': f}))
+    sweep.add_step(scale, grid={'k': [0, 1]})
+    sweep.add_step(offset, grid={'m': [0, 1, 2]})
+
+    rows = sweep.process_file('a')
+
+    assert sorted(row['parameter_set'] for row in rows) == list(range(6))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy import signal as sg
+
+from process_spectra.utils.valley import estimate_valley, find_valleys
+
+
+@pytest.mark.parametrize('center', [1500.4, 1550.3, 1599.6])
+def test_coarse_search_matches_full_search(center):
+    wl = np.arange(1500, 1600, 0.05)
+    ys = -40 - 15 / (1 + ((wl - center) / 0.2) ** 2)
+
+    expected, properties = sg.find_peaks(-ys, prominence=5)
+    valleys, coarse_properties = find_valleys(ys, 5, coarse_factor=16)
+
+    assert len(expected) == 1
+    np.testing.assert_array_equal(valleys, expected)
+    np.testing.assert_allclose(coarse_properties['prominences'],
+                               properties['prominences'])
+
+
+STEP = 0.05
+CENTER = 1550.013      # entre duas amostras do grid
+
+
+def valley(shape):
+    wl = np.arange(1545, 1555, STEP)
+    if shape == 'gaussian':
+        depth = 15 * np.exp(-(wl - CENTER) ** 2 / (2 * 0.3 ** 2))
+    else:
+        depth = 15 / (1 + ((wl - CENTER) / 0.3) ** 2)
+    return wl, -40 - depth
+
+
+@pytest.mark.parametrize('estimator, shape, tolerance', [
+    ('gaussian', 'gaussian', 1e-9),
+    ('lorentz', 'lorentz', 1e-9),
+    ('parabolic', 'lorentz', 0.05 * STEP),
+    ('parabolic', 'gaussian', 0.05 * STEP),
+    ('centroid', 'lorentz', 0.05 * STEP),
+])
+def test_estimator_accuracy(estimator, shape, tolerance):
+    wl, ys = valley(shape)
+    index = int(np.argmin(ys))
+    prominence = -40 - ys[index]     # como a do find_peaks
+
+    x0, y0 = estimate_valley(wl, ys, index, prominence, estimator)
+
+    assert abs(wl[index] - CENTER) > 0.2 * STEP
+    assert abs(x0 - CENTER) < tolerance
+    if tolerance < 1e-6:
+        assert y0 == pytest.approx(-55)
+
+
+def test_invalid_estimator():
+    wl, ys = valley('lorentz')
+    with pytest.raises(ValueError):
+        estimate_valley(wl, ys, 100, 15, 'cubic')